@@ -0,0 +1,286 @@
+import importlib.util
+import os
+import queue
+import re
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+current_dir = os.path.dirname(os.path.abspath(__file__))
+
+
+def load_script(filename):
+    """Import one of the generator scripts by file name (they have dashes, so no plain import)"""
+    module_name = os.path.splitext(filename)[0].replace('-', '_')
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(current_dir, filename))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def script_text(txt_content):
+    """Plain text of a txt script with the 'Speaker N:' labels dropped"""
+    lines = [re.sub(r'^Speaker\s+\d+:\s*', '', line.strip(), flags=re.IGNORECASE)
+             for line in txt_content.strip().split('\n')]
+    return ' '.join(line for line in lines if line)
+
+
+class TTSBackend:
+    """Common interface for the synthesis engines behind the router.
+
+    A backend loads its model once, registers the reference voices, and turns a queued txt
+    job into wav(s) in its output directory, either as one file (synthesize) or as audio
+    that becomes playable while it is still being generated (stream). The router only
+    needs the cost estimate: seconds of wall time per script character, updated from
+    every finished job.
+    """
+
+    name = "base"
+    max_chars = None
+
+    def __init__(self, seconds_per_char=0.05):
+        self.seconds_per_char = seconds_per_char
+
+    def load(self, job_queue=None):
+        """Load the model; `job_queue` is the queue the jobs come from, for cancellation and deadlines"""
+        raise NotImplementedError
+
+    def register_voices(self):
+        pass
+
+    def synthesize(self, job):
+        raise NotImplementedError
+
+    def stream(self, job):
+        return self.synthesize(job)
+
+    def estimate_seconds(self, chars):
+        return self.seconds_per_char * max(chars, 1)
+
+    def observe(self, chars, seconds):
+        # Exponential moving average so the estimate follows the current load and model
+        self.seconds_per_char = 0.8 * self.seconds_per_char + 0.2 * (seconds / max(chars, 1))
+
+
+class VibeVoiceBackend(TTSBackend):
+    name = "vibevoice"
+
+    def __init__(self, model_path, speaker_names, output_dir, device, cfg_scale=1.3, dtype="float32",
+                 stream_segment_seconds=0, seconds_per_char=0.05, **options):
+        super().__init__(seconds_per_char)
+        self.args = (model_path, speaker_names, output_dir, device, cfg_scale, dtype)
+        self.options = options
+        self.stream_segment_seconds = stream_segment_seconds
+        self.handler = None
+
+    def load(self, job_queue=None):
+        generator = load_script("generator.py")
+        self.handler = generator.TxtFileHandler(*self.args, job_queue=job_queue, **self.options)
+
+    def register_voices(self):
+        self.handler.voice_mapper.setup_voice_presets()
+
+    def synthesize(self, job):
+        self.handler.process_txt_file(job.txt_path, stream_segment_seconds=0)
+
+    def stream(self, job):
+        self.handler.process_txt_file(job.txt_path, stream_segment_seconds=self.stream_segment_seconds)
+
+
+class CosyVoiceBackend(TTSBackend):
+    name = "cosyvoice"
+
+    def __init__(self, model_dir, speaker_names, output_dir, device, write_mode="full",
+                 seconds_per_char=0.03, **options):
+        super().__init__(seconds_per_char)
+        self.args = (model_dir, speaker_names, output_dir, device)
+        self.options = options
+        self.write_mode = write_mode
+        self.handler = None
+
+    def load(self, job_queue=None):
+        cosyvoice = load_script("generator-cosyvoice.py")
+        # The handler indexes voices_cut/ while it loads
+        self.handler = cosyvoice.TxtFileHandler(*self.args, job_queue=job_queue, write_mode=self.write_mode,
+                                                **self.options)
+
+    def register_voices(self):
+        self.handler.voice_mapper.setup_voice_presets()
+        self.handler.register_speakers()
+
+    def synthesize(self, job):
+        self.handler.process_txt_file(job.txt_path, write_mode="full")
+
+    def stream(self, job):
+        write_mode = self.write_mode if self.write_mode != "full" else "segment"
+        self.handler.process_txt_file(job.txt_path, write_mode=write_mode)
+
+
+class EspeakBackend(TTSBackend):
+    """espeak-ng, the same engine robo-commentator.sh uses for comm_txt/. Cheap and CPU only."""
+
+    name = "espeak"
+
+    def __init__(self, output_dir, voice=None, seconds_per_char=0.001):
+        super().__init__(seconds_per_char)
+        self.output_dir = output_dir
+        self.voice = voice
+
+    def load(self, job_queue=None):
+        subprocess.run(['espeak-ng', '--version'], check=True, stdout=subprocess.DEVNULL)
+
+    def synthesize(self, job):
+        with open(job.txt_path, 'r', encoding='utf-8') as f:
+            text = script_text(f.read())
+        if not text:
+            print(f"No text found in {job.txt_path}")
+            return
+        txt_filename = os.path.splitext(job.name)[0]
+        partial_dir = os.path.join(self.output_dir, ".partial")
+        os.makedirs(partial_dir, exist_ok=True)
+        tmp_path = os.path.join(partial_dir, f"{txt_filename}_generated.wav")
+        command = ['espeak-ng', '--stdin', '-w', tmp_path]
+        if self.voice:
+            command += ['-v', self.voice]
+        subprocess.run(command, input=text.encode('utf-8'), check=True)
+        output_path = os.path.join(self.output_dir, f"{txt_filename}_generated.wav")
+        os.replace(tmp_path, output_path)
+        print(f"Generated audio saved to {output_path}")
+
+
+class BackendWorker:
+    """Runs one backend on its own thread with its own small queue and backlog estimate.
+
+    The queue holds at most `max_pending` jobs besides the one being generated, everything
+    else stays in the shared job queue where it is still ordered, shed and expired. A job
+    that was cancelled or went past its deadline while it waited here is dropped unrun.
+    """
+
+    def __init__(self, backend, job_queue, streaming=False, max_pending=1):
+        self.backend = backend
+        self.job_queue = job_queue
+        self.streaming = streaming
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.backlog = 0.0
+        self.lock = threading.Lock()
+        # Notified whenever a job leaves `pending`; the router waits on it for room
+        self.room = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name=f"{backend.name}-worker", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def backlog_seconds(self):
+        with self.lock:
+            return self.backlog
+
+    def has_room(self):
+        return not self.pending.full()
+
+    def submit(self, job, chars):
+        estimate = self.backend.estimate_seconds(chars)
+        with self.lock:
+            self.backlog += estimate
+        self.pending.put((job, chars, estimate))
+
+    def run(self):
+        while True:
+            job, chars, estimate = self.pending.get()
+            with self.room:
+                self.room.notify_all()
+            if job.cancelled.is_set() or self.job_queue.expire_taken(job):
+                with self.lock:
+                    self.backlog = max(0.0, self.backlog - estimate)
+                if job.cancelled.is_set():
+                    print(f"[{self.backend.name}] Skipping cancelled job {job.name}")
+                    self.job_queue.done(job)
+                continue
+            start = time.time()
+            try:
+                if self.streaming:
+                    self.backend.stream(job)
+                else:
+                    self.backend.synthesize(job)
+                self.backend.observe(chars, time.time() - start)
+            except Exception as e:
+                print(f"[{self.backend.name}] Error processing {job.txt_path}: {e}")
+                print(traceback.format_exc())
+            finally:
+                with self.lock:
+                    self.backlog = max(0.0, self.backlog - estimate)
+                self.job_queue.done(job)
+
+
+class Router:
+    """Sends each job from the shared job queue to one of several backends.
+
+    Backends are given best quality first. A job goes to the first backend whose current
+    backlog plus the job's own estimated time fits in the latency budget. If none fits, it
+    goes to whichever backend would finish it soonest, so short or low-priority messages
+    fall through to the cheap engine while the GPU is busy. Low-priority jobs, and jobs the
+    queue flagged as late for their deadline, always take the cheapest backend.
+    """
+
+    def __init__(self, workers, job_queue, latency_budget=30.0):
+        self.workers = workers
+        self.job_queue = job_queue
+        self.latency_budget = latency_budget
+        self.routed = {worker.backend.name: 0 for worker in workers}
+        # One condition for all workers, so the router wakes up when any of them has room
+        self.room = threading.Condition()
+        for worker in workers:
+            worker.room = self.room
+        self.thread = threading.Thread(target=self.run, name="router", daemon=True)
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+        self.thread.start()
+
+    def choose(self, job, chars):
+        eligible = [w for w in self.workers if w.backend.max_chars is None or chars <= w.backend.max_chars]
+        if not eligible:
+            eligible = self.workers
+        if job.priority == 'low' or job.late:
+            return min(eligible, key=lambda w: w.backend.estimate_seconds(chars))
+        predictions = [(w.backlog_seconds() + w.backend.estimate_seconds(chars), w) for w in eligible]
+        for predicted, worker in predictions:
+            if predicted <= self.latency_budget:
+                return worker
+        return min(predictions, key=lambda p: p[0])[1]
+
+    def wait_for_room(self):
+        """Block until at least one worker can take another job"""
+        with self.room:
+            while not any(worker.has_room() for worker in self.workers):
+                self.room.wait(1.0)
+
+    def run(self):
+        while True:
+            # Jobs only leave the shared queue once a backend can take one, so it keeps
+            # applying its size limit, priority/deadline order and expiry to the backlog
+            self.wait_for_room()
+            job = self.job_queue.get()
+            try:
+                with open(job.txt_path, 'r', encoding='utf-8') as f:
+                    chars = len(script_text(f.read()))
+            except OSError as e:
+                print(f"Error reading {job.txt_path}: {e}")
+                self.job_queue.done(job)
+                continue
+            worker = self.choose(job, chars)
+            while not worker.has_room():
+                # The backend this job belongs on is full; wait for a slot and choose again,
+                # since the backlogs have moved by then
+                with self.room:
+                    self.room.wait(1.0)
+                worker = self.choose(job, chars)
+            self.routed[worker.backend.name] += 1
+            print(f"Routing {job.name} ({chars} chars, {job.priority}) to {worker.backend.name}, "
+                  f"backlog {worker.backlog_seconds():.1f}s, queue depth {self.job_queue.depth}")
+            worker.submit(job, chars)
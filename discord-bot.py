@@ -2,6 +2,7 @@ import discord
 from discord.ext import commands, tasks
 import os
 import asyncio
+import queue
 from collections import deque
 import time
 import re
@@ -11,9 +12,12 @@ import threading
 from discord.ext import voice_recv
 from aiohttp import web
 import json
-import signal
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
+from ipc import IPCClient
+from outputformat import read_opus_packets
+import numpy as np
+from pcm import DISCORD_CHANNELS, DISCORD_RATE, FRAME_BYTES, FRAME_SAMPLES, StreamResampler, decode_file, from_s16le, read_discord_wav, to_channels, to_discord, to_s16le
 
 # Create a subfolder for model input
 if not os.path.exists("./txt"):
@@ -32,6 +36,8 @@ BOT_TOKEN = os.environ.get("BOT_TOKEN", "0")
 OUTPUTS_FOLDER = "./outputs"
 THROTTLE_TIME = 30 # seconds
 CHARACTER_LIMIT = 200
+# Generator socket (its --ipc_socket); messages fall back to ./txt whenever it is unreachable
+IPC_SOCKET = os.environ.get("IPC_SOCKET", "")
 
 # Playback settings
 local_playback_bot_enabled = os.environ.get('LOCAL_PLAYBACK_BOT', 'false').lower() in ('true', '1', 't')
@@ -40,18 +46,210 @@ local_playback_channel_enabled = os.environ.get('LOCAL_PLAYBACK_CHANNEL', 'false
 # Mute state management
 is_muted = False
 mute_timer_task = None 
-local_playback_process = None
+ipc_client = None
 # User-specific message queues for throttling
 user_throttles = {}
 
 # --- Playback Control ---
 # Queue for voice playback
 voice_queue = asyncio.Queue()
-# Event to signal that a playback has finished and the next one can start
-playback_finished = asyncio.Event()
+# Event to signal that a clip has finished playing and there is room for the next one
+clip_finished = asyncio.Event()
 # Event to pause the playback worker when muted
 play_allowed = asyncio.Event()
 play_allowed.set() # Set by default to allow playing
+SILENCE_FRAME = bytes(FRAME_BYTES)
+# Decoded clips waiting behind the one that is playing
+PREFETCH_CLIPS = 1
+# What the generators write, see their --output_format
+AUDIO_EXTENSIONS = ('.wav', '.opus')
+
+class GaplessSource(discord.AudioSource):
+    """A single long-lived audio source that plays queued clips back to back.
+
+    Clips are handed over already decoded to 48 kHz stereo s16le, so read() only slices the
+    next 20 ms out of memory, and the frame after the end of one clip carries the start of
+    the next. A clip can also be a list of 20 ms Opus packets (--output_format opus), which
+    are sent one per read as they are and tell discord.py to skip its encoder for those
+    frames; they can't be spliced onto PCM, so a PCM clip's last frame before one is padded
+    with silence instead. A StreamingClip is played as far as its audio has arrived, with
+    silence while it catches up, until it is marked complete. With nothing queued it sends
+    silence for `idle_seconds` and then ends, so the bot doesn't show as speaking forever;
+    play_audio_worker starts the same source again when the next clip comes in.
+    """
+
+    def __init__(self, on_clip_done, on_frame=None, idle_seconds=1.0):
+        self.on_clip_done = on_clip_done
+        self.on_frame = on_frame
+        self.max_idle_frames = int(idle_seconds * 50)
+        self.clips = deque()
+        self.current = None
+        self.offset = 0
+        self.idle_frames = 0
+        self.running = False
+        # Whether the frame read() last returned is Opus, discord.py asks right after each read
+        self.sending_opus = False
+        self.lock = threading.Lock()
+
+    def enqueue(self, pcm, item):
+        """Queue a clip, either 48 kHz stereo s16le bytes or a list of Opus packets"""
+        with self.lock:
+            self.clips.append((pcm, item))
+
+    def extend(self, item, pcm):
+        """Append audio to a StreamingClip, whether or not it is queued yet"""
+        with self.lock:
+            item.pcm += pcm
+
+    def end_stream(self, item, pcm=b'', cut=False):
+        """Mark a StreamingClip complete, dropping what has not been played yet with `cut`"""
+        with self.lock:
+            if cut:
+                del item.pcm[:]
+            else:
+                item.pcm += pcm
+            item.complete = True
+
+    def is_opus(self):
+        return self.sending_opus
+
+    def queued(self):
+        with self.lock:
+            return len(self.clips)
+
+    def has_audio(self):
+        with self.lock:
+            return self.current is not None or bool(self.clips)
+
+    def read(self):
+        # Called by discord.py's player thread every 20 ms
+        finished = []
+        packet = None
+        waiting = False
+        with self.lock:
+            frame = bytearray()
+            while len(frame) < FRAME_BYTES and packet is None:
+                if self.current is None:
+                    if not self.clips or (frame and isinstance(self.clips[0][0], list)):
+                        break
+                    self.current = self.clips.popleft()
+                    self.offset = 0
+                pcm, item = self.current
+                if isinstance(pcm, list):
+                    if self.offset < len(pcm):
+                        packet = pcm[self.offset]
+                        self.offset += 1
+                    if self.offset >= len(pcm):
+                        finished.append(item)
+                        self.current = None
+                    continue
+                chunk = pcm[self.offset:self.offset + FRAME_BYTES - len(frame)]
+                frame += chunk
+                self.offset += len(chunk)
+                if self.offset >= len(pcm):
+                    if not getattr(item, 'complete', True):
+                        # The rest of this stream hasn't arrived yet, pad with silence
+                        waiting = True
+                        break
+                    finished.append(item)
+                    self.current = None
+            self.sending_opus = packet is not None
+            if frame or packet is not None or waiting:
+                self.idle_frames = 0
+            else:
+                self.idle_frames += 1
+                if self.idle_frames > self.max_idle_frames:
+                    self.idle_frames = 0
+                    self.running = False
+                    return b''
+        for item in finished:
+            self.on_clip_done(item)
+        if packet is not None:
+            data = packet
+        else:
+            data = bytes(frame.ljust(FRAME_BYTES, b'\0')) if frame else SILENCE_FRAME
+        if self.on_frame is not None:
+            self.on_frame(data, packet is not None)
+        return data
+
+class LocalMirror:
+    """Plays 20 ms frames on this machine's sound card through one long-running paplay.
+
+    Frames go through a small bounded queue that drops its oldest frame when full, so a
+    stalled local player loses audio instead of holding up the thread feeding it, and
+    catches up once it recovers. Opus frames are decoded on the mirror's thread.
+    """
+
+    def __init__(self, max_frames=50):
+        self.frames = queue.Queue(maxsize=max_frames)
+        self.proc = None
+        self.decoder = None
+        self.closed = False
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.run, name="local-playback", daemon=True)
+        self.thread.start()
+
+    def feed(self, frame, opus=False):
+        while True:
+            try:
+                self.frames.put_nowait((frame, opus))
+                return
+            except queue.Full:
+                try:
+                    self.frames.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def close(self):
+        self.closed = True
+        proc = self.proc
+        if proc is not None and proc.poll() is None:
+            # Also unblocks a write stuck on a stalled paplay
+            proc.kill()
+
+    def run(self):
+        while not self.closed:
+            try:
+                frame, opus = self.frames.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                if opus:
+                    if self.decoder is None:
+                        self.decoder = discord.opus.Decoder()
+                    frame = self.decoder.decode(frame, fec=False)
+                if self.proc is None or self.proc.poll() is not None:
+                    self.proc = subprocess.Popen(['paplay', '--raw', f'--channels={DISCORD_CHANNELS}',
+                                                  f'--rate={DISCORD_RATE}', '--format=s16le'],
+                                                 stdin=subprocess.PIPE, bufsize=0)
+                self.proc.stdin.write(frame)
+            except (OSError, discord.opus.OpusError) as e:
+                if self.closed:
+                    break
+                print(f"Local playback error: {e}")
+                self.proc = None
+                time.sleep(1)
+        if self.proc is not None:
+            if self.proc.poll() is None:
+                self.proc.kill()
+            self.proc.wait()
+
+def mirror_frame(frame, opus):
+    if local_playback_bot_enabled:
+        local_mirror.feed(frame, opus)
+
+def clip_done(item):
+    """GaplessSource callback, hops from the player thread to the event loop"""
+    bot.loop.call_soon_threadsafe(finish_clip, item)
+
+def finish_clip(item):
+    print(f"Playback finished for {clip_label(item)}.")
+    discard_clip(item)
+    clip_finished.set()
+
+local_mirror = LocalMirror()
+playback_source = GaplessSource(clip_done, on_frame=mirror_frame)
 
 # --- Watchdog File System Handler ---
 class AudioFileHandler(FileSystemEventHandler):
@@ -61,16 +259,79 @@ class AudioFileHandler(FileSystemEventHandler):
         self.loop = loop
 
     def on_created(self, event):
-        if not event.is_directory and event.src_path.endswith('.wav'):
+        if not event.is_directory and event.src_path.endswith(AUDIO_EXTENSIONS):
             print(f"Watchdog detected new file: {event.src_path}")
             # Use call_soon_threadsafe because watchdog runs in a separate thread
             self.loop.call_soon_threadsafe(self.queue.put_nowait, event.src_path)
 
+    def on_moved(self, event):
+        # Generators write into a hidden subfolder and rename finished files into place
+        if not event.is_directory and event.dest_path.endswith(AUDIO_EXTENSIONS):
+            print(f"Watchdog detected finished file: {event.dest_path}")
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, event.dest_path)
+
+class StreamingClip:
+    """An IPC job whose audio is still arriving, converted to 48 kHz stereo s16le chunk by chunk"""
+
+    def __init__(self, name, sample_rate, channels):
+        self.name = name
+        self.channels = channels
+        self.resampler = StreamResampler(sample_rate, DISCORD_RATE, channels)
+        self.pcm = bytearray()
+        self.complete = False
+
+    def convert(self, pcm, final=False):
+        if self.resampler.passthrough and self.channels == DISCORD_CHANNELS:
+            return pcm
+        audio = from_s16le(pcm, self.channels)
+        return to_s16le(to_channels(self.resampler.feed(audio, final), DISCORD_CHANNELS))
+
+# IPC jobs whose audio is coming in, by job id; only used on the IPC reader thread
+ipc_streams = {}
+
+def stream_audio(job_id, name, sample_rate, channels, pcm):
+    """IPCClient on_audio callback, runs on its reader thread.
+
+    A job's first chunk queues it like a finished file and the rest are appended to it, so
+    it starts playing while the generator is still working on it.
+    """
+    item = ipc_streams.get(job_id)
+    if item is None:
+        item = ipc_streams[job_id] = StreamingClip(name, sample_rate, channels)
+        print(f"Receiving audio for {name} over IPC")
+        bot.loop.call_soon_threadsafe(voice_queue.put_nowait, item)
+    playback_source.extend(item, item.convert(pcm))
+
+def write_txt_job(job_name, content):
+    """The filesystem handoff: a txt file in ./txt for the generator's watchdog"""
+    filename = f"./txt/{job_name}.txt"
+    with open(filename, "a", encoding="utf-8") as file:
+        file.write(f"{content}\n")
+    return filename
+
+def queue_clip(clip):
+    """IPCClient on_clip callback, runs on its reader thread once a job has ended"""
+    item = ipc_streams.pop(clip.job_id, None)
+    if item is None:
+        if clip.status in ('rejected', 'disconnected') and clip.script:
+            # Not queued, or lost before any audio came back: let the txt path have a go
+            filename = write_txt_job(clip.name, clip.script)
+            print(f"IPC job {clip.name} ended {clip.status} before any audio, wrote it to {filename} instead")
+            return
+        print(f"Generation of {clip.name} ended without audio ({clip.status})")
+        return
+    if clip.status != 'ok':
+        print(f"Generation of {clip.name} ended early ({clip.status}), dropping the rest of it")
+        playback_source.end_stream(item, cut=True)
+        return
+    print(f"Received {clip.duration:.1f}s of audio for {clip.name} over IPC")
+    playback_source.end_stream(item, item.convert(b'', final=True))
+
 # --- Mute and Unmute Core Logic ---
 
 async def _mute():
     """Pauses voice client and local playback, and sets the global muted state."""
-    global is_muted, mute_timer_task, local_playback_process
+    global is_muted, mute_timer_task
     if is_muted:
         return
 
@@ -87,21 +348,14 @@ async def _mute():
     if guild:
         vc = discord.utils.get(bot.voice_clients, guild=guild)
         if vc and vc.is_playing():
+            # The source keeps its position, and local playback stops with it
             vc.pause()
             print("Audio playback paused.")
 
-    # Pause the local playback subprocess
-    if local_playback_process and local_playback_process.poll() is None:
-        try:
-            local_playback_process.send_signal(signal.SIGSTOP)
-            print("Local playback process paused.")
-        except Exception as e:
-            print(f"Error pausing local playback process: {e}")
-
 
 async def _unmute():
     """Resumes voice client and local playback, and clears the global muted state."""
-    global is_muted, mute_timer_task, local_playback_process
+    global is_muted, mute_timer_task
     if not is_muted:
         return
 
@@ -121,14 +375,6 @@ async def _unmute():
             vc.resume()
             print("Audio playback resumed.")
 
-    # Resume the local playback subprocess
-    if local_playback_process and local_playback_process.poll() is None:
-        try:
-            local_playback_process.send_signal(signal.SIGCONT)
-            print("Local playback process resumed.")
-        except Exception as e:
-            print(f"Error resuming local playback process: {e}")
-
 # --- Web API Handlers ---
 
 async def handle_mute(request):
@@ -200,8 +446,11 @@ async def on_ready():
         observer.start()
         print(f"👀 Watchdog is now monitoring the {OUTPUTS_FOLDER} directory.")
 
-        # Set the event initially to allow the first track to play
-        playback_finished.set()
+        if IPC_SOCKET:
+            global ipc_client
+            ipc_client = IPCClient(IPC_SOCKET, queue_clip, on_audio=stream_audio)
+            if not ipc_client.connect():
+                print(f"Generator socket {IPC_SOCKET} not available yet, using ./txt until it is")
 
         # Start background tasks
         check_voice_channel.start()
@@ -276,10 +525,12 @@ async def on_message(message):
             content_to_write = "\n".join(processed_lines)
         else:
             content_to_write = f"Speaker 1: {message.content}"
-        filename = f"./txt/{message.author.name}_{uuid.uuid4().hex[:6]}.txt"
-        with open(filename, "a", encoding="utf-8") as file:
-            file.write(f"{content_to_write}\n")
-        print(f"Logged message from {message.author.name} to {filename}")
+        job_name = f"{message.author.name}_{uuid.uuid4().hex[:6]}"
+        if ipc_client is not None and ipc_client.submit(content_to_write, name=job_name):
+            print(f"Sent message from {message.author.name} to the generator as {job_name}")
+        else:
+            filename = write_txt_job(job_name, content_to_write)
+            print(f"Logged message from {message.author.name} to {filename}")
         
     await bot.process_commands(message)
 
@@ -324,103 +575,121 @@ async def check_voice_channel():
     vc = discord.utils.get(bot.voice_clients, guild=guild)
     if vc and vc.is_connected() and local_playback_channel_enabled and not vc.is_listening():
         start_listening(vc)
+    # Clips that were queued when the connection dropped continue on the new one
+    if vc and vc.is_connected() and playback_source.has_audio() and not is_muted:
+        await ensure_playing(vc)
+
+def clip_label(item):
+    return item.name if isinstance(item, StreamingClip) else os.path.basename(item)
+
+def discard_clip(item):
+    """Delete a played or dropped wav; IPC clips only ever lived in memory"""
+    if isinstance(item, StreamingClip) or not os.path.exists(item):
+        return
+    try:
+        os.remove(item)
+    except OSError as e:
+        print(f"Error deleting file {item}: {e}")
+
+def decode_for_playback(item):
+    """Decode a queued file to 48 kHz stereo s16le (runs in the executor).
+
+    Opus files come back as their list of packets, and pcm48 wavs as their sample bytes,
+    since both are already what gets sent. An IPC clip is already converted as it arrives,
+    its buffer is played as it grows.
+    """
+    if isinstance(item, StreamingClip):
+        return item.pcm
+    if item.endswith('.opus'):
+        return read_opus_packets(item)
+    pcm = read_discord_wav(item)
+    if pcm is not None:
+        return pcm
+    audio, rate = decode_file(item)
+    return to_discord(audio, rate)
+
+def clip_seconds(pcm):
+    # 50 Opus packets or 50 PCM frames per second
+    return len(pcm) / 50 if isinstance(pcm, list) else len(pcm) / (FRAME_BYTES * 50)
+
+def after_playback(error):
+    if error:
+        print(f'Player error: {error}')
+
+async def ensure_playing(vc):
+    """Start the persistent source on vc unless it is already being read (or paused by a mute)"""
+    if vc.is_paused() or (playback_source.running and vc.is_playing()):
+        return
+    # A player that just ran out of clips may still be shutting down; keep trying rather than
+    # leaving the clip queued until the next voice channel check
+    for _ in range(100):
+        if vc.is_paused() or not vc.is_connected():
+            return
+        if not vc.is_playing():
+            playback_source.running = True
+            # discord.py only sets up its encoder if the source says it's PCM when playback starts
+            playback_source.sending_opus = False
+            try:
+                vc.play(playback_source, after=after_playback)
+                return
+            except discord.ClientException as e:
+                # Lost the race with the old player thread
+                print(f"Couldn't start playback yet ({e}), retrying")
+        await asyncio.sleep(0.05)
+    print("Previous player is still running, leaving playback to the voice channel check")
+
+def connected_voice_client():
+    guild = bot.get_guild(GUILD_ID)
+    vc = discord.utils.get(bot.voice_clients, guild=guild)
+    return vc if vc and vc.is_connected() else None
 
 async def play_audio_worker():
-    """A dedicated worker that plays audio from the queue."""
-    global local_playback_process
+    """Decodes queued clips ahead of time and feeds them to the persistent source."""
     await bot.wait_until_ready()
 
     while True:
-        # Get the next file to play. This will block until a file is available.
-        filepath = await voice_queue.get()
+        # Get the next file (or IPC clip) to play. This will block until one is available.
+        item = await voice_queue.get()
+        label = clip_label(item)
 
-        # Now, wait if the bot is muted. This prevents playing a new track after a mute is requested.
-        await play_allowed.wait()
+        # Decoding runs in a thread while the previous clip is still playing
+        try:
+            pcm = await bot.loop.run_in_executor(None, decode_for_playback, item)
+        except Exception as e:
+            print(f"Error decoding {label}: {e}")
+            discard_clip(item)
+            voice_queue.task_done()
+            continue
 
-        # Wait for the previous track to finish before starting a new one.
-        await playback_finished.wait()
+        # Keep at most PREFETCH_CLIPS decoded clips waiting behind the one that is playing
+        while True:
+            clip_finished.clear()
+            if playback_source.queued() < PREFETCH_CLIPS or connected_voice_client() is None:
+                break
+            try:
+                await asyncio.wait_for(clip_finished.wait(), timeout=1.0)
+            except asyncio.TimeoutError:
+                pass
 
-        guild = bot.get_guild(GUILD_ID)
-        vc = discord.utils.get(bot.voice_clients, guild=guild)
+        # Now, wait if the bot is muted. This prevents playing a new track after a mute is requested.
+        await play_allowed.wait()
 
         # Ensure we are in a voice channel
-        if not vc or not vc.is_connected():
-            print(f"Not connected to voice, discarding {os.path.basename(filepath)}")
-            if os.path.exists(filepath):
-                os.remove(filepath)
-            voice_queue.task_done()
+        vc = connected_voice_client()
+        if vc is None:
             # The check_voice_channel task should handle reconnecting.
-            # We must set playback_finished here to allow the worker to process the next item
-            # in case the connection returns. Otherwise, the worker would be stuck.
-            playback_finished.set()
+            print(f"Not connected to voice, discarding {label}")
+            discard_clip(item)
+            voice_queue.task_done()
             continue
 
-        # Clear the event, ready for the new playback
-        playback_finished.clear()
-
-        print(f"Playing audio file: {filepath}")
-
-        discord_finished_event = asyncio.Event()
-
-        def after_playing_callback(error):
-            if error:
-                print(f'Player error: {error}')
-            bot.loop.call_soon_threadsafe(discord_finished_event.set)
-
+        print(f"Queued {label} for playback ({clip_seconds(pcm):.1f}s)")
+        playback_source.enqueue(pcm, item)
         try:
-            # Reset global process handle at the start of a new playback
-            local_playback_process = None
-
-            # Start Discord playback
-            print("Starting Discord playback...")
-            vc.play(discord.FFmpegPCMAudio(filepath), after=after_playing_callback)
-            print("Discord playback started.")
-
-            # Start local playback if enabled
-            if local_playback_bot_enabled:
-                print("Attempting to start local playback with ffplay...")
-                try:
-                    with open(os.devnull, 'w') as devnull:
-                        local_playback_process = subprocess.Popen(
-                            ['ffplay', '-nodisp', '-autoexit', filepath],
-                            stdout=devnull,
-                            stderr=devnull
-                        )
-                    print("ffplay process started.")
-                except Exception as e:
-                    print(f"Error starting ffplay subprocess: {e}")
-
-            # --- Wait for completion ---
-            # 1. Wait for Discord playback to finish
-            await discord_finished_event.wait()
-
-            # 2. Wait for local playback to finish (if it was started)
-            if local_playback_process and local_playback_process.poll() is None:
-                print("Discord playback finished. Waiting for local playback...")
-                # Use an executor to avoid blocking the event loop.
-                await bot.loop.run_in_executor(None, local_playback_process.wait)
-                print("Local playback finished.")
-
+            await ensure_playing(vc)
         except Exception as e:
             print(f"Error during playback: {e}")
-            # Ensure local process is killed if an error occurs
-            if local_playback_process and local_playback_process.poll() is None:
-                print("Killing local playback process due to error.")
-                local_playback_process.kill()
-                local_playback_process.wait()
-        finally:
-            # --- Cleanup ---
-            local_playback_process = None # Clear the global handle
-            print(f"Playback finished for {os.path.basename(filepath)}. Deleting file.")
-            if os.path.exists(filepath):
-                try:
-                    os.remove(filepath)
-                except OSError as e:
-                    print(f"Error deleting file {filepath}: {e}")
-
-            # Signal that the worker is ready for the next track
-            playback_finished.set()
-            voice_queue.task_done()
+        voice_queue.task_done()
 
 # --- Discord Commands ---
 
@@ -444,27 +713,101 @@ async def unmute(ctx):
         await ctx.send("Bot voice playback has been unmuted.")
         print(f"{ctx.author} has unmuted the bot.")
 
+@bot.command(help="Cancels every queued and in-progress voice generation.")
+@commands.has_permissions(stream=True)
+async def cancel(ctx):
+    # The generators watch ./txt and cancel everything when all.cancel shows up there
+    with open("./txt/all.cancel", "w", encoding="utf-8"):
+        pass
+    if ipc_client is not None:
+        ipc_client.cancel_all()
+    await ctx.send("Cancelled all pending voice messages.")
+    print(f"{ctx.author} has cancelled all pending generations.")
+
 # (Your other commands and classes like PaplaySink, start_listening, etc. remain unchanged)
 class PaplaySink(voice_recv.AudioSink):
-    def __init__(self):
-        self.proc = subprocess.Popen(['paplay', '--raw', '--channels=2', '--rate=48000', '--format=s16le'], stdin=subprocess.PIPE)
-        self.queue = asyncio.Queue()
-        self.loop = asyncio.get_event_loop()
-        self.write_task = self.loop.create_task(self._write_to_paplay())
+    """Mixes everyone talking in the voice channel into one stream for the local sound card.
+
+    write() runs on voice_recv's packet thread and only appends the decoded frame to that
+    speaker's jitter buffer, a deque that drops its oldest frame when it is full. Every 20 ms
+    a mixer thread takes one frame from each speaker whose buffer has filled to `depth`
+    frames, sums them in int32 and clips back to s16. A speaker whose buffer runs dry waits
+    for it to refill before being mixed in again. The mix goes to its own LocalMirror, so a
+    lagging paplay drops old frames and nothing touches the event loop.
+    """
+
+    def __init__(self, depth=3, max_frames=25):
+        super().__init__()
+        self.depth = depth
+        self.max_frames = max_frames
+        self.buffers = {}
+        # Speakers whose buffer has filled to `depth` since it last ran dry
+        self.playing = set()
+        self.lock = threading.Lock()
+        self.dropped = 0
+        self.output = LocalMirror(max_frames=10)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="receive-mixer", daemon=True)
+        self.thread.start()
+
     def wants_opus(self): return False
-    def write(self, user, data): self.loop.call_soon_threadsafe(self.queue.put_nowait, data.pcm)
-    async def _write_to_paplay(self):
-        while True:
-            pcm_data = await self.queue.get()
-            if pcm_data is None: break
-            try: self.proc.stdin.write(pcm_data)
-            except: break
+
+    def write(self, user, data):
+        # Packets from users the bot hasn't matched to an ssrc yet are still kept apart
+        key = user.id if user is not None else getattr(getattr(data, 'packet', None), 'ssrc', None)
+        frame = np.frombuffer(data.pcm[:FRAME_BYTES], '<i2')
+        if frame.size < FRAME_SAMPLES * DISCORD_CHANNELS:
+            frame = np.pad(frame, (0, FRAME_SAMPLES * DISCORD_CHANNELS - frame.size))
+        with self.lock:
+            buffer = self.buffers.get(key)
+            if buffer is None:
+                buffer = self.buffers[key] = deque(maxlen=self.max_frames)
+            elif len(buffer) == self.max_frames:
+                self.dropped += 1
+            buffer.append(frame)
+
+    def mix(self):
+        """The next 20 ms of the channel as s16le bytes"""
+        frames = []
+        with self.lock:
+            for key in list(self.buffers):
+                buffer = self.buffers[key]
+                if key not in self.playing:
+                    if len(buffer) < self.depth:
+                        continue
+                    self.playing.add(key)
+                frames.append(buffer.popleft())
+                if not buffer:
+                    del self.buffers[key]
+                    self.playing.discard(key)
+        if not frames:
+            return SILENCE_FRAME
+        if len(frames) == 1:
+            return frames[0].tobytes()
+        mixed = np.sum(frames, axis=0, dtype=np.int32)
+        return np.clip(mixed, -32768, 32767).astype('<i2').tobytes()
+
+    def run(self):
+        next_tick = time.monotonic()
+        while self.running:
+            self.output.feed(self.mix())
+            next_tick += 0.02
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -0.2:
+                # Fell far behind (suspend, overloaded box), carry on from now instead of bursting
+                next_tick = time.monotonic()
+
     def cleanup(self):
-        if self.write_task and not self.write_task.done():
-            self.loop.call_soon_threadsafe(self.queue.put_nowait, None)
-            self.loop.call_soon_threadsafe(self.write_task.cancel)
-        if self.proc.poll() is None: self.proc.kill()
-        self.proc.wait()
+        # Called by voice_recv when listening stops and by stop_listening, so it can run twice
+        if not self.running:
+            return
+        self.running = False
+        self.output.close()
+        dropped = self.dropped + self.output.dropped
+        if dropped:
+            print(f"Dropped {dropped} late frames of voice channel audio")
 
 def start_listening(voice_client):
     sink = PaplaySink()
@@ -1,12 +1,13 @@
 import argparse
+import hashlib
 import os
 import time
 import torch
 import re
 import sys
 import traceback
+from contextlib import nullcontext
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
 
 # Add CosyVoice to path
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -15,6 +16,12 @@ sys.path.append(cosyvoice_dir)
 sys.path.append(os.path.join(cosyvoice_dir, "third_party/Matcha-TTS"))
 
 from cosyvoice.cli.cosyvoice import AutoModel
+from jobqueue import PRIORITIES, IngestHandler, JobQueue, start_workers
+from resultcache import ResultCache
+from offload import IdleOffloader
+from metrics import MetricsRecorder, peak_memory, reset_peak_memory
+from ipc import IPCServer
+from outputformat import EXTENSIONS, OUTPUT_FORMATS, OutputEncoder
 import torchaudio
 import soundfile as sf
 import numpy as np
@@ -139,16 +146,121 @@ def parse_txt_script(txt_content: str):
         
     return segments
 
-class TxtFileHandler(FileSystemEventHandler):
-    def __init__(self, model_dir, speaker_names, output_dir, device):
+def prompt_text_for(ref_text: str) -> str:
+    # For CosyVoice3, ensure the correct prompt structure
+    if '<|endofprompt|>' not in ref_text:
+        return f"You are a helpful assistant.<|endofprompt|>{ref_text}"
+    return ref_text
+
+class SpeakerStore:
+    """On-disk store of zero-shot speaker prompts (embedding + prompt tokens) from add_zero_shot_spk.
+
+    Files are named <speaker>-<wav hash>-<text hash>.pt, so editing a reference wav or its
+    txt produces a new entry and the stale one is removed on the next save.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+
+    @staticmethod
+    def key_for(wav_path, prompt_text):
+        with open(wav_path, 'rb') as f:
+            wav_hash = hashlib.sha256(f.read()).hexdigest()[:16]
+        text_hash = hashlib.sha256(prompt_text.encode('utf-8')).hexdigest()[:16]
+        return f"{wav_hash}-{text_hash}"
+
+    def path_for(self, spk_name, key):
+        return os.path.join(self.store_dir, f"{spk_name}-{key}.pt")
+
+    def load(self, spk_name, key, device):
+        path = self.path_for(spk_name, key)
+        if not os.path.exists(path):
+            return None
+        return torch.load(path, map_location=device)
+
+    def entries_for(self, spk_name):
+        """This speaker's files only, not those of other speakers whose names start with 'spk_name-'"""
+        pattern = re.compile(rf"^{re.escape(spk_name)}-[0-9a-f]{{16}}-[0-9a-f]{{16}}\.pt$")
+        return [os.path.join(self.store_dir, name) for name in os.listdir(self.store_dir) if pattern.match(name)]
+
+    def save(self, spk_name, key, spk_info):
+        for stale in self.entries_for(spk_name):
+            os.remove(stale)
+        cpu_info = {k: v.cpu() if torch.is_tensor(v) else v for k, v in spk_info.items()}
+        path = self.path_for(spk_name, key)
+        torch.save(cpu_info, path + ".tmp")
+        os.replace(path + ".tmp", path)
+
+class AudioBuffer:
+    """Preallocated CPU float32 buffer that streamed chunks are copied into as they arrive.
+
+    Grows by doubling, so a long script costs a handful of reallocations instead of one
+    GPU tensor per chunk kept alive until the end.
+    """
+
+    def __init__(self, sample_rate, initial_seconds=30):
+        self.capacity = int(sample_rate * initial_seconds)
+        self.data = None
+        self.length = 0
+
+    def append(self, chunk):
+        audio = chunk.detach().float().cpu().numpy()
+        if audio.ndim == 1:
+            audio = audio[np.newaxis, :]
+        if self.data is None:
+            self.data = np.zeros((audio.shape[0], self.capacity), dtype=np.float32)
+        n = audio.shape[-1]
+        if self.length + n > self.data.shape[1]:
+            grown = np.zeros((self.data.shape[0], max(self.data.shape[1] * 2, self.length + n)), dtype=np.float32)
+            grown[:, :self.length] = self.data[:, :self.length]
+            self.data = grown
+        self.data[:, self.length:self.length + n] = audio
+        self.length += n
+
+    def view(self):
+        return self.data[:, :self.length]
+
+    def clear(self):
+        self.length = 0
+
+class TxtFileHandler:
+    def __init__(self, model_dir, speaker_names, output_dir, device, job_queue=None, write_mode='full',
+                 spk_store_dir=os.path.join(current_dir, "spk_cache"), result_cache_dir="./result_cache",
+                 result_cache_mb=0, idle_offload_minutes=0, metrics=None, metrics_file=None, output_format='wav',
+                 output_workers=2):
         self.model_dir = model_dir
         self.speaker_names = speaker_names
         self.output_dir = output_dir
         self.device = device
+        self.write_mode = write_mode
+        self.output_format = output_format
+        self.extension = EXTENSIONS[output_format]
+        self.encoder = OutputEncoder(output_format, output_workers) if output_format != 'wav' else None
+        self.result_cache = ResultCache(result_cache_dir, result_cache_mb, self.extension) if result_cache_mb > 0 else None
+        self.job_queue = job_queue if job_queue is not None else JobQueue()
+        # Scripts that came in over the IPC socket, by their virtual txt path
+        self.ipc_jobs = {}
+        self.job_queue.listeners.append(self.release_ipc_job)
         self.model = None
         self.voice_mapper = VoiceMapper()
+        self.spk_store = SpeakerStore(spk_store_dir)
+        self.spk_keys = {}
+        # Reference wav/txt modification times each key was computed from
+        self.spk_sources = {}
+        self.metrics = metrics if metrics is not None else MetricsRecorder(metrics_file)
         self.load_model()
         self.register_speakers()
+        self.offloader = None
+        if idle_offload_minutes > 0:
+            if str(device).startswith("cuda"):
+                inner = self.model.model
+                modules = [getattr(inner, name, None) for name in ('llm', 'flow', 'hift')]
+                self.offloader = IdleOffloader(modules, device, idle_offload_minutes * 60,
+                                               on_offload=[self.drop_speakers])
+                self.offloader.start()
+            else:
+                print(f"Idle offload only applies to cuda devices, keeping the model on {device}")
 
     def load_model(self):
         print(f"Loading CosyVoice model from {self.model_dir}...")
@@ -157,93 +269,355 @@ class TxtFileHandler(FileSystemEventHandler):
         self.model = AutoModel(model_dir=self.model_dir, fp16=True)
         print("Model loaded successfully.")
 
+    @staticmethod
+    def source_mtimes(wav_path):
+        """Modification times of a reference wav and its txt, None for a missing file"""
+        mtimes = []
+        for path in (wav_path, os.path.splitext(wav_path)[0] + ".txt"):
+            try:
+                mtimes.append(os.path.getmtime(path))
+            except OSError:
+                mtimes.append(None)
+        return tuple(mtimes)
+
+    def index_speaker(self, spk_name, wav_path, ref_text):
+        """Store key for a speaker, re-hashed when its wav or txt changed since it was indexed.
+
+        A registered prompt whose source files no longer match is dropped, so the next use
+        registers the speaker again.
+        """
+        mtimes = self.source_mtimes(wav_path)
+        if spk_name in self.spk_keys and self.spk_sources.get(spk_name) == mtimes:
+            return self.spk_keys[spk_name]
+        key = SpeakerStore.key_for(wav_path, prompt_text_for(ref_text))
+        if self.spk_keys.get(spk_name) != key:
+            self.model.frontend.spk2info.pop(spk_name, None)
+        self.spk_keys[spk_name] = key
+        self.spk_sources[spk_name] = mtimes
+        return key
+
     def register_speakers(self):
-        print("Registering speakers...")
+        """Hash every reference voice and load the prompts already in the store.
+
+        Voices without a stored prompt are registered with the model on first use.
+        """
+        print("Indexing speakers...")
+        spk2info = self.model.frontend.spk2info
+        loaded = 0
         for spk_name, wav_path in self.voice_mapper.voice_presets.items():
             _, ref_text = self.voice_mapper.get_voice_info(spk_name)
-            
-            # For CosyVoice3, ensure the correct prompt structure
-            if '<|endofprompt|>' not in ref_text:
-                full_ref_text = f"You are a helpful assistant.<|endofprompt|>{ref_text}"
-            else:
-                full_ref_text = ref_text
-                
-            print(f"Registering {spk_name} with ref_text: '{full_ref_text[:30]}...'")
             try:
-                self.model.add_zero_shot_spk(full_ref_text, wav_path, spk_name)
+                key = self.index_speaker(spk_name, wav_path, ref_text)
+            except OSError as e:
+                print(f"Error reading reference voice {wav_path}: {e}")
+                continue
+            if spk_name in spk2info:
+                continue
+            try:
+                spk_info = self.spk_store.load(spk_name, key, self.model.frontend.device)
             except Exception as e:
-                print(f"Error registering speaker {spk_name}: {e}")
-        print("All speakers registered.")
+                print(f"Error loading stored speaker {spk_name}, it will be registered again: {e}")
+                continue
+            if spk_info is not None:
+                spk2info[spk_name] = spk_info
+                loaded += 1
+        print(f"Indexed {len(self.spk_keys)} speakers, loaded {loaded} from {self.spk_store.store_dir}.")
+
+    def ensure_speaker(self, spk_name):
+        """Register a speaker with the model, from the on-disk store if possible"""
+        spk2info = self.model.frontend.spk2info
+        wav_path, ref_text = self.voice_mapper.get_voice_info(spk_name)
+        key = self.index_speaker(spk_name, wav_path, ref_text)
+        if spk_name in spk2info:
+            return
+        full_ref_text = prompt_text_for(ref_text)
 
-    def on_created(self, event):
-        if event.is_directory or not event.src_path.endswith(".txt"):
+        start = time.time()
+        spk_info = self.spk_store.load(spk_name, key, self.model.frontend.device)
+        if spk_info is not None:
+            spk2info[spk_name] = spk_info
+            print(f"Loaded stored speaker {spk_name} in {time.time() - start:.2f}s")
             return
-        print(f"New text file detected: {event.src_path}")
-        time.sleep(0.5) # Wait for file write
+
+        print(f"Registering {spk_name} with ref_text: '{full_ref_text[:30]}...'")
+        self.model.add_zero_shot_spk(full_ref_text, wav_path, spk_name)
+        self.spk_store.save(spk_name, key, spk2info[spk_name])
+        print(f"Registered and stored speaker {spk_name} in {time.time() - start:.2f}s")
+
+    def drop_speakers(self):
+        # Registered prompts hold device tensors and would pin VRAM while idle; the next use
+        # of each speaker loads it back from the on-disk store
+        spk2info = self.model.frontend.spk2info
+        for spk_name in self.spk_keys:
+            spk2info.pop(spk_name, None)
+
+    def resident(self):
+        """Context for using the model: reloads offloaded weights and holds off the idle offload"""
+        return self.offloader.use() if self.offloader is not None else nullcontext()
+
+    def start_workers(self):
+        start_workers(self.job_queue, self.process_job)
+
+    def process_job(self, job):
+        # Give the writer a moment to finish the file if it was only just queued
+        if job.txt_path not in self.ipc_jobs:
+            time.sleep(max(0.0, 0.5 - (time.time() - job.enqueued)))
+        self.process_txt_file(job.txt_path)
+
+    def ipc_path(self, job_id):
+        return os.path.abspath(os.path.join(self.output_dir, f"ipc_{job_id}.txt"))
+
+    def submit_ipc(self, job_id, script, priority, sink):
+        """Queue a script that came in over the IPC socket; its audio goes to `sink`, not a wav"""
+        txt_path = self.ipc_path(job_id)
+        self.ipc_jobs[txt_path] = (script, sink)
+        if self.job_queue.put(txt_path, priority if priority in PRIORITIES else 'normal', ledger=False):
+            return True
+        self.ipc_jobs.pop(txt_path, None)
+        return False
+
+    def cancel_ipc(self, job_id):
+        self.job_queue.cancel(self.ipc_path(job_id))
+
+    def release_ipc_job(self, job):
+        # Queue listener, tells the client about jobs that were shed, expired or cancelled
+        entry = self.ipc_jobs.pop(job.txt_path, None)
+        if entry is not None:
+            entry[1].end('cancelled' if job.cancelled.is_set() else 'dropped')
+
+    def speaker_name_for(self, seg):
+        # Map speaker number to name
+        try:
+            return self.speaker_names[int(seg['speaker_num']) - 1]
+        except IndexError:
+            return self.speaker_names[0]
+
+    def cache_key_for(self, segments):
+        voices = {}
+        for seg in segments:
+            name = self.speaker_name_for(seg)
+            if name not in voices:
+                wav_path, ref_text = self.voice_mapper.get_voice_info(name)
+                voices[name] = self.index_speaker(name, wav_path, ref_text)
+        return ResultCache.make_key(
+            segments=[(self.speaker_name_for(seg), ' '.join(seg['text'].split())) for seg in segments],
+            voices=voices,
+            model=self.model_dir,
+            fp16=True,
+            # Cached clips are stored already encoded, so each format has its own entries
+            **({'output_format': self.output_format} if self.encoder is not None else {}),
+        )
+
+    def process_txt_file(self, txt_path, write_mode=None):
+        """Generate one txt file; `write_mode` overrides the handler's for this file only"""
+        queued = self.job_queue.job_for(txt_path)
+        metrics = self.metrics.begin(txt_path, queued.enqueued if queued is not None else None)
         try:
-            self.process_txt_file(event.src_path)
-        except Exception as e:
-            print(f"Error processing {event.src_path}: {e}")
-            print(traceback.format_exc())
+            self.serve_txt_file(txt_path, metrics, write_mode or self.write_mode)
+        except Exception:
+            metrics.status = 'failed'
+            raise
+        finally:
+            self.metrics.finish(metrics)
+            ipc_job = self.ipc_jobs.get(os.path.abspath(txt_path))
+            if ipc_job is not None:
+                ipc_job[1].end(metrics.status)
 
-    def process_txt_file(self, txt_path):
-        with open(txt_path, 'r', encoding='utf-8') as file:
-            txt_content = file.read()
+    def serve_txt_file(self, txt_path, metrics, write_mode):
+        ipc_job = self.ipc_jobs.get(os.path.abspath(txt_path))
+        if ipc_job is not None:
+            txt_content = ipc_job[0]
+        else:
+            with open(txt_path, 'r', encoding='utf-8') as file:
+                txt_content = file.read()
+        metrics.mark('read')
 
         segments = parse_txt_script(txt_content)
+        metrics.mark('parsed')
         if not segments:
             print(f"No valid segments found in {txt_path}")
+            metrics.status = 'empty'
             return
 
-        generated_wavs = []
-        
-        for i, seg in enumerate(segments):
-            speaker_num = int(seg['speaker_num'])
-            text = seg['text']
-            
-            # Map speaker number to name
-            try:
-                speaker_name = self.speaker_names[speaker_num - 1]
-            except IndexError:
-                speaker_name = self.speaker_names[0]
+        txt_filename = os.path.splitext(os.path.basename(txt_path))[0]
+        output_path = os.path.join(self.output_dir, f"{txt_filename}_cosy_generated{self.extension}")
+        stop_check = lambda: self.job_queue.is_cancelled(txt_path)
+        if ipc_job is not None:
+            # Chunks go straight back to the client as they are generated, nothing is cached
+            self.synthesize(segments, txt_filename, output_path, stop_check=stop_check, metrics=metrics,
+                            sink=ipc_job[1], write_mode=write_mode)
+            return
+        if self.result_cache is None:
+            self.synthesize(segments, txt_filename, output_path, stop_check=stop_check, metrics=metrics,
+                            write_mode=write_mode)
+            return
+
+        cache_key = self.cache_key_for(segments)
+        if self.result_cache.begin(cache_key) is not None:
+            self.result_cache.publish(cache_key, output_path)
+            metrics.mark('written')
+            metrics.status = 'cached'
+            print(f"Result cache hit, audio saved to {output_path}")
+            return
+        try:
+            full = self.synthesize(segments, txt_filename, output_path, keep_full=True, stop_check=stop_check,
+                                   metrics=metrics, write_mode=write_mode)
+            if full is not None:
+                incoming = self.result_cache.incoming_path(cache_key)
+                if self.encoder is not None:
+                    self.encoder.write(full.T, self.model.sample_rate, incoming)
+                else:
+                    sf.write(incoming, full.T, self.model.sample_rate)
+                self.result_cache.finish(cache_key, incoming)
+        finally:
+            self.result_cache.finish(cache_key)
+        print(f"Result cache: {self.result_cache.stats()}")
+
+    def synthesize(self, segments, txt_filename, output_path, keep_full=False, stop_check=None, metrics=None,
+                   sink=None, write_mode=None):
+        """Run every segment through the model and write it out according to write_mode.
+
+        With keep_full the whole utterance is also returned as a (C, T) array, unless a
+        segment failed, so it can be cached. stop_check is polled between segments and
+        streamed chunks; once it returns True nothing more is generated or written. With an
+        IPC `sink` every chunk is sent to it as it arrives and no wav is written.
+        """
+        metrics = metrics if metrics is not None else self.metrics.begin(output_path)
+        write_mode = write_mode or self.write_mode
+        buffer = AudioBuffer(self.model.sample_rate)
+        full = buffer if write_mode == 'full' else (AudioBuffer(self.model.sample_rate) if keep_full else None)
+        parts_written = 0
+        failed = False
+        samples = 0
+
+        with self.resident():
+            reset_peak_memory(self.device)
+            start = time.time()
+            for i, seg in enumerate(segments):
+                if stop_check is not None and stop_check():
+                    print(f"Cancelled {txt_filename} after {i}/{len(segments)} segments")
+                    metrics.status = 'cancelled'
+                    return None
+                text = seg['text']
+                speaker_name = self.speaker_name_for(seg)
                 
-            print(f"Generating segment {i+1}/{len(segments)} for {speaker_name} (cached)...")
+                print(f"Generating segment {i+1}/{len(segments)} for {speaker_name} (cached)...")
             
-            # Use zero_shot_spk_id for faster inference
-            try:
-                # stream=True can be used for even lower latency if we had a player
-                # but here we concatenate for saving.
-                for chunk in self.model.inference_zero_shot(text, '', '', zero_shot_spk_id=speaker_name, stream=True):
-                    generated_wavs.append(chunk['tts_speech'])
-            except Exception as e:
-                print(f"Error during inference for segment {i+1}: {e}")
-                traceback.print_exc()
+                # Use zero_shot_spk_id for faster inference
+                try:
+                    self.ensure_speaker(speaker_name)
+                    metrics.mark('preprocessed')
+                    for chunk in self.model.inference_zero_shot(text, '', '', zero_shot_spk_id=speaker_name, stream=True):
+                        if stop_check is not None and stop_check():
+                            break
+                        metrics.mark('first_audio')
+                        samples += chunk['tts_speech'].shape[-1]
+                        if sink is not None:
+                            self.send_audio(sink, chunk['tts_speech'])
+                            continue
+                        buffer.append(chunk['tts_speech'])
+                        if full is not buffer and full is not None:
+                            full.append(chunk['tts_speech'])
+                        if write_mode == 'chunk':
+                            parts_written = self.flush_part(buffer, txt_filename, parts_written, metrics)
+                except Exception as e:
+                    failed = True
+                    print(f"Error during inference for segment {i+1}: {e}")
+                    traceback.print_exc()
 
-        if generated_wavs:
-            # Concatenate
-            final_wav = torch.cat(generated_wavs, dim=-1)
-            
-            # Save audio
-            txt_filename = os.path.splitext(os.path.basename(txt_path))[0]
-            output_path = os.path.join(self.output_dir, f"{txt_filename}_cosy_generated.wav")
-            os.makedirs(self.output_dir, exist_ok=True)
-            
-            audio_np = final_wav.cpu().numpy()
-            if audio_np.ndim > 1:
-                audio_np = audio_np.T # (C, T) -> (T, C)
-            
-            sf.write(output_path, audio_np, self.model.sample_rate)
-            os.chmod(output_path, 0o666)
+                if stop_check is not None and stop_check():
+                    print(f"Cancelled {txt_filename} during segment {i+1}/{len(segments)}")
+                    metrics.status = 'cancelled'
+                    return None
+                if write_mode == 'segment':
+                    parts_written = self.flush_part(buffer, txt_filename, parts_written, metrics)
+            metrics.mark('generated')
+            metrics.generate_seconds = time.time() - start
+            metrics.audio_seconds = samples / self.model.sample_rate
+            metrics.peak_memory = peak_memory(self.device)
+
+        if sink is not None:
+            if samples:
+                metrics.mark('written')
+            print(f"Streamed {samples / self.model.sample_rate:.1f}s of audio for {txt_filename} to the IPC client")
+        elif write_mode == 'full' and buffer.length:
+            self.write_wav(buffer.view(), output_path, metrics)
+            metrics.mark('written')
             print(f"Generated audio saved to {output_path}")
+        elif parts_written:
+            metrics.mark('written')
+            print(f"Generated audio saved as {parts_written} part(s) for {txt_filename}")
         else:
             print("No audio generated.")
 
-def main(model_dir, speaker_names, output_dir, device, watch_dir):
-    event_handler = TxtFileHandler(model_dir, speaker_names, output_dir, device)
+        if keep_full and not failed and full.length:
+            return full.view()
+        return None
+
+    def flush_part(self, buffer, txt_filename, index, metrics=None):
+        """Write whatever is buffered as the next numbered part, returns the next index"""
+        if not buffer.length:
+            return index
+        output_path = os.path.join(self.output_dir, f"{txt_filename}_cosy_generated_{index:03d}{self.extension}")
+        self.write_wav(buffer.view(), output_path, metrics)
+        buffer.clear()
+        print(f"Part {index} saved to {output_path}")
+        return index + 1
+
+    def send_audio(self, sink, chunk):
+        """Send a (C, T) float chunk to an IPC client as interleaved s16le PCM"""
+        audio = chunk.detach().float().cpu()
+        if audio.dim() == 1:
+            audio = audio.unsqueeze(0)
+        if not sink.started:
+            sink.start(self.model.sample_rate, audio.shape[0])
+        sink.write((audio.clamp(-1, 1) * 32767).to(torch.int16).T.contiguous().numpy().tobytes())
+
+    def write_wav(self, audio, output_path, metrics=None):
+        """Write a (C, T) array into a hidden subfolder, then rename it into place for the watchers.
+
+        With an encoder that happens on its worker processes, after this has returned; `metrics`
+        then only counts it written once it is in place.
+        """
+        if self.encoder is not None:
+            on_done = None
+            if metrics is not None:
+                self.metrics.write_queued(metrics)
+                on_done = lambda ok: self.metrics.write_done(metrics, ok)
+            self.encoder.submit(audio.T, self.model.sample_rate, output_path, on_done=on_done)
+            return
+        partial_dir = os.path.join(self.output_dir, ".partial")
+        os.makedirs(partial_dir, exist_ok=True)
+        tmp_path = os.path.join(partial_dir, os.path.basename(output_path))
+        sf.write(tmp_path, audio.T, self.model.sample_rate) # (C, T) -> (T, C)
+        os.chmod(tmp_path, 0o666)
+        os.replace(tmp_path, output_path)
+
+def main(model_dir, speaker_names, output_dir, device, watch_dir, queue_size=64, queue_policy='reject', scan_max_age=600,
+         deadline_seconds=0, metrics_file=None, metrics_port=0, ipc_socket=None, **options):
+    # CosyVoice has no cheaper quality level, so files that would miss their deadline are dropped
+    deadlines = {priority: deadline_seconds for priority in PRIORITIES} if deadline_seconds > 0 else None
+    job_queue = JobQueue(queue_size, queue_policy, ledger_path=os.path.join(watch_dir, ".generated"),
+                         deadlines=deadlines, deadline_policy='drop')
+    metrics = MetricsRecorder(metrics_file, metrics_port)
+    metrics.add_source('queue', job_queue.stats)
+    handler = TxtFileHandler(model_dir, speaker_names, output_dir, device, job_queue=job_queue, metrics=metrics,
+                             **options)
+    if handler.result_cache is not None:
+        metrics.add_source('result_cache', handler.result_cache.stats)
+    if handler.encoder is not None:
+        metrics.add_source('encoder', handler.encoder.stats)
+    if handler.offloader is not None:
+        metrics.add_source('offload', handler.offloader.stats)
+    handler.start_workers()
+    if ipc_socket:
+        IPCServer(ipc_socket, handler.submit_ipc, handler.cancel_ipc).start()
+    metrics.start()
     observer = Observer()
-    observer.schedule(event_handler, watch_dir, recursive=False)
+    observer.schedule(IngestHandler(job_queue), watch_dir, recursive=False)
     observer.start()
     print(f"Watching folder: {watch_dir} for new .txt files...")
+    job_queue.scan(watch_dir, max_age=scan_max_age)
     try:
         while True:
             time.sleep(1)
@@ -258,6 +632,26 @@ if __name__ == "__main__":
     parser.add_argument("--output_dir", type=str, default="./outputs", help="Directory to save output audio files")
     parser.add_argument("--device", type=str, default=("cuda" if torch.cuda.is_available() else "cpu"), help="Device")
     parser.add_argument("--watch_dir", type=str, default="./txt", help="Directory to watch")
+    parser.add_argument("--queue_size", type=int, default=64, help="Maximum number of pending txt files")
+    parser.add_argument("--queue_policy", type=str, default="reject", choices=["reject", "drop_oldest"], help="What to do with new files when the queue is full")
+    parser.add_argument("--scan_max_age", type=float, default=600, help="Pick up unprocessed txt files up to this many seconds old at startup")
+    parser.add_argument("--deadline_seconds", type=float, default=0, help="Seconds a txt file may wait before it is too stale to generate (0 disables deadlines)")
+    parser.add_argument("--metrics_file", type=str, default=None, help="Append one JSON line of timings per generated file here")
+    parser.add_argument("--metrics_port", type=int, default=0, help="Serve a JSON metrics summary on 127.0.0.1:<port>/metrics (0 disables)")
+    parser.add_argument("--ipc_socket", type=str, default=None, help="Also accept scripts on this Unix socket and stream the audio back to the client")
+    parser.add_argument("--spk_store_dir", type=str, default=os.path.join(current_dir, "spk_cache"), help="Directory for stored speaker prompts")
+    parser.add_argument("--result_cache_dir", type=str, default="./result_cache", help="Directory for cached generated audio")
+    parser.add_argument("--result_cache_mb", type=float, default=0, help="Size cap of the generated audio cache in MB (0 disables it)")
+    parser.add_argument("--idle_offload_minutes", type=float, default=0, help="Move the model to pinned host memory after this many idle minutes (0 keeps it on the GPU)")
+    parser.add_argument("--output_format", type=str, default="wav", choices=OUTPUT_FORMATS, help="wav: the model's rate; pcm48: 48 kHz stereo s16le wav; opus: Ogg Opus the bot sends without re-encoding")
+    parser.add_argument("--output_workers", type=int, default=2, help="Worker processes that resample/encode output with --output_format pcm48 or opus")
+    parser.add_argument("--write_mode", type=str, default="full", choices=["full", "segment", "chunk"], help="Write one wav per file, per script segment or per streamed chunk")
     
     args = parser.parse_args()
-    main(args.model_dir, args.speaker_names, args.output_dir, args.device, args.watch_dir)
+    main(args.model_dir, args.speaker_names, args.output_dir, args.device, args.watch_dir,
+         args.queue_size, args.queue_policy, args.scan_max_age, deadline_seconds=args.deadline_seconds,
+         write_mode=args.write_mode,
+         spk_store_dir=args.spk_store_dir, result_cache_dir=args.result_cache_dir,
+         result_cache_mb=args.result_cache_mb, idle_offload_minutes=args.idle_offload_minutes,
+         metrics_file=args.metrics_file, metrics_port=args.metrics_port, ipc_socket=args.ipc_socket,
+         output_format=args.output_format, output_workers=args.output_workers)
@@ -1,14 +1,28 @@
 import argparse
+import copy
+import json
 import os
 import time
 import torch
 import re
+import threading
+import multiprocessing
+import queue
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
 from watchdog.observers import Observer
-from watchdog.events import FileSystemEventHandler
 from vibevoice.modular.modeling_vibevoice_inference import VibeVoiceForConditionalGenerationInference
 from vibevoice.processor.vibevoice_processor import VibeVoiceProcessor
+from vibevoice.modular.streamer import AudioStreamer
 from transformers.utils import logging
 import traceback
+from jobqueue import PRIORITIES, IngestHandler, JobQueue, start_workers
+from resultcache import ResultCache
+from offload import IdleOffloader
+from metrics import MetricsRecorder, peak_memory, reset_peak_memory
+from ipc import IPCServer
+from outputformat import EXTENSIONS, OUTPUT_FORMATS, OutputEncoder
+from pcm import to_s16le
 
 logging.set_verbosity_info()
 logger = logging.get_logger(__name__)
@@ -17,16 +31,30 @@ class VoiceMapper:
     """Maps speaker names to voice file paths"""
 
     def __init__(self):
+        self.voices_dir = os.path.join(os.path.dirname(__file__), "voices")
+        self.voices_dir_mtime = None
         self.setup_voice_presets()
 
+    def refresh_if_changed(self):
+        """Rescan the voices directory only if something was added or removed"""
+        try:
+            mtime = os.stat(self.voices_dir).st_mtime_ns
+        except OSError:
+            mtime = None
+        if mtime != self.voices_dir_mtime:
+            self.setup_voice_presets()
+
     def setup_voice_presets(self):
-        voices_dir = os.path.join(os.path.dirname(__file__), "voices")
+        voices_dir = self.voices_dir
         if not os.path.exists(voices_dir):
             print(f"Warning: Voices directory not found at {voices_dir}")
             self.voice_presets = {}
             self.available_voices = {}
+            self.voices_dir_mtime = None
             return
 
+        self.voices_dir_mtime = os.stat(voices_dir).st_mtime_ns
+
         self.voice_presets = {}
         wav_files = [f for f in os.listdir(voices_dir)
                      if f.lower().endswith('.wav') and os.path.isfile(os.path.join(voices_dir, f))]
@@ -51,6 +79,258 @@ class VoiceMapper:
         print(f"Warning: No voice preset found for '{speaker_name}', using default voice: {default_voice}")
         return default_voice
 
+def torch_dtype_for(dtype):
+    if dtype == "float32":
+        return torch.float32
+    elif dtype == "float16":
+        return torch.float16
+    elif dtype == "bfloat16":
+        return torch.bfloat16
+    raise ValueError(f"Unsupported dtype: {dtype}")
+
+def read_snapshot_info(model_path):
+    """Return the snapshot.json of a directory written by write_snapshot, or None"""
+    info_path = os.path.join(model_path, "snapshot.json")
+    if not os.path.isfile(info_path):
+        return None
+    with open(info_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def write_snapshot(model_path, dtype, snapshot_dir):
+    """Save the model already cast to `dtype` as safetensors, next to its processor config.
+
+    Loading a snapshot skips the float32 download/cast and the extra host copy: the
+    memory-mapped tensors are placed straight onto the target device.
+    """
+    start = time.time()
+    print(f"Loading {model_path} as {dtype}...")
+    processor = VibeVoiceProcessor.from_pretrained(model_path,)
+    model = VibeVoiceForConditionalGenerationInference.from_pretrained(model_path, torch_dtype=torch_dtype_for(dtype),)
+    os.makedirs(snapshot_dir, exist_ok=True)
+    model.save_pretrained(snapshot_dir, safe_serialization=True)
+    processor.save_pretrained(snapshot_dir)
+    with open(os.path.join(snapshot_dir, "snapshot.json"), 'w', encoding='utf-8') as f:
+        json.dump({'source': model_path, 'dtype': dtype, 'created': time.time()}, f, indent=2)
+    print(f"Snapshot written to {snapshot_dir} in {time.time() - start:.1f}s")
+
+class VoicePromptCache:
+    """LRU cache of decoded reference audio, the processor's voice prompts and device-resident
+    voice tensors.
+
+    Entries are keyed by (path, mtime, size) so replacing a wav in voices/ invalidates it.
+    With install() the processor's per-request voice prompt (the normalized speech inputs and
+    their placeholder tokens) is built once per ordered voice set and reused after that.
+    """
+
+    def __init__(self, processor, device, max_mb=256):
+        self.processor = processor
+        self.device = device
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def file_key(path):
+        st = os.stat(path)
+        return (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+
+    @staticmethod
+    def entry_size(value):
+        if torch.is_tensor(value):
+            return value.element_size() * value.nelement()
+        if hasattr(value, 'nbytes'):
+            return int(value.nbytes)
+        if isinstance(value, dict):
+            return sum(VoicePromptCache.entry_size(v) for v in value.values())
+        if isinstance(value, (list, tuple)):
+            return sum(VoicePromptCache.entry_size(v) for v in value)
+        return 0
+
+    def _get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+            return None
+
+    def _put(self, key, value):
+        size = self.entry_size(value)
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.total_bytes += size
+            while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+    def get_audio(self, path):
+        """Return the reference wav decoded and resampled to the processor's rate"""
+        key = ('audio',) + self.file_key(path)
+        wav = self._get(key)
+        if wav is None:
+            wav = self.processor.audio_processor._load_audio_from_path(path)
+            self._put(key, wav)
+        return wav
+
+    def install(self):
+        """Serve the processor's voice prompts from the cache, returns False if it can't.
+
+        The processor then gets the voice file paths instead of decoded audio and only runs
+        its prompt builder on a miss.
+        """
+        build = getattr(self.processor, '_create_voice_prompt', None)
+        if build is None:
+            print("Processor has no voice prompt builder to cache, caching decoded audio only")
+            return False
+
+        def create_voice_prompt(speaker_samples):
+            if not all(isinstance(sample, str) for sample in speaker_samples):
+                return build(speaker_samples)
+            key = ('prompt',) + tuple(self.file_key(path) for path in speaker_samples)
+            prompt = self._get(key)
+            if prompt is None:
+                prompt = build([self.get_audio(path) for path in speaker_samples])
+                self._put(key, prompt)
+            # The processor appends to what it gets back
+            return tuple(list(part) for part in prompt)
+
+        self.processor._create_voice_prompt = create_voice_prompt
+        return True
+
+    def get_voice_tensors(self, voice_sets, inputs):
+        """Return speech_tensors/speech_masks for a batch of ordered voice sets, already on device.
+
+        On a miss the tensors the processor just built in `inputs` are moved and kept.
+        """
+        key = ('tensors',) + tuple(tuple(self.file_key(p) for p in paths) for paths in voice_sets)
+        tensors = self._get(key)
+        if tensors is None:
+            tensors = {k: inputs[k].to(self.device) for k in ('speech_tensors', 'speech_masks')
+                       if torch.is_tensor(inputs.get(k))}
+            self._put(key, tensors)
+        return tensors
+
+    def drop_device_entries(self):
+        """Forget the device-resident voice tensors, keeping the decoded audio"""
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == 'tensors']:
+                self.total_bytes -= self.entries.pop(key)[1]
+
+    def stats(self):
+        return (f"{len(self.entries)} entries, {self.total_bytes / 1024 / 1024:.1f}MB, "
+                f"{self.hits} hits, {self.misses} misses")
+
+class PrefixKVCache:
+    """LRU cache of the language model's past key/values over the system + voice prompt.
+
+    The processor lays out every request as system prompt, voice prompt, then the script,
+    so for a fixed ordered voice set everything up to the last speech token is identical
+    and only the script part needs a fresh prefill.
+
+    Entries are keyed by the voice files' (path, mtime, size), like VoicePromptCache, so a
+    voice wav replaced in place gets a new prefix and the old one is dropped.
+    """
+
+    def __init__(self, model, max_entries=4):
+        self.model = model
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def prefix_length(inputs):
+        mask = inputs.get('speech_input_mask')
+        if not torch.is_tensor(mask) or mask.shape[0] != 1 or not mask.any():
+            return 0
+        return int(mask[0].nonzero()[-1]) + 1
+
+    def get(self, voice_paths, inputs):
+        """Return (prefix_len, past_key_values) for this request, computing it on a miss"""
+        prefix_len = self.prefix_length(inputs)
+        if prefix_len == 0 or prefix_len >= inputs['input_ids'].shape[1]:
+            return None
+        key = tuple(VoicePromptCache.file_key(path) for path in voice_paths)
+        prefix_ids = inputs['input_ids'][:, :prefix_len]
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and torch.equal(entry[0], prefix_ids):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return prefix_len, entry[1]
+            self.misses += 1
+        past_key_values = self.compute(inputs, prefix_len)
+        paths = [signature[0] for signature in key]
+        with self.lock:
+            # Prefixes of an older version of the same voice files can never be hit again
+            for stale in [k for k in self.entries if k != key and [s[0] for s in k] == paths]:
+                del self.entries[stale]
+            self.entries[key] = (prefix_ids, past_key_values)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return prefix_len, past_key_values
+
+    @torch.no_grad()
+    def compute(self, inputs, prefix_len):
+        outputs = self.model(
+            input_ids=inputs['input_ids'][:, :prefix_len],
+            attention_mask=inputs['attention_mask'][:, :prefix_len],
+            speech_tensors=inputs['speech_tensors'],
+            speech_masks=inputs['speech_masks'],
+            speech_input_mask=inputs['speech_input_mask'][:, :prefix_len],
+            use_cache=True,
+            return_dict=True,
+            logits_to_keep=1,
+        )
+        return outputs.past_key_values
+
+    @contextmanager
+    def attach(self, prefix_len, past_key_values):
+        """Make generate's prefill forward start from a copy of the cached prefix.
+
+        Only the first forward carrying the voice prompt is rewritten; decode steps and the
+        CFG negative branch go through untouched.
+        """
+        model = self.model
+        original_forward = model.forward
+        pending = [True]
+
+        def forward(*args, **kwargs):
+            if pending[0] and kwargs.get('speech_tensors') is not None:
+                pending[0] = False
+                kwargs['past_key_values'] = copy.deepcopy(past_key_values)
+                for name in ('input_ids', 'position_ids'):
+                    if torch.is_tensor(kwargs.get(name)):
+                        kwargs[name] = kwargs[name][:, prefix_len:]
+                if torch.is_tensor(kwargs.get('cache_position')):
+                    kwargs['cache_position'] = kwargs['cache_position'][prefix_len:]
+                kwargs['speech_tensors'] = None
+                kwargs['speech_masks'] = None
+                kwargs['speech_input_mask'] = None
+                kwargs['inputs_embeds'] = None
+            return original_forward(*args, **kwargs)
+
+        model.forward = forward
+        try:
+            yield
+        finally:
+            del model.forward
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return f"{len(self.entries)} prefixes, {self.hits} hits, {self.misses} misses"
+
 def parse_txt_script(txt_content: str):
     """Parse txt script content and extract speakers and their text"""
     lines = txt_content.strip().split('\n')
@@ -80,99 +360,1283 @@ def parse_txt_script(txt_content: str):
         speaker_numbers.append(current_speaker)
     return scripts, speaker_numbers
 
-class TxtFileHandler(FileSystemEventHandler):
-    def __init__(self, model_path, speaker_names, output_dir, device, cfg_scale, dtype):
+def finish_if_stale(handler, job_queue, prepared):
+    """Finish a prepared job cancelled or expired since it left the queue, True if it was.
+
+    Stages that hold jobs outside the queue call this before spending more work on them.
+    """
+    job = prepared['job']
+    if job.cancelled.is_set():
+        print(f"Skipping cancelled job {job.txt_path}")
+        handler.finish_metrics(prepared, 'cancelled')
+        job_queue.done(job)
+        return True
+    if job_queue.expire_taken(job):
+        handler.finish_metrics(prepared, 'expired')
+        return True
+    return False
+
+class BatchScheduler:
+    """Pulls jobs off the job queue and hands them to the handler in batches.
+
+    A batch is started once `max_batch` files are ready or the oldest one has waited
+    `max_wait_ms` since it was queued. It holds files with the same speaker set as the
+    oldest file whose script length is within `length_ratio` of it, so padding stays small.
+    Files that don't fit are held for the next batch.
+    """
+
+    def __init__(self, handler, job_queue, max_batch=4, max_wait_ms=100, length_ratio=2.0):
+        self.handler = handler
+        self.job_queue = job_queue
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.length_ratio = length_ratio
+        self.held = []
+        self.thread = threading.Thread(target=self.run, name="batch-scheduler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def pull(self, timeout):
+        """Move one job from the queue into the held list, returns False on timeout"""
+        job = self.job_queue.get(timeout)
+        if job is None:
+            return False
+        try:
+            prepared = self.handler.prepare_job(job.txt_path)
+        except Exception as e:
+            print(f"Error reading {job.txt_path}: {e}")
+            prepared = None
+        if prepared is None:
+            self.job_queue.done(job)
+        else:
+            prepared['job'] = job
+            self.held.append(prepared)
+        return True
+
+    def drop_stale(self):
+        # Held jobs have left the queue, so its own shedding and expiry no longer reach them
+        self.held = [prepared for prepared in self.held
+                     if not finish_if_stale(self.handler, self.job_queue, prepared)]
+
+    def take_batch(self):
+        while True:
+            while not self.held:
+                self.pull(None)
+            deadline = self.held[0]['job'].enqueued + self.max_wait
+            while len(self.held) < self.max_batch:
+                remaining = max(deadline - time.time(), 0)
+                if remaining == 0 and not self.job_queue.depth:
+                    break
+                if not self.pull(remaining):
+                    break
+            self.drop_stale()
+            if self.held:
+                break
+
+        oldest = self.held[0]
+        base_len = max(len(oldest['script']), 1)
+        batch = []
+        for job in self.held:
+            if len(batch) >= self.max_batch:
+                break
+            ratio = max(len(job['script']), 1) / base_len
+            if (job['speaker_paths'] == oldest['speaker_paths']
+                    and 1 / self.length_ratio <= ratio <= self.length_ratio):
+                batch.append(job)
+        taken = {id(job) for job in batch}
+        self.held = [job for job in self.held if id(job) not in taken]
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.take_batch()
+            try:
+                self.handler.process_batch(batch)
+            except Exception as e:
+                print(f"Error processing batch {[job['txt_path'] for job in batch]}: {e}")
+                print(traceback.format_exc())
+            finally:
+                for prepared in batch:
+                    self.job_queue.done(prepared['job'])
+
+class PipelinedExecutor:
+    """Runs one file at a time through three overlapping stages.
+
+    A prepare thread reads, parses and tokenizes upcoming files into pinned tensors, the
+    generate thread only copies them to the device and runs the model, and a writer thread
+    saves (and caches) finished audio. So while file N generates, file N+1 is being prepared
+    and file N-1 written. Each hand-off queue holds at most `depth` files, which bounds both
+    the memory held by prepared inputs and how far ahead of the model the prepare stage gets.
+    A file cancelled or past its deadline by the time it reaches the next stage is dropped there.
+    """
+
+    def __init__(self, handler, job_queue, depth=1):
+        self.handler = handler
+        self.job_queue = job_queue
+        self.prepared = queue.Queue(maxsize=depth)
+        self.writes = queue.Queue(maxsize=depth)
+        self.threads = [threading.Thread(target=target, name=name, daemon=True) for target, name in
+                        ((self.prepare_loop, "pipeline-prepare"), (self.generate_loop, "pipeline-generate"),
+                         (self.write_loop, "pipeline-write"))]
+
+    def start(self):
+        self.handler.output_writer = self
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, job, audio):
+        # Waiting writes must not hold on to device memory
+        if torch.is_tensor(audio):
+            audio = audio.detach().float().cpu()
+        self.writes.put((job, audio))
+
+    def prepare_loop(self):
+        handler = self.handler
+        while True:
+            job = self.job_queue.get()
+            try:
+                prepared = handler.prepare_job(job.txt_path)
+                # Windowed scripts build their own inputs per window
+                if prepared is not None and not (0 < handler.chunk_chars < len(prepared['script'])):
+                    prepared['inputs'] = handler.preprocess([prepared['script']], [prepared['speaker_paths']])
+                    prepared['metrics'].mark('preprocessed')
+            except Exception as e:
+                print(f"Error preparing {job.txt_path}: {e}")
+                print(traceback.format_exc())
+                prepared = None
+            if prepared is None:
+                self.job_queue.done(job)
+                continue
+            prepared['job'] = job
+            self.prepared.put(prepared)
+
+    def generate_loop(self):
+        while True:
+            prepared = self.prepared.get()
+            if finish_if_stale(self.handler, self.job_queue, prepared):
+                continue
+            try:
+                self.handler.process_batch([prepared])
+            except Exception as e:
+                print(f"Error processing {prepared['txt_path']}: {e}")
+                print(traceback.format_exc())
+            finally:
+                prepared.pop('inputs', None)
+                # Otherwise the writer finishes the job once its wav is out
+                if not prepared.get('write_pending'):
+                    self.job_queue.done(prepared['job'])
+
+    def write_loop(self):
+        handler = self.handler
+        while True:
+            job, audio = self.writes.get()
+            if finish_if_stale(handler, self.job_queue, job):
+                if handler.result_cache is not None and 'cache_key' in job:
+                    handler.result_cache.finish(job['cache_key'])
+                continue
+            try:
+                handler.write_output(job, audio)
+            except Exception as e:
+                print(f"Error writing audio for {job['txt_path']}: {e}")
+                print(traceback.format_exc())
+            finally:
+                if handler.result_cache is not None and 'cache_key' in job:
+                    handler.result_cache.finish(job['cache_key'])
+                # No-op when write_output already recorded it
+                handler.finish_metrics(job, 'failed')
+                self.job_queue.done(job['job'])
+
+def split_script(scripts, max_chars):
+    """Split parsed 'Speaker N: text' lines into windows of at most max_chars of text.
+
+    Windows break at speaker turns first: a turn that doesn't fit in what is left of the
+    current window starts a new one. Only a turn longer than a whole window is split, at
+    sentence ends, and a single sentence longer than max_chars at word boundaries. The
+    length counts the separators the window's text is joined with.
+    Returns a list of windows, each a list of (speaker_number, text) turns.
+    """
+    turns = []
+    for line in scripts:
+        match = re.match(r'^Speaker\s+(\d+):\s*(.*)$', line, re.IGNORECASE)
+        speaker, text = match.group(1), match.group(2)
+        sentences = []
+        for sentence in re.split(r'(?<=[.!?])\s+', text):
+            while len(sentence) > max_chars:
+                cut = sentence.rfind(' ', 0, max_chars)
+                if cut <= 0:
+                    cut = max_chars
+                sentences.append(sentence[:cut].strip())
+                sentence = sentence[cut:].strip()
+            if sentence:
+                sentences.append(sentence)
+        if sentences:
+            turns.append((speaker, sentences))
+
+    windows = []
+    current = []
+    current_len = 0
+    for speaker, sentences in turns:
+        turn_len = sum(len(sentence) for sentence in sentences) + len(sentences) - 1
+        if current and current_len + 1 + turn_len > max_chars:
+            windows.append(current)
+            current, current_len = [], 0
+        for sentence in sentences:
+            # One separator (a space within a turn, a newline between turns) before every piece but the first
+            added = len(sentence) + (1 if current else 0)
+            if current and current_len + added > max_chars:
+                windows.append(current)
+                current, current_len = [], 0
+                added = len(sentence)
+            if current and current[-1][0] == speaker:
+                current[-1] = (speaker, current[-1][1] + " " + sentence)
+            else:
+                current.append((speaker, sentence))
+            current_len += added
+    if current:
+        windows.append(current)
+    return windows
+
+def crossfade_join(pieces, overlap):
+    """Concatenate 1-D audio tensors with a linear crossfade of `overlap` samples"""
+    joined = pieces[0]
+    for piece in pieces[1:]:
+        n = min(overlap, joined.numel(), piece.numel())
+        if n == 0:
+            joined = torch.cat([joined, piece])
+            continue
+        fade = torch.linspace(0.0, 1.0, n)
+        mixed = joined[-n:] * (1 - fade) + piece[:n] * fade
+        joined = torch.cat([joined[:-n], mixed, piece[n:]])
+    return joined
+
+def window_token_budget(text_tokens, cap=4096):
+    """max_new_tokens for one chunked window of `text_tokens` tokenized script.
+
+    The acoustic tokenizer emits 7.5 speech tokens per second of audio and read-aloud
+    speech runs at about 3 text tokens per second, so a window needs roughly 2.5 speech
+    tokens per text token. Twice that plus a fixed margin covers slow delivery and pauses
+    while still stopping a window that fails to end well short of the full cap.
+    """
+    return min(cap, text_tokens * 5 + 128)
+
+class AdaptiveQuality:
+    """Picks DDPM steps and CFG for each generation from the backlog and a time-to-audio target.
+
+    Level 0 is the configured quality. Higher levels cut diffusion steps and apply CFG to
+    fewer (early) steps; the last one drops CFG entirely. Only the diffusion head gets
+    cheaper: the LM runs its conditional and its negative (unconditional) pass for every
+    speech token at any level, as the stock generate computes the negative condition even
+    without CFG. `lm_share` is the LM's part of a level 0 generation.
+    """
+
+    def __init__(self, base_steps, cfg_scale, target_seconds, lm_share=0.6):
+        # (ddpm steps, cfg scale, fraction of steps that use CFG)
+        self.levels = [
+            (base_steps, cfg_scale, 1.0),
+            (max(2, round(base_steps * 0.7)), cfg_scale, 0.5),
+            (max(2, round(base_steps * 0.5)), cfg_scale, 0.25),
+            (max(2, round(base_steps * 0.3)), 1.0, 0.0),
+        ]
+        self.lm_share = lm_share
+        self.target = target_seconds
+        self.full_seconds = None
+
+    def head_evaluations(self, level):
+        # Every step runs the conditional batch, the CFG steps the unconditional half as well
+        steps, cfg_scale, cutoff = self.levels[level]
+        return steps * (1 + (cutoff if cfg_scale != 1.0 else 0))
+
+    def cost(self, level):
+        head = self.head_evaluations(level) / self.head_evaluations(0)
+        return self.lm_share + (1 - self.lm_share) * head
+
+    def pick(self, backlog):
+        """Lowest level that gets everything in the backlog plus this job done within the target"""
+        if not self.target or backlog == 0 or self.full_seconds is None:
+            return 0
+        for level in range(len(self.levels)):
+            if (backlog + 1) * self.full_seconds * self.cost(level) <= self.target:
+                return level
+        return len(self.levels) - 1
+
+    def observe(self, level, seconds):
+        full = seconds / self.cost(level)
+        self.full_seconds = full if self.full_seconds is None else 0.8 * self.full_seconds + 0.2 * full
+
+class TxtFileHandler:
+    def __init__(self, model_path, speaker_names, output_dir, device, cfg_scale, dtype, voice_cache_mb=256,
+                 prefix_cache=0, batch_size=1, batch_wait_ms=100, job_queue=None, stream_segment_seconds=0,
+                 result_cache_dir="./result_cache", result_cache_mb=0, chunk_chars=0, chunk_crossfade_ms=30,
+                 ddpm_steps=10, latency_target=0, compile=False, warmup=0, quantize=False, idle_offload_minutes=0,
+                 pipeline_depth=0, metrics=None, metrics_file=None, output_format='wav', output_workers=2):
         self.model_path = model_path
         self.speaker_names = speaker_names
         self.output_dir = output_dir
         self.device = device
         self.cfg_scale = cfg_scale
+        self.current_cfg = cfg_scale
+        self.cfg_cutoff = 1.0
         self.dtype = dtype
+        self.ddpm_steps = ddpm_steps
         self.model = None
         self.processor = None
+        self.voice_mapper = VoiceMapper()
+        self.metrics = metrics if metrics is not None else MetricsRecorder(metrics_file)
         self.load_model()
+        if quantize:
+            self.quantize_model()
+        self.voice_cache = VoicePromptCache(self.processor, self.device, max_mb=voice_cache_mb)
+        self.voice_prompts_cached = self.voice_cache.install()
+        self.prefix_cache = PrefixKVCache(self.model, max_entries=prefix_cache) if prefix_cache > 0 else None
+        self.job_queue = job_queue if job_queue is not None else JobQueue()
+        # Scripts that came in over the IPC socket, by their virtual txt path
+        self.ipc_jobs = {}
+        self.job_queue.listeners.append(self.release_ipc_job)
+        self.batch_size = batch_size
+        self.batch_wait_ms = batch_wait_ms
+        self.stream_segment_seconds = stream_segment_seconds
+        self.pipeline_depth = pipeline_depth
+        self.output_writer = None
+        self.processor_lock = threading.Lock()
+        self.output_format = output_format
+        self.extension = EXTENSIONS[output_format]
+        self.encoder = OutputEncoder(output_format, output_workers) if output_format != 'wav' else None
+        self.result_cache = ResultCache(result_cache_dir, result_cache_mb, self.extension) if result_cache_mb > 0 else None
+        self.chunk_chars = chunk_chars
+        self.chunk_crossfade_ms = chunk_crossfade_ms
+        self.quality = None
+        # Late jobs from a deadline-aware queue are generated at the fastest level
+        downgrades = bool(self.job_queue.deadlines) and self.job_queue.deadline_policy == 'downgrade'
+        if latency_target > 0 or downgrades:
+            self.quality = AdaptiveQuality(self.ddpm_steps, self.cfg_scale, latency_target)
+            self.install_cfg_cutoff_sampler()
+        if compile:
+            self.compile_model()
+            warmup = max(warmup, 2)
+        if warmup > 0:
+            self.warm_up(warmup)
+        self.offloader = None
+        if idle_offload_minutes > 0:
+            if str(self.device).startswith("cuda"):
+                self.offloader = IdleOffloader([self.model], self.device, idle_offload_minutes * 60,
+                                               on_offload=[self.drop_device_caches])
+                self.offloader.start()
+            else:
+                print(f"Idle offload only applies to cuda devices, keeping the model on {self.device}")
 
     def load_model(self):
-        if self.dtype == "float32":
-            torch_dtype = torch.float32
-        elif self.dtype == "float16":
-            torch_dtype = torch.float16
-        elif self.dtype == "bfloat16":
-            torch_dtype = torch.bfloat16
+        torch_dtype = torch_dtype_for(self.dtype)
+        start = time.time()
+        snapshot = read_snapshot_info(self.model_path)
+        if snapshot is not None:
+            if snapshot['dtype'] != self.dtype:
+                print(f"Warning: snapshot was written as {snapshot['dtype']}, loading it as {self.dtype} needs a cast")
+            print(f"Loading VibeVoice snapshot of {snapshot['source']}...")
+            self.processor = VibeVoiceProcessor.from_pretrained(self.model_path,)
+            # Weights are already in the target dtype: map the safetensors straight onto the device
+            self.model = VibeVoiceForConditionalGenerationInference.from_pretrained(
+                self.model_path, torch_dtype=torch_dtype, device_map=self.device, low_cpu_mem_usage=True,)
         else:
-            raise ValueError(f"Unsupported dtype: {self.dtype}")
-        print("Loading VibeVoice model...")
-        self.processor = VibeVoiceProcessor.from_pretrained(self.model_path,)
-        self.model = VibeVoiceForConditionalGenerationInference.from_pretrained(self.model_path,torch_dtype=torch_dtype,)
-        self.model.to(self.device)
+            print("Loading VibeVoice model...")
+            self.processor = VibeVoiceProcessor.from_pretrained(self.model_path,)
+            self.model = VibeVoiceForConditionalGenerationInference.from_pretrained(self.model_path,torch_dtype=torch_dtype,)
+            self.model.to(self.device)
         self.model.eval()
-        self.model.set_ddpm_inference_steps(num_steps=10)
-        print("Model loaded successfully.")
+        self.model.set_ddpm_inference_steps(num_steps=self.ddpm_steps)
+        print(f"Model loaded successfully in {time.time() - start:.1f}s.")
+
+    def quantize_model(self):
+        """Dynamic int8 quantization of the language model's Linear layers for CPU inference.
 
-    def on_created(self, event):
-        if event.is_directory or not event.src_path.endswith(".txt"):
+        Weights are stored as int8 and activations are quantized on the fly, which roughly
+        halves the LM's per-token time on AVX2/AVX512 CPUs. The diffusion head and the audio
+        tokenizers stay in float32, they are small and sensitive to precision.
+        """
+        if self.dtype != "float32":
+            print(f"Warning: dynamic quantization needs float32 weights, skipping it for {self.dtype}")
             return
-        print(f"New text file detected: {event.src_path}")
-        try:
-            self.process_txt_file(event.src_path)
-        except Exception as e:
-            print(f"Error processing {event.src_path}: {e}")
-            print(traceback.format_exc())
+        if not str(self.device).startswith("cpu"):
+            print(f"Warning: dynamic quantization only runs on CPU, skipping it on {self.device}")
+            return
+        language_model = self.model.model.language_model
+        torch.ao.quantization.quantize_dynamic(language_model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        print("Quantized language model Linear layers to int8")
 
-    def process_txt_file(self, txt_path):
-        print(f"Starting generation with cfg_scale: {self.cfg_scale}")
-        with open(txt_path, 'r', encoding='utf-8') as file:
-            txt_content = file.read()
+    def compile_model(self):
+        """torch.compile the LM and the diffusion head in place, keeping parameter names intact"""
+        language_model = self.model.model.language_model
+        prediction_head = self.model.model.prediction_head
+        # The KV cache grows every step, so let the LM graph take dynamic shapes. The head always
+        # sees the same (batch, latent) shape and can be captured into CUDA graphs.
+        language_model.compile(dynamic=True)
+        head_mode = "reduce-overhead" if str(self.device).startswith("cuda") else "default"
+        prediction_head.compile(mode=head_mode)
+        print(f"Compiled language model (dynamic) and diffusion head ({head_mode})")
+
+    def warm_up(self, runs):
+        """Run a few throwaway generations so kernel selection, compilation and allocator growth
+        happen now instead of on the first real message"""
+        self.voice_mapper.refresh_if_changed()
+        speaker_paths = [self.voice_mapper.get_voice_path(self.speaker_names[0])]
+        script = "Speaker 1: Warming up the voice model, one, two, three."
+        timings = []
+        for _ in range(runs):
+            start = time.time()
+            inputs = self.build_inputs([script], [speaker_paths])
+            self.generate(inputs, voice_key=tuple(speaker_paths), max_new_tokens=256, verbose=False)
+            if str(self.device).startswith("cuda"):
+                torch.cuda.synchronize()
+            timings.append(time.time() - start)
+        print(f"Warmup: first generation {timings[0]:.2f}s, last {timings[-1]:.2f}s "
+              f"({timings[0] - timings[-1]:.2f}s of one-off startup cost paid before the first message)")
+
+    def resident(self):
+        """Context for using the model: reloads offloaded weights and holds off the idle offload"""
+        return self.offloader.use() if self.offloader is not None else nullcontext()
+
+    def drop_device_caches(self):
+        # Cached voice tensors and prompt KV live on the GPU and would pin VRAM while idle
+        self.voice_cache.drop_device_entries()
+        if self.prefix_cache is not None:
+            self.prefix_cache.clear()
+
+    def start_workers(self):
+        """Start consuming the job queue, batched or one file at a time"""
+        if self.batch_size > 1:
+            BatchScheduler(self, self.job_queue, self.batch_size, self.batch_wait_ms).start()
+        elif self.pipeline_depth > 0:
+            PipelinedExecutor(self, self.job_queue, self.pipeline_depth).start()
+        else:
+            start_workers(self.job_queue, lambda job: self.process_txt_file(job.txt_path))
+
+    def ipc_path(self, job_id):
+        return os.path.abspath(os.path.join(self.output_dir, f"ipc_{job_id}.txt"))
+
+    def submit_ipc(self, job_id, script, priority, sink):
+        """Queue a script that came in over the IPC socket like a txt file.
+
+        The job gets a virtual txt path that never exists on disk, and its audio goes to
+        `sink` instead of the output folder.
+        """
+        txt_path = self.ipc_path(job_id)
+        self.ipc_jobs[txt_path] = (script, sink)
+        if self.job_queue.put(txt_path, priority if priority in PRIORITIES else 'normal', ledger=False):
+            return True
+        self.ipc_jobs.pop(txt_path, None)
+        return False
+
+    def cancel_ipc(self, job_id):
+        self.job_queue.cancel(self.ipc_path(job_id))
+
+    def release_ipc_job(self, job):
+        # Queue listener. Generated jobs have told their client already; this covers the
+        # ones that were shed, expired or cancelled before a worker got to them.
+        entry = self.ipc_jobs.pop(job.txt_path, None)
+        if entry is not None:
+            entry[1].end('cancelled' if job.cancelled.is_set() else 'dropped')
+
+    def prepare_job(self, txt_path):
+        """Read and parse a txt file into a job dict, or None if it has no usable script"""
+        queued = self.job_queue.job_for(txt_path)
+        metrics = self.metrics.begin(txt_path, queued.enqueued if queued is not None else None)
+        ipc_job = self.ipc_jobs.get(os.path.abspath(txt_path))
+        if ipc_job is not None:
+            txt_content = ipc_job[0]
+        else:
+            with open(txt_path, 'r', encoding='utf-8') as file:
+                txt_content = file.read()
+        metrics.mark('read')
 
         scripts, speaker_numbers = parse_txt_script(txt_content)
+        metrics.mark('parsed')
         if not scripts:
             print(f"No valid scripts found in {txt_path}")
-            return
+            self.metrics.finish(metrics, 'empty')
+            if ipc_job is not None:
+                ipc_job[1].end('empty')
+            return None
 
-        voice_mapper = VoiceMapper()
+        self.voice_mapper.refresh_if_changed()
         unique_speakers = sorted(list(set(speaker_numbers)), key=int)
-        speaker_paths = [voice_mapper.get_voice_path(self.speaker_names[int(num)-1]) for num in unique_speakers]
+        speaker_paths = [self.voice_mapper.get_voice_path(self.speaker_names[int(num)-1]) for num in unique_speakers]
 
         # Combine all scripts into a single string, exactly like the working example
         full_script = '\n'.join(scripts)
+        job = {'txt_path': txt_path, 'script': full_script, 'scripts': scripts, 'speaker_paths': speaker_paths,
+               'metrics': metrics}
+        if ipc_job is not None:
+            # Streamed straight back to the client, never published from the result cache
+            job['sink'] = ipc_job[1]
+        elif self.result_cache is not None:
+            job['cache_key'] = ResultCache.make_key(
+                script='\n'.join(' '.join(line.split()) for line in scripts),
+                voices=[VoicePromptCache.file_key(path) for path in speaker_paths],
+                model=self.model_path,
+                dtype=self.dtype,
+                cfg_scale=self.cfg_scale,
+                steps=self.ddpm_steps,
+                # Cached clips are stored already encoded, so each format has its own entries
+                **({'output_format': self.output_format} if self.encoder is not None else {}),
+            )
+        return job
+
+    def output_path_for(self, job):
+        txt_filename = os.path.splitext(os.path.basename(job['txt_path']))[0]
+        return os.path.join(self.output_dir, f"{txt_filename}_generated{self.extension}")
+
+    def process_txt_file(self, txt_path, stream_segment_seconds=None):
+        """Generate one txt file; `stream_segment_seconds` overrides the handler's for this file only"""
+        job = self.prepare_job(txt_path)
+        if job is not None:
+            if stream_segment_seconds is not None:
+                job['segment_seconds'] = stream_segment_seconds
+            self.process_batch([job])
+
+    def segment_seconds(self, job):
+        return job.get('segment_seconds', self.stream_segment_seconds)
+
+    def is_cancelled(self, job):
+        return self.job_queue.is_cancelled(job['txt_path'])
+
+    def is_late(self, job):
+        queued = self.job_queue.job_for(job['txt_path'])
+        return queued is not None and queued.late
+
+    def backlog(self, jobs):
+        """Jobs waiting behind these ones, including the parent's share for a pool worker"""
+        queued = [self.job_queue.job_for(job['txt_path']) for job in jobs]
+        return max([self.job_queue.depth] + [job.backlog for job in queued if job is not None])
+
+    def finish_metrics(self, job, status=None):
+        metrics = job['metrics']
+        metrics.audio_seconds = job.get('audio_seconds', metrics.audio_seconds)
+        self.metrics.finish(metrics, status)
+        if 'sink' in job:
+            job['sink'].end(metrics.status)
+
+    def process_batch(self, jobs):
+        """Serve jobs from the result cache where possible and generate the rest together"""
+        try:
+            self.serve_batch(jobs)
+        except Exception:
+            for job in jobs:
+                job['metrics'].status = 'failed'
+            raise
+        finally:
+            # Pipelined writes record their job once the wav is out
+            for job in jobs:
+                if not job.get('write_pending'):
+                    self.finish_metrics(job)
+
+    def serve_batch(self, jobs):
+        for job in jobs:
+            if self.is_cancelled(job):
+                print(f"Skipping cancelled job {job['txt_path']}")
+                self.finish_metrics(job, 'cancelled')
+        jobs = [job for job in jobs if not self.is_cancelled(job)]
+        if not jobs:
+            return
+        if self.result_cache is None:
+            self.generate_batch(jobs)
+            return
+
+        leaders = [job for job in jobs if 'cache_key' not in job]
+        duplicates = []
+        for job in jobs:
+            if 'cache_key' not in job:
+                continue
+            key = job['cache_key']
+            if any(key == leader.get('cache_key') for leader in leaders):
+                duplicates.append(job)
+            elif self.result_cache.begin(key) is not None:
+                self.result_cache.publish(key, self.output_path_for(job))
+                job['metrics'].mark('written')
+                self.finish_metrics(job, 'cached')
+                print(f"Result cache hit for {job['txt_path']}")
+            else:
+                leaders.append(job)
+        leader_for = {job['cache_key']: job for job in leaders if 'cache_key' in job}
+        for job in duplicates:
+            # Kept in memory for the duplicates in case the cache ends up without it
+            leader_for[job['cache_key']]['keep_audio'] = True
+        try:
+            if leaders:
+                self.generate_batch(leaders)
+        finally:
+            for job in leaders:
+                # A pipelined write releases its key once the wav is actually stored
+                if 'cache_key' in job and not job.get('write_pending'):
+                    self.result_cache.finish(job['cache_key'])
+        try:
+            self.serve_duplicates(duplicates, leader_for)
+        finally:
+            for job in leaders:
+                job.pop('audio', None)
+        print(f"Result cache: {self.result_cache.stats()}")
+
+    def serve_duplicates(self, duplicates, leader_for):
+        """Give within-batch duplicates their leader's audio, or generate them after all.
+
+        Degraded leaders are not cached, and cancelled or silent ones have nothing to cache,
+        so the cache is only the first place to look.
+        """
+        regenerate = []
+        for job in duplicates:
+            if self.is_cancelled(job):
+                print(f"Skipping cancelled job {job['txt_path']}")
+                self.finish_metrics(job, 'cancelled')
+                continue
+            if self.result_cache.publish(job['cache_key'], self.output_path_for(job)):
+                job['metrics'].mark('written')
+                self.finish_metrics(job, 'cached')
+                print(f"Shared generated audio with duplicate {job['txt_path']}")
+                continue
+            leader = leader_for[job['cache_key']]
+            if leader.get('audio') is None:
+                regenerate.append(job)
+                continue
+            job['audio_seconds'] = leader.get('audio_seconds', 0.0)
+            destination = self.emit(job, leader['audio'], self.output_path_for(job))
+            job['metrics'].mark('written')
+            self.finish_metrics(job)
+            print(f"Shared generated audio with duplicate {job['txt_path']}, saved to {destination}")
+        if not regenerate:
+            return
+        print(f"Generating {len(regenerate)} duplicate(s) whose leader produced no audio")
+        self.generate_batch(regenerate)
+        for job in regenerate:
+            if 'written' not in job['metrics'].marks and not self.is_cancelled(job):
+                self.finish_metrics(job, 'failed')
+
+    def build_inputs(self, texts, voice_sets):
+        """Run the processor over scripts and their voice sets and move the result to the device"""
+        return self.to_device(self.preprocess(texts, voice_sets), voice_sets)
+
+    def preprocess(self, texts, voice_sets):
+        """CPU half of build_inputs: load the voices and tokenize, pinned for a fast async copy"""
+        if self.voice_prompts_cached:
+            # Built from the voice cache by the processor's patched prompt builder
+            voice_samples = [list(paths) for paths in voice_sets]
+        else:
+            voice_samples = [[self.voice_cache.get_audio(path) for path in paths] for paths in voice_sets]
 
         # Prepare inputs
-        inputs = self.processor(
-            text=[full_script],             # wrap in list
-            voice_samples=[speaker_paths],  # wrap in list
-            padding=True,
-            return_tensors="pt",
-            return_attention_mask=True,
-        )
-        # Move tensors to target device
+        with self.processor_lock:
+            inputs = self.processor(
+                text=texts,
+                voice_samples=voice_samples,
+                padding=True,
+                return_tensors="pt",
+                return_attention_mask=True,
+            )
+        if str(self.device).startswith("cuda"):
+            for k, v in inputs.items():
+                if torch.is_tensor(v):
+                    inputs[k] = v.pin_memory()
+        return inputs
+
+    def to_device(self, inputs, voice_sets):
+        # Move tensors to target device, reusing the cached voice tensors
+        voice_tensors = self.voice_cache.get_voice_tensors(voice_sets, inputs)
         for k, v in inputs.items():
-            if torch.is_tensor(v):
-                inputs[k] = v.to(self.device)
+            if k in voice_tensors:
+                inputs[k] = voice_tensors[k]
+            elif torch.is_tensor(v):
+                inputs[k] = v.to(self.device, non_blocking=True)
+        print(f"Voice cache: {self.voice_cache.stats()}")
+        return inputs
 
-        # Generate audio
-        with torch.no_grad():
-            outputs = self.model.generate(
-                **inputs,
-                cfg_scale=self.cfg_scale,
-                max_new_tokens=4096,
-                generation_config={'do_sample': False},
-                verbose=True,
-                tokenizer=self.processor.tokenizer  # MUST be passed
-            )
+    def install_cfg_cutoff_sampler(self):
+        """Replace the diffusion sampler with one that stops applying CFG after cfg_cutoff of the steps.
+
+        Same maths as the stock sampler, but once CFG is off only the conditional half of the
+        batch goes through the prediction head.
+        """
+        model = self.model
+
+        def sample_speech_tokens(condition, neg_condition, cfg_scale=3.0):
+            scheduler = model.model.noise_scheduler
+            head = model.model.prediction_head
+            scheduler.set_timesteps(model.ddpm_inference_steps)
+            condition = condition.to(head.device)
+            neg_condition = neg_condition.to(head.device)
+            speech = torch.randn(condition.shape[0], model.config.acoustic_vae_dim).to(condition)
+            cfg_steps = round(len(scheduler.timesteps) * self.cfg_cutoff) if cfg_scale != 1.0 else 0
+            for i, t in enumerate(scheduler.timesteps):
+                if i < cfg_steps:
+                    combined = torch.cat([speech, speech], dim=0)
+                    eps = head(combined, t.repeat(combined.shape[0]).to(combined),
+                               condition=torch.cat([condition, neg_condition], dim=0))
+                    cond_eps, uncond_eps = torch.split(eps, len(eps) // 2, dim=0)
+                    eps = uncond_eps + cfg_scale * (cond_eps - uncond_eps)
+                else:
+                    eps = head(speech, t.repeat(speech.shape[0]).to(speech), condition=condition)
+                speech = scheduler.step(eps, t, speech).prev_sample
+            return speech
+
+        model.sample_speech_tokens = sample_speech_tokens
+
+    def generate_batch(self, jobs):
+        """Generate jobs at the quality level the current backlog allows"""
+        with self.resident():
+            reset_peak_memory(self.device)
+            start = time.time()
+            if self.quality is None:
+                self.run_batch(jobs)
+            else:
+                backlog = self.backlog(jobs)
+                level = self.quality.pick(backlog)
+                if any(self.is_late(job) for job in jobs):
+                    level = len(self.quality.levels) - 1
+                steps, self.current_cfg, self.cfg_cutoff = self.quality.levels[level]
+                self.model.set_ddpm_inference_steps(num_steps=steps)
+                for job in jobs:
+                    # Degraded audio must not be cached under the full-quality key
+                    job['degraded'] = level > 0
+                print(f"Quality level {level}: {steps} steps, cfg {self.current_cfg} on {self.cfg_cutoff:.0%} of steps "
+                      f"(backlog {backlog})")
+                self.run_batch(jobs)
+                self.quality.observe(level, time.time() - start)
+
+        elapsed = time.time() - start
+        audio_seconds = sum(job.get('audio_seconds', 0) for job in jobs)
+        if audio_seconds > 0:
+            print(f"Generated {audio_seconds:.1f}s of audio for {len(jobs)} file(s) in {elapsed:.1f}s "
+                  f"(RTF {elapsed / audio_seconds:.2f})")
+
+    def run_batch(self, jobs):
+        """Generate one or more prepared jobs in a single padded generate call"""
+        if self.chunk_chars > 0:
+            # Long scripts go window by window on their own instead of padding the whole batch
+            for job in jobs:
+                if len(job['script']) > self.chunk_chars:
+                    self.process_chunked(job)
+            jobs = [job for job in jobs if len(job['script']) <= self.chunk_chars]
+            if not jobs:
+                return
+
+        print(f"Starting generation of {len(jobs)} file(s) with cfg_scale: {self.current_cfg}")
+        voice_sets = [job['speaker_paths'] for job in jobs]
+        if len(jobs) == 1 and 'inputs' in jobs[0]:
+            # Already tokenized by the pipeline while the previous job was generating
+            inputs = self.to_device(jobs[0].pop('inputs'), voice_sets)
+        else:
+            inputs = self.build_inputs([job['script'] for job in jobs], voice_sets)
+        for job in jobs:
+            job['metrics'].mark('preprocessed')
+
+        voice_key = tuple(voice_sets[0]) if len(jobs) == 1 else None
+        # Stop early only once every job in the batch has been cancelled
+        stop_check = lambda: all(self.is_cancelled(job) for job in jobs)
+        # Streamed segments of batched jobs would interleave in the player, so only stream single jobs
+        if len(jobs) == 1 and self.segment_seconds(jobs[0]) > 0:
+            self.generate_streaming(jobs[0], inputs, voice_key, stop_check)
+            return
+        start = time.time()
+        outputs = self.generate(inputs, voice_key=voice_key, stop_check_fn=stop_check)
+        self.record_generation(jobs, inputs, outputs, time.time() - start)
 
         # Save audio
-        txt_filename = os.path.splitext(os.path.basename(txt_path))[0]
-        output_path = os.path.join(self.output_dir, f"{txt_filename}_generated.wav")
-        os.makedirs(self.output_dir, exist_ok=True)
-        self.processor.save_audio(outputs.speech_outputs[0], output_path=output_path)
-        print(f"Generated audio saved to {output_path}")
-
-def main(model_path, speaker_names, output_dir, device, cfg_scale, watch_dir, dtype):
-    event_handler = TxtFileHandler(model_path, speaker_names, output_dir, device, cfg_scale, dtype)
+        for job, speech in zip(jobs, outputs.speech_outputs):
+            if self.is_cancelled(job):
+                print(f"Generation of {job['txt_path']} was cancelled, discarding its audio")
+                job['metrics'].status = 'cancelled'
+                continue
+            if speech is None:
+                print(f"No audio generated for {job['txt_path']}")
+                continue
+            job['audio_seconds'] = speech.shape[-1] / self.processor.audio_processor.sampling_rate
+            if self.output_writer is not None:
+                job['write_pending'] = True
+                self.output_writer.submit(job, speech)
+            else:
+                self.write_output(job, speech)
+
+    def write_output(self, job, audio):
+        output_path = self.output_path_for(job)
+        destination = output_path
+        if not self.cache_result(job, audio, output_path):
+            destination = self.emit(job, audio, output_path)
+        job['metrics'].mark('written')
+        self.finish_metrics(job)
+        print(f"Generated audio saved to {destination}")
+
+    @staticmethod
+    def new_tokens(inputs, outputs):
+        sequences = getattr(outputs, 'sequences', None)
+        if not torch.is_tensor(sequences):
+            return 0
+        return max(0, sequences.shape[-1] - inputs['input_ids'].shape[-1])
+
+    def record_generation(self, jobs, inputs, outputs, seconds):
+        tokens = self.new_tokens(inputs, outputs)
+        for job in jobs:
+            metrics = job['metrics']
+            metrics.mark('first_audio')
+            metrics.mark('generated')
+            metrics.generate_seconds += seconds
+            metrics.tokens += tokens
+            metrics.peak_memory = peak_memory(self.device)
+
+    def process_chunked(self, job):
+        audio = self.generate_chunked(job)
+        if self.is_cancelled(job):
+            print(f"Generation of {job['txt_path']} was cancelled, discarding its audio")
+            job['metrics'].status = 'cancelled'
+            return
+        if audio is None:
+            print(f"No audio generated for {job['txt_path']}")
+            return
+        job['metrics'].mark('generated')
+        job['metrics'].peak_memory = peak_memory(self.device)
+        job['audio_seconds'] = audio.numel() / self.processor.audio_processor.sampling_rate
+        if self.segment_seconds(job) > 0:
+            # Windows were already written out as segments while generating
+            self.cache_result(job, audio)
+            job['metrics'].mark('written')
+            return
+        output_path = self.output_path_for(job)
+        destination = output_path
+        if not self.cache_result(job, audio, output_path):
+            destination = self.emit(job, audio, output_path)
+        job['metrics'].mark('written')
+        print(f"Generated audio saved to {destination}")
+
+    def generate_chunked(self, job):
+        """Generate a long script window by window and crossfade the pieces into one clip.
+
+        Each window is at most chunk_chars of text with a token budget scaled from its
+        tokenized length, so peak memory depends on the window size rather than on the
+        length of the pasted text.
+        """
+        windows = split_script(job['scripts'], self.chunk_chars)
+        print(f"Generating {job['txt_path']} in {len(windows)} windows of up to {self.chunk_chars} characters")
+        txt_filename = os.path.splitext(os.path.basename(job['txt_path']))[0]
+        sample_rate = self.processor.audio_processor.sampling_rate
+        pieces = []
+        for i, window in enumerate(windows):
+            if self.is_cancelled(job):
+                return None
+            # Renumber the speakers of this window from 1 so they line up with its voice list
+            speakers = sorted({speaker for speaker, _ in window}, key=int)
+            renumber = {speaker: n + 1 for n, speaker in enumerate(speakers)}
+            script = '\n'.join(f"Speaker {renumber[speaker]}: {text}" for speaker, text in window)
+            speaker_paths = [self.voice_mapper.get_voice_path(self.speaker_names[int(num)-1]) for num in speakers]
+
+            inputs = self.build_inputs([script], [speaker_paths])
+            job['metrics'].mark('preprocessed')
+            text_tokens = len(self.processor.tokenizer.encode(script, add_special_tokens=False))
+            start = time.time()
+            outputs = self.generate(inputs, voice_key=tuple(speaker_paths),
+                                    max_new_tokens=window_token_budget(text_tokens),
+                                    stop_check_fn=lambda: self.is_cancelled(job))
+            job['metrics'].generate_seconds += time.time() - start
+            job['metrics'].tokens += self.new_tokens(inputs, outputs)
+            speech = outputs.speech_outputs[0]
+            del inputs, outputs
+            if speech is None:
+                print(f"Window {i+1}/{len(windows)} produced no audio")
+                continue
+            speech = speech.detach().float().cpu().reshape(-1)
+            if self.segment_seconds(job) > 0:
+                self.emit(job, speech, os.path.join(self.output_dir, f"{txt_filename}_generated_{i:03d}{self.extension}"))
+            pieces.append(speech)
+            job['metrics'].mark('first_audio')
+            print(f"Window {i+1}/{len(windows)} done ({speech.numel() / sample_rate:.1f}s of audio)")
+
+        if not pieces:
+            return None
+        return crossfade_join(pieces, int(self.chunk_crossfade_ms / 1000 * sample_rate))
+
+    def cache_result(self, job, audio, output_path=None):
+        """Store a leader's full audio in the result cache and publish it, False if not cached"""
+        if job.get('keep_audio'):
+            job['audio'] = audio
+        if self.result_cache is None or 'cache_key' not in job or job.get('degraded'):
+            return False
+        key = job['cache_key']
+        incoming = self.result_cache.incoming_path(key)
+        if self.encoder is not None:
+            # Wait for it, duplicates are published from this file as soon as finish() runs
+            self.encoder.write(self.to_numpy(audio), self.processor.audio_processor.sampling_rate, incoming)
+        else:
+            self.processor.save_audio(audio, output_path=incoming)
+        self.result_cache.finish(key, incoming)
+        return output_path is not None and self.result_cache.publish(key, output_path)
+
+    @staticmethod
+    def to_numpy(audio):
+        return audio.detach().float().cpu().reshape(-1).numpy()
+
+    def save_audio(self, audio, output_path, metrics=None):
+        """Write into a hidden subfolder first so watchers never pick up a half-written wav.
+
+        With an encoder the file is converted and renamed into place by its worker processes,
+        after this has returned; `metrics` then only counts it written once it is in place.
+        """
+        if self.encoder is not None:
+            on_done = None
+            if metrics is not None:
+                self.metrics.write_queued(metrics)
+                on_done = lambda ok: self.metrics.write_done(metrics, ok)
+            self.encoder.submit(self.to_numpy(audio), self.processor.audio_processor.sampling_rate, output_path,
+                                on_done=on_done)
+            return
+        partial_dir = os.path.join(self.output_dir, ".partial")
+        os.makedirs(partial_dir, exist_ok=True)
+        tmp_path = os.path.join(partial_dir, os.path.basename(output_path))
+        self.processor.save_audio(audio, output_path=tmp_path)
+        os.replace(tmp_path, output_path)
+
+    def emit(self, job, audio, output_path):
+        """Send audio to the job's IPC client, or save it to output_path. Returns where it went."""
+        if 'sink' in job:
+            self.send_audio(job['sink'], audio)
+            return "IPC client"
+        self.save_audio(audio, output_path, job['metrics'])
+        return output_path
+
+    def send_audio(self, sink, audio):
+        """Stream float audio to an IPC client as s16le mono PCM"""
+        if not sink.started:
+            sink.start(self.processor.audio_processor.sampling_rate, 1)
+        sink.write(to_s16le(self.to_numpy(audio)))
+
+    def generate_streaming(self, job, inputs, voice_key, stop_check=None):
+        """Generate while a writer thread flushes decoded audio into numbered segment wavs"""
+        streamer = AudioStreamer(batch_size=1)
+        writer = threading.Thread(target=self.write_stream, args=(job, streamer.get_stream(0)),
+                                  name="stream-writer", daemon=True)
+        writer.start()
+        start = time.time()
+        try:
+            outputs = self.generate(inputs, voice_key=voice_key, audio_streamer=streamer, stop_check_fn=stop_check)
+        finally:
+            streamer.end()
+            writer.join()
+        self.record_generation([job], inputs, outputs, time.time() - start)
+        job['metrics'].mark('written')
+        if self.is_cancelled(job):
+            job['metrics'].status = 'cancelled'
+
+        # Only a completed generation may end up in the result cache
+        streamed = job.pop('streamed_audio', None)
+        if streamed is not None and not self.is_cancelled(job):
+            self.cache_result(job, streamed)
+
+    def write_stream(self, job, stream):
+        txt_filename = os.path.splitext(os.path.basename(job['txt_path']))[0]
+        segment_samples = int(self.segment_seconds(job) * self.processor.audio_processor.sampling_rate)
+        pending = []
+        pending_samples = 0
+        index = 0
+        total_samples = 0
+        everything = []
+        start = time.time()
+        for chunk in stream:
+            job['metrics'].mark('first_audio')
+            chunk = chunk.detach().float().cpu().reshape(-1)
+            pending.append(chunk)
+            if self.result_cache is not None:
+                everything.append(chunk)
+            pending_samples += chunk.numel()
+            total_samples += chunk.numel()
+            if pending_samples >= segment_samples:
+                output_path = os.path.join(self.output_dir, f"{txt_filename}_generated_{index:03d}{self.extension}")
+                output_path = self.emit(job, torch.cat(pending), output_path)
+                print(f"Streamed segment {index} saved to {output_path} after {time.time() - start:.2f}s")
+                pending, pending_samples = [], 0
+                index += 1
+        if pending:
+            output_path = os.path.join(self.output_dir, f"{txt_filename}_generated_{index:03d}{self.extension}")
+            self.emit(job, torch.cat(pending), output_path)
+            index += 1
+        job['audio_seconds'] = total_samples / self.processor.audio_processor.sampling_rate
+        print(f"Streamed {index} segment(s) for {job['txt_path']} in {time.time() - start:.2f}s")
+        if everything:
+            job['streamed_audio'] = torch.cat(everything)
+
+    def generate(self, inputs, voice_key=None, **kwargs):
+        """Run model.generate, starting from a cached voice-prompt prefix when enabled"""
+        generate_kwargs = dict(
+            cfg_scale=self.current_cfg,
+            max_new_tokens=4096,
+            generation_config={'do_sample': False},
+            verbose=True,
+            tokenizer=self.processor.tokenizer,  # MUST be passed
+        )
+        generate_kwargs.update(kwargs)
+
+        prefix = None
+        if self.prefix_cache is not None and voice_key is not None:
+            try:
+                prefix = self.prefix_cache.get(voice_key, inputs)
+            except Exception as e:
+                print(f"Prefix cache unavailable, disabling it: {e}")
+                self.prefix_cache = None
+
+        with torch.no_grad():
+            if prefix is not None:
+                try:
+                    with self.prefix_cache.attach(*prefix):
+                        outputs = self.model.generate(**inputs, **generate_kwargs)
+                    print(f"Prefix cache: {self.prefix_cache.stats()} (skipped {prefix[0]} prefill tokens)")
+                    return outputs
+                except Exception as e:
+                    print(f"Generation from cached prefix failed, disabling prefix cache: {e}")
+                    self.prefix_cache = None
+            return self.model.generate(**inputs, **generate_kwargs)
+
+def set_cpu_threads(threads, interop_threads):
+    """Pin torch's intra-op and inter-op thread pools (0 keeps torch's default)"""
+    if threads > 0:
+        torch.set_num_threads(threads)
+    if interop_threads > 0:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            # Can only be set before the first parallel op runs in this process
+            pass
+
+
+def pool_worker_main(worker_id, device, threads, handler_args, handler_kwargs, queue_options, tasks, cancels,
+                     results):
+    """Entry point of a pool worker process: loads its own model and generates the txt paths it is sent"""
+    if str(device).startswith("cpu"):
+        set_cpu_threads(threads, 1)
+    # Same deadline settings as the parent's queue, so late jobs are downgraded here too
+    handler = TxtFileHandler(handler_args[0], handler_args[1], handler_args[2], device, *handler_args[3:],
+                             job_queue=JobQueue(**queue_options), **handler_kwargs)
+
+    def forward_cancels():
+        while True:
+            handler.job_queue.cancel(cancels.get())
+
+    threading.Thread(target=forward_cancels, name="cancel-listener", daemon=True).start()
+    results.put(('ready', worker_id, None, 0.0, True))
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        txt_path, priority, enqueued, late, backlog = task
+        # Track the file in this process's own queue so cancel requests from the parent reach it,
+        # enqueued when the parent got it so it has the same deadline
+        handler.job_queue.put(txt_path, priority, enqueued)
+        job = handler.job_queue.get(timeout=0)
+        if job is None:
+            # Went past its deadline on the way here
+            results.put(('done', worker_id, txt_path, 0.0, False))
+            continue
+        job.late = job.late or late
+        job.backlog = backlog
+        start = time.time()
+        ok = True
+        try:
+            handler.process_txt_file(job.txt_path)
+        except Exception as e:
+            ok = False
+            print(f"[worker {worker_id}] Error processing {txt_path}: {e}")
+            print(traceback.format_exc())
+        finally:
+            handler.job_queue.done(job)
+        results.put(('done', worker_id, txt_path, time.time() - start, ok))
+
+
+class ProcessWorkerPool:
+    """One model replica per worker process, all fed from the shared job queue.
+
+    A dispatcher thread hands each job to the ready worker with the fewest jobs in flight
+    (at most `max_inflight` each, so the rest wait in the job queue where they can still be
+    shed) and a collector thread marks jobs done as the workers report back. Workers are
+    spawned, not forked, so CUDA and torch's thread pools start clean in every replica.
+
+    A health check thread restarts worker processes that died and puts the jobs they had
+    in flight back at the front of the queue, up to `max_attempts` tries per job. A worker
+    that keeps dying before its model is even loaded is given up on. The same thread
+    forwards cancellations of running jobs to the worker generating them.
+    """
+
+    def __init__(self, job_queue, devices, handler_args, handler_kwargs, threads=1, max_inflight=1,
+                 max_attempts=2, max_restarts=3, health_interval=2.0):
+        self.job_queue = job_queue
+        self.handler_args = handler_args
+        self.handler_kwargs = handler_kwargs
+        self.threads = threads
+        self.max_inflight = max_inflight
+        self.max_attempts = max_attempts
+        self.max_restarts = max_restarts
+        self.health_interval = health_interval
+        self.context = multiprocessing.get_context("spawn")
+        self.results = self.context.Queue()
+        self.cond = threading.Condition()
+        self.workers = [{'id': i, 'device': device, 'ready': False, 'failed': False, 'inflight': {},
+                         'busy': 0.0, 'completed': 0, 'crashes': 0, 'early_crashes': 0}
+                        for i, device in enumerate(devices)]
+
+    def start_process(self, worker):
+        worker['tasks'] = self.context.Queue()
+        worker['cancels'] = self.context.Queue()
+        worker['ready'] = False
+        worker['process'] = self.context.Process(
+            target=pool_worker_main, name=f"generator-{worker['id']}", daemon=True,
+            args=(worker['id'], worker['device'], self.threads, self.handler_args, self.handler_kwargs,
+                  {'deadlines': self.job_queue.deadlines, 'deadline_policy': self.job_queue.deadline_policy},
+                  worker['tasks'], worker['cancels'], self.results))
+        worker['process'].start()
+
+    def start(self):
+        for worker in self.workers:
+            self.start_process(worker)
+        threading.Thread(target=self.dispatch, name="pool-dispatcher", daemon=True).start()
+        threading.Thread(target=self.collect, name="pool-collector", daemon=True).start()
+        threading.Thread(target=self.check_health, name="pool-health", daemon=True).start()
+        print(f"Started {len(self.workers)} worker process(es) on {', '.join(str(w['device']) for w in self.workers)}")
+
+    def dispatch(self):
+        while True:
+            job = self.job_queue.get()
+            with self.cond:
+                while True:
+                    if all(w['failed'] for w in self.workers):
+                        worker = None
+                        break
+                    available = [w for w in self.workers if w['ready'] and len(w['inflight']) < self.max_inflight]
+                    if available:
+                        # Fewest jobs in flight, then least busy so far so idle replicas share the work
+                        worker = min(available, key=lambda w: (len(w['inflight']), w['busy']))
+                        worker['inflight'][job.txt_path] = (job, time.time())
+                        break
+                    self.cond.wait()
+            if worker is None:
+                # Nothing can generate it; leave it and the rest of the backlog in the queue (and
+                # out of the ledger) so the next start picks them up
+                self.job_queue.requeue(job)
+                print(f"Error: no generator workers left, stopped dispatching with {self.job_queue.depth} job(s) queued")
+                return
+            # Each worker only sees its own job, so it is told its share of the parent's backlog
+            # to pick a quality level from
+            live = sum(1 for w in self.workers if not w['failed'])
+            backlog = -(-self.job_queue.depth // max(live, 1))
+            worker['tasks'].put((job.txt_path, job.priority, job.enqueued, job.late, backlog))
+
+    def collect(self):
+        while True:
+            kind, worker_id, txt_path, seconds, ok = self.results.get()
+            worker = self.workers[worker_id]
+            with self.cond:
+                if kind == 'ready':
+                    worker['ready'] = True
+                    worker['early_crashes'] = 0
+                    print(f"Worker {worker_id} ({worker['device']}) ready")
+                    self.cond.notify_all()
+                    continue
+                job, _ = worker['inflight'].pop(txt_path, (None, None))
+                if job is not None:
+                    worker['busy'] += seconds
+                    worker['completed'] += 1
+                self.cond.notify_all()
+            if job is not None:
+                print(f"Worker {worker_id} finished {job.name} in {seconds:.1f}s"
+                      f"{'' if ok else ' (failed)'}, queue depth {self.job_queue.depth}")
+                self.job_queue.done(job)
+
+    def check_health(self):
+        while True:
+            time.sleep(self.health_interval)
+            for worker in self.workers:
+                process = worker['process']
+                with self.cond:
+                    for txt_path, (job, _) in worker['inflight'].items():
+                        if job.cancelled.is_set() and not getattr(job, 'cancel_sent', False):
+                            job.cancel_sent = True
+                            worker['cancels'].put(txt_path)
+                if worker['failed'] or process.is_alive():
+                    continue
+                with self.cond:
+                    lost = list(worker['inflight'].values())
+                    worker['inflight'].clear()
+                    worker['ready'] = False
+                    worker['crashes'] += 1
+                    worker['early_crashes'] += 1
+                    if worker['early_crashes'] > self.max_restarts:
+                        worker['failed'] = True
+                        # The dispatcher may be waiting for a worker that will never be ready
+                        self.cond.notify_all()
+                print(f"Worker {worker['id']} ({worker['device']}) exited with code {process.exitcode}, "
+                      f"{len(lost)} job(s) in flight")
+                for job, _ in lost:
+                    if job.cancelled.is_set():
+                        print(f"Not retrying cancelled {job.name}")
+                        self.job_queue.done(job)
+                        continue
+                    job.attempts += 1
+                    if job.attempts < self.max_attempts:
+                        self.job_queue.requeue(job)
+                    else:
+                        print(f"Giving up on {job.name} after {job.attempts} crashed attempt(s)")
+                        self.job_queue.done(job)
+                if worker['failed']:
+                    print(f"Worker {worker['id']} ({worker['device']}) keeps failing to start, not restarting it")
+                    if all(w['failed'] for w in self.workers):
+                        print("Error: no generator workers left")
+                else:
+                    self.start_process(worker)
+
+    def stats(self):
+        return ', '.join(f"{w['device']}: {w['completed']} done, {w['busy']:.0f}s busy, {w['crashes']} crashes"
+                         for w in self.workers)
+
+
+def main(model_path, speaker_names, output_dir, device, cfg_scale, watch_dir, dtype,
+         queue_size=64, queue_policy='reject', scan_max_age=600, deadline_seconds=0, deadline_policy='drop',
+         cpu_profile=False, cpu_threads=0, cpu_interop_threads=0, cpu_workers=1, devices=None,
+         metrics_file=None, metrics_port=0, ipc_socket=None, **options):
+    deadlines = {priority: deadline_seconds for priority in PRIORITIES} if deadline_seconds > 0 else None
+    job_queue = JobQueue(queue_size, queue_policy, ledger_path=os.path.join(watch_dir, ".generated"),
+                         deadlines=deadlines, deadline_policy=deadline_policy)
+    metrics = MetricsRecorder(metrics_file, metrics_port)
+    metrics.add_source('queue', job_queue.stats)
+    if cpu_profile:
+        if dtype != "float32":
+            print(f"CPU profile runs in float32, ignoring --dtype {dtype}")
+        device, dtype = "cpu", "float32"
+        options['quantize'] = True
+        cpu_interop_threads = cpu_interop_threads or 1
+    if str(device).startswith("cpu"):
+        set_cpu_threads(cpu_threads, cpu_interop_threads)
+        print(f"Using {torch.get_num_threads()} intra-op and {torch.get_num_interop_threads()} inter-op CPU threads")
+    # One replica per listed device; several small single-threaded CPU replicas also beat one
+    # many-threaded model on short messages
+    pool_devices = list(devices or []) or ([device] * cpu_workers if cpu_workers > 1 else [])
+    if pool_devices:
+        # Workers append their per-job records to the shared file, the endpoint shows the pool
+        pool = ProcessWorkerPool(job_queue, pool_devices,
+                                 (model_path, speaker_names, output_dir, cfg_scale, dtype),
+                                 dict(options, metrics_file=metrics_file), threads=cpu_threads or 1)
+        metrics.add_source('workers', pool.stats)
+        pool.start()
+        if ipc_socket:
+            print("IPC jobs need the model in this process, ignoring --ipc_socket with a worker pool")
+    else:
+        handler = TxtFileHandler(model_path, speaker_names, output_dir, device, cfg_scale, dtype,
+                                 job_queue=job_queue, metrics=metrics, **options)
+        metrics.add_source('voice_cache', handler.voice_cache.stats)
+        if handler.result_cache is not None:
+            metrics.add_source('result_cache', handler.result_cache.stats)
+        if handler.encoder is not None:
+            metrics.add_source('encoder', handler.encoder.stats)
+        if handler.offloader is not None:
+            metrics.add_source('offload', handler.offloader.stats)
+        handler.start_workers()
+        if ipc_socket:
+            IPCServer(ipc_socket, handler.submit_ipc, handler.cancel_ipc).start()
+    metrics.start()
     observer = Observer()
-    observer.schedule(event_handler, watch_dir, recursive=False)
+    observer.schedule(IngestHandler(job_queue), watch_dir, recursive=False)
     observer.start()
     print(f"Watching folder: {watch_dir} for new .txt files...")
+    job_queue.scan(watch_dir, max_age=scan_max_age)
     try:
         while True:
             time.sleep(1)
@@ -182,6 +1646,8 @@ def main(model_path, speaker_names, output_dir, device, cfg_scale, watch_dir, dt
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="VibeVoice Watcher")
+    parser.add_argument("command", nargs="?", default="watch", choices=["watch", "snapshot"], help="watch: generate from the watch folder (default); snapshot: write a dtype-ready local copy of the model")
+    parser.add_argument("--snapshot_dir", type=str, default=None, help="Where the snapshot command writes (default ./snapshots/<model>-<dtype>)")
     parser.add_argument("--model_path", type=str, default="microsoft/VibeVoice-1.5b", help="Path to HuggingFace model directory")
     parser.add_argument("--speaker_names", type=str, nargs='+', default=['boris'], help="Speaker names in order")
     parser.add_argument("--output_dir", type=str, default="./outputs", help="Directory to save output audio files")
@@ -195,6 +1661,56 @@ if __name__ == "__main__":
     choices=["float32", "float16", "bfloat16"],
     help="Torch dtype to use for model (default: float32)",
 )
+    parser.add_argument("--voice_cache_mb", type=float, default=256, help="Memory cap for cached voice prompts in MB")
+    parser.add_argument("--prefix_cache", type=int, default=0, help="Number of voice-prompt KV prefixes to keep (0 disables)")
+    parser.add_argument("--batch_size", type=int, default=1, help="Maximum number of txt files generated together (1 disables batching)")
+    parser.add_argument("--batch_wait_ms", type=float, default=100, help="How long to wait for more files before starting a batch")
+    parser.add_argument("--queue_size", type=int, default=64, help="Maximum number of pending txt files")
+    parser.add_argument("--queue_policy", type=str, default="reject", choices=["reject", "drop_oldest"], help="What to do with new files when the queue is full")
+    parser.add_argument("--scan_max_age", type=float, default=600, help="Pick up unprocessed txt files up to this many seconds old at startup")
+    parser.add_argument("--deadline_seconds", type=float, default=0, help="Seconds a txt file may wait before it is too stale to generate (0 disables deadlines)")
+    parser.add_argument("--deadline_policy", type=str, default="drop", choices=["drop", "downgrade"], help="What to do with files that would miss their deadline: drop them or generate them at the fastest quality")
+    parser.add_argument("--stream_segment_seconds", type=float, default=0, help="Write audio in segments of this length while generating (0 disables streaming)")
+    parser.add_argument("--result_cache_dir", type=str, default="./result_cache", help="Directory for cached generated audio")
+    parser.add_argument("--result_cache_mb", type=float, default=0, help="Size cap of the generated audio cache in MB (0 disables it)")
+    parser.add_argument("--chunk_chars", type=int, default=0, help="Generate scripts longer than this many characters in windows (0 disables chunking)")
+    parser.add_argument("--chunk_crossfade_ms", type=float, default=30, help="Crossfade between generated windows in milliseconds")
+    parser.add_argument("--ddpm_steps", type=int, default=10, help="Diffusion steps per speech token")
+    parser.add_argument("--latency_target", type=float, default=0, help="Target seconds to audio; lowers steps/CFG while the queue is backed up (0 disables)")
+    parser.add_argument("--compile", action="store_true", help="torch.compile the LM and diffusion head and warm them up at startup")
+    parser.add_argument("--warmup", type=int, default=0, help="Number of synthetic warmup generations at startup")
+    parser.add_argument("--output_format", type=str, default="wav", choices=OUTPUT_FORMATS, help="wav: the model's rate; pcm48: 48 kHz stereo s16le wav; opus: Ogg Opus the bot sends without re-encoding")
+    parser.add_argument("--output_workers", type=int, default=2, help="Worker processes that resample/encode output with --output_format pcm48 or opus")
+    parser.add_argument("--metrics_file", type=str, default=None, help="Append one JSON line of timings per generated file here")
+    parser.add_argument("--metrics_port", type=int, default=0, help="Serve a JSON metrics summary on 127.0.0.1:<port>/metrics (0 disables)")
+    parser.add_argument("--ipc_socket", type=str, default=None, help="Also accept scripts on this Unix socket and stream the audio back to the client (e.g. /tmp/vibevoice.sock)")
+    parser.add_argument("--cpu_profile", action="store_true", help="CPU inference: float32 with int8 dynamic quantization of the LM")
+    parser.add_argument("--cpu_threads", type=int, default=0, help="Intra-op CPU threads per model (0 uses torch's default)")
+    parser.add_argument("--cpu_interop_threads", type=int, default=0, help="Inter-op CPU threads (0 uses torch's default, 1 with --cpu_profile)")
+    parser.add_argument("--pipeline_depth", type=int, default=0, help="Prepare upcoming files and write finished ones on background threads, this many files deep (0 disables)")
+    parser.add_argument("--idle_offload_minutes", type=float, default=0, help="Move the model to pinned host memory after this many idle minutes (0 keeps it on the GPU)")
+    parser.add_argument("--devices", type=str, nargs='+', default=None, help="Run one model replica per listed device (e.g. cuda:0 cuda:1) in separate worker processes")
+    parser.add_argument("--cpu_workers", type=int, default=1, help="Number of model worker processes; each gets --cpu_threads (default 1) threads")
     args = parser.parse_args()
+    if args.cpu_profile and any(not device.startswith("cpu") for device in args.devices or []):
+        parser.error("--cpu_profile quantizes for CPU inference, it can't be combined with non-cpu --devices")
+
+    if args.command == "snapshot":
+        snapshot_dir = args.snapshot_dir or os.path.join("./snapshots", f"{os.path.basename(args.model_path.rstrip('/'))}-{args.dtype}")
+        write_snapshot(args.model_path, args.dtype, snapshot_dir)
+        raise SystemExit(0)
 
-    main(args.model_path, args.speaker_names, args.output_dir, args.device, args.cfg_scale, args.watch_dir, args.dtype)
+    main(args.model_path, args.speaker_names, args.output_dir, args.device, args.cfg_scale, args.watch_dir, args.dtype,
+         voice_cache_mb=args.voice_cache_mb, prefix_cache=args.prefix_cache,
+         batch_size=args.batch_size, batch_wait_ms=args.batch_wait_ms,
+         queue_size=args.queue_size, queue_policy=args.queue_policy, scan_max_age=args.scan_max_age,
+         deadline_seconds=args.deadline_seconds, deadline_policy=args.deadline_policy,
+         stream_segment_seconds=args.stream_segment_seconds,
+         result_cache_dir=args.result_cache_dir, result_cache_mb=args.result_cache_mb,
+         chunk_chars=args.chunk_chars, chunk_crossfade_ms=args.chunk_crossfade_ms,
+         ddpm_steps=args.ddpm_steps, latency_target=args.latency_target,
+         compile=args.compile, warmup=args.warmup, idle_offload_minutes=args.idle_offload_minutes,
+         pipeline_depth=args.pipeline_depth, cpu_profile=args.cpu_profile, cpu_threads=args.cpu_threads,
+         cpu_interop_threads=args.cpu_interop_threads, cpu_workers=args.cpu_workers, devices=args.devices,
+         metrics_file=args.metrics_file, metrics_port=args.metrics_port, ipc_socket=args.ipc_socket,
+         output_format=args.output_format, output_workers=args.output_workers)
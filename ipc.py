@@ -0,0 +1,325 @@
+"""Unix-domain-socket transport between discord-bot.py and the generators.
+
+The filesystem handoff (txt file in, wav file out, a watchdog on each side) stays the
+default and the fallback; this carries the same jobs and the resulting PCM directly.
+
+Every frame is a 4-byte header length and a 4-byte payload length (big endian), a JSON
+header, then the raw payload:
+
+    client -> server  {"type": "job", "id", "name", "script", "priority"}
+                      {"type": "cancel", "id"}
+    server -> client  {"type": "start", "id", "sample_rate", "channels", "format"}
+                      {"type": "audio", "id"} + PCM bytes (s16le, interleaved)
+                      {"type": "end", "id", "status"}
+
+Audio payloads are at most MAX_PAYLOAD bytes; a generator that hands over a whole clip at
+once has it split into several audio frames, so other jobs' frames on the same connection
+are not held up behind it. A job the server could not queue ends with status "rejected"
+before any audio; the client hands its script back in the Clip so the caller can fall back
+to a txt file.
+"""
+import io
+import json
+import os
+import socket
+import struct
+import threading
+import uuid
+import wave
+
+FRAME = struct.Struct('>II')
+MAX_PAYLOAD = 64 * 1024
+
+
+def send_frame(sock, header, payload=b''):
+    blob = json.dumps(header).encode('utf-8')
+    sock.sendall(FRAME.pack(len(blob), len(payload)) + blob)
+    if payload:
+        sock.sendall(payload)
+
+
+def recv_exact(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if count == 0:
+            return None
+        received += count
+    return bytes(buffer)
+
+
+def read_frame(sock):
+    """Read one (header, payload) frame, or None once the peer has closed the socket"""
+    prefix = recv_exact(sock, FRAME.size)
+    if prefix is None:
+        return None
+    header_len, payload_len = FRAME.unpack(prefix)
+    blob = recv_exact(sock, header_len)
+    payload = recv_exact(sock, payload_len) if payload_len else b''
+    if blob is None or payload is None:
+        return None
+    return json.loads(blob.decode('utf-8')), payload
+
+
+class Connection:
+    """One connected client; sends from several worker threads are serialized"""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def send(self, header, payload=b''):
+        if self.closed:
+            return False
+        try:
+            with self.lock:
+                send_frame(self.sock, header, payload)
+            return True
+        except OSError:
+            self.closed = True
+            return False
+
+    def close(self):
+        self.closed = True
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class AudioSink:
+    """Where a generator writes one IPC job's audio instead of a wav file"""
+
+    def __init__(self, connection, job_id):
+        self.connection = connection
+        self.job_id = job_id
+        self.started = False
+        self.ended = False
+        self.frame_bytes = 2
+
+    def start(self, sample_rate, channels=1, format='s16le'):
+        self.started = True
+        self.frame_bytes = 2 * channels
+        self.connection.send({'type': 'start', 'id': self.job_id, 'sample_rate': sample_rate,
+                              'channels': channels, 'format': format})
+
+    def write(self, pcm):
+        # Split on whole sample frames so every payload can be played on its own
+        step = MAX_PAYLOAD - MAX_PAYLOAD % self.frame_bytes
+        for offset in range(0, len(pcm), step):
+            if not self.connection.send({'type': 'audio', 'id': self.job_id}, pcm[offset:offset + step]):
+                return
+
+    def end(self, status='ok'):
+        if self.ended:
+            return
+        self.ended = True
+        self.connection.send({'type': 'end', 'id': self.job_id, 'status': status})
+
+
+class IPCServer:
+    """Accepts jobs on a Unix socket and hands them to submit(job_id, script, priority, sink).
+
+    submit returns False if the job was not accepted (queue full, duplicate), in which case
+    the client is told right away. cancel(job_id) is called for cancel messages.
+    """
+
+    def __init__(self, socket_path, submit, cancel=None):
+        self.socket_path = socket_path
+        self.submit = submit
+        self.cancel = cancel
+        self.sock = None
+
+    def start(self):
+        if os.path.exists(self.socket_path):
+            # Left over from a previous run; a live server would still hold it open
+            os.remove(self.socket_path)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.socket_path)
+        os.chmod(self.socket_path, 0o660)
+        self.sock.listen()
+        threading.Thread(target=self.accept_loop, name="ipc-accept", daemon=True).start()
+        print(f"Listening for IPC jobs on {self.socket_path}")
+
+    def accept_loop(self):
+        while True:
+            try:
+                client, _ = self.sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self.serve, args=(Connection(client),), name="ipc-client", daemon=True).start()
+
+    def serve(self, connection):
+        try:
+            while True:
+                frame = read_frame(connection.sock)
+                if frame is None:
+                    break
+                header, _ = frame
+                if header.get('type') == 'job':
+                    sink = AudioSink(connection, header['id'])
+                    try:
+                        accepted = self.submit(header['id'], header['script'], header.get('priority', 'normal'), sink)
+                    except Exception as e:
+                        print(f"Error accepting IPC job {header['id']}: {e}")
+                        accepted = False
+                    if not accepted:
+                        sink.end('rejected')
+                elif header.get('type') == 'cancel' and self.cancel is not None:
+                    self.cancel(header['id'])
+        except (OSError, ValueError) as e:
+            print(f"IPC connection error: {e}")
+        finally:
+            connection.close()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            try:
+                os.remove(self.socket_path)
+            except OSError:
+                pass
+
+
+class Clip:
+    """A finished IPC job: the whole utterance as interleaved s16le PCM.
+
+    When the client streamed the audio to on_audio instead, `pcm` is empty and `streamed`
+    is how many bytes of it there were. `script` is what was submitted, for falling back to
+    a txt file when the job was rejected or lost.
+    """
+
+    def __init__(self, job_id, name, status, sample_rate=0, channels=1, pcm=b'', streamed=0, script=None):
+        self.job_id = job_id
+        self.name = name
+        self.status = status
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.pcm = pcm
+        self.streamed = streamed
+        self.script = script
+
+    @property
+    def duration(self):
+        if not self.sample_rate:
+            return 0.0
+        return (len(self.pcm) or self.streamed) / (2 * self.channels * self.sample_rate)
+
+    def to_wav(self):
+        """The clip as an in-memory wav, for players that want a container rather than raw PCM"""
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as wav:
+            wav.setnchannels(self.channels)
+            wav.setsampwidth(2)
+            wav.setframerate(self.sample_rate)
+            wav.writeframes(self.pcm)
+        return buffer.getvalue()
+
+    def __repr__(self):
+        return f"Clip({self.name}, {self.status}, {self.duration:.2f}s)"
+
+
+class IPCClient:
+    """Submits scripts to a generator's socket and collects the audio that comes back.
+
+    Finished clips are passed to on_clip(clip) from the reader thread. With `on_audio`, every
+    chunk is passed to on_audio(job_id, name, sample_rate, channels, pcm) as soon as it
+    arrives instead of being collected, so playback can start while the rest is generated;
+    on_clip then only reports how the job ended. submit() reconnects if needed and returns
+    None when the generator can't be reached, so the caller can fall back to writing a txt
+    file.
+    """
+
+    def __init__(self, socket_path, on_clip, on_audio=None):
+        self.socket_path = socket_path
+        self.on_clip = on_clip
+        self.on_audio = on_audio
+        self.connection = None
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    @property
+    def connected(self):
+        return self.connection is not None and not self.connection.closed
+
+    def connect(self):
+        with self.lock:
+            if self.connected:
+                return True
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.socket_path)
+            except OSError:
+                sock.close()
+                return False
+            self.connection = Connection(sock)
+            self.pending = {}
+        threading.Thread(target=self.read_loop, args=(self.connection,), name="ipc-reader", daemon=True).start()
+        print(f"Connected to generator at {self.socket_path}")
+        return True
+
+    def submit(self, script, name=None, priority='normal'):
+        if not self.connect():
+            return None
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            self.pending[job_id] = {'name': name or job_id, 'script': script, 'sample_rate': 0, 'channels': 1,
+                                    'chunks': [], 'streamed': 0}
+        if not self.connection.send({'type': 'job', 'id': job_id, 'name': name, 'script': script,
+                                     'priority': priority}):
+            with self.lock:
+                self.pending.pop(job_id, None)
+            return None
+        return job_id
+
+    def cancel(self, job_id):
+        return self.connected and self.connection.send({'type': 'cancel', 'id': job_id})
+
+    def cancel_all(self):
+        with self.lock:
+            job_ids = list(self.pending)
+        for job_id in job_ids:
+            self.cancel(job_id)
+        return len(job_ids)
+
+    def read_loop(self, connection):
+        try:
+            while True:
+                frame = read_frame(connection.sock)
+                if frame is None:
+                    break
+                header, payload = frame
+                with self.lock:
+                    entry = self.pending.get(header.get('id'))
+                    if entry is None:
+                        continue
+                    if header['type'] == 'start':
+                        entry['sample_rate'] = header['sample_rate']
+                        entry['channels'] = header['channels']
+                    elif header['type'] == 'audio':
+                        if self.on_audio is not None:
+                            entry['streamed'] += len(payload)
+                        else:
+                            entry['chunks'].append(payload)
+                    elif header['type'] == 'end':
+                        del self.pending[header['id']]
+                if header['type'] == 'audio' and self.on_audio is not None and payload:
+                    self.on_audio(header['id'], entry['name'], entry['sample_rate'], entry['channels'], payload)
+                elif header['type'] == 'end':
+                    self.on_clip(Clip(header['id'], entry['name'], header['status'], entry['sample_rate'],
+                                      entry['channels'], b''.join(entry['chunks']), entry['streamed'],
+                                      entry['script']))
+        except (OSError, ValueError) as e:
+            print(f"IPC connection error: {e}")
+        finally:
+            connection.close()
+            print("Disconnected from generator")
+            # Jobs that were in flight are lost with the connection
+            with self.lock:
+                lost, self.pending = self.pending, {}
+            for job_id, entry in lost.items():
+                self.on_clip(Clip(job_id, entry['name'], 'disconnected', script=entry['script']))
+
@@ -0,0 +1,376 @@
+import heapq
+import itertools
+import os
+import threading
+import time
+import traceback
+from watchdog.events import FileSystemEventHandler
+
+
+CANCEL_SUFFIX = ".cancel"
+# Scheduling classes, served strictly in this order
+PRIORITIES = {'high': 0, 'normal': 1, 'low': 2}
+
+_sequence = itertools.count()
+
+
+class Job:
+    """A pending txt file waiting for a generator worker"""
+
+    def __init__(self, txt_path, priority='normal', enqueued=None, deadline=None, ledger=True):
+        self.txt_path = os.path.abspath(txt_path)
+        self.name = os.path.basename(txt_path)
+        self.priority = priority
+        self.enqueued = enqueued if enqueued is not None else time.time()
+        self.deadline = deadline
+        self.ledger = ledger
+        self.seq = next(_sequence)
+        self.started = None
+        self.late = False
+        # Jobs waiting behind this one in another process's queue, for a job handed to a pool worker
+        self.backlog = 0
+        self.attempts = 0
+        self.cancelled = threading.Event()
+
+    def sort_key(self):
+        deadline = self.deadline if self.deadline is not None else float('inf')
+        return (PRIORITIES.get(self.priority, PRIORITIES['normal']), deadline, self.seq)
+
+    def __lt__(self, other):
+        return self.sort_key() < other.sort_key()
+
+    def __repr__(self):
+        return f"Job({self.name})"
+
+
+class JobQueue:
+    """Bounded, deduplicating queue between the watchdog observer and the inference workers.
+
+    The observer thread only calls put(); workers call get() and done(). When the queue is
+    full the `policy` decides what happens: 'reject' drops the new file, 'drop_oldest' sheds
+    the oldest pending one to make room. Finished files are appended to a ledger in the watch
+    directory so a restart only picks up files that were never generated.
+
+    Jobs are served by priority class, then earliest deadline first. `deadlines` maps a
+    class to the seconds a job of that class may take from being written to being
+    generated. When a job is taken, one that is already past its deadline is dropped,
+    and one that would miss it at the current service time is dropped or flagged `late`
+    (so the worker takes a faster path) depending on `deadline_policy`.
+
+    cancel() drops a pending job outright and flags a running one, workers poll
+    is_cancelled() between generation steps and give up on the job as soon as it is set.
+
+    Callables in `listeners` are called with every job the queue is finished with, whether
+    it was generated, shed, expired or cancelled.
+    """
+
+    def __init__(self, maxsize=64, policy='reject', ledger_path=None, deadlines=None, deadline_policy='drop'):
+        if policy not in ('reject', 'drop_oldest'):
+            raise ValueError(f"Unsupported queue policy: {policy}")
+        if deadline_policy not in ('drop', 'downgrade'):
+            raise ValueError(f"Unsupported deadline policy: {deadline_policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self.ledger_path = ledger_path
+        self.deadlines = deadlines or {}
+        self.deadline_policy = deadline_policy
+        self.service_seconds = None
+        self.pending = []
+        self.active = {}
+        self.listeners = []
+        self.cond = threading.Condition()
+        self.ledger_lock = threading.Lock()
+        self.accepted = 0
+        self.duplicates = 0
+        self.shed = 0
+        self.completed = 0
+        self.cancelled = 0
+        self.expired = 0
+        self.downgraded = 0
+
+    @property
+    def depth(self):
+        return len(self.pending)
+
+    def put(self, txt_path, priority='normal', enqueued=None, ledger=True):
+        """Enqueue a txt file, returns False if it was a duplicate or got rejected.
+
+        Jobs put with `ledger=False` (IPC scripts, which have no txt file a restart could
+        pick up again) are never written to the ledger.
+        """
+        job = Job(txt_path, priority, enqueued, ledger=ledger)
+        budget = self.deadlines.get(priority)
+        if budget:
+            job.deadline = job.enqueued + budget
+        with self.cond:
+            if job.txt_path in self.active:
+                self.duplicates += 1
+                return False
+            if len(self.pending) >= self.maxsize:
+                if self.policy == 'reject':
+                    self.shed += 1
+                    self.record(job)
+                    print(f"Job queue full ({self.maxsize}), rejecting {job.name}")
+                    return False
+                dropped = min(self.pending, key=lambda j: j.seq)
+                self.remove_pending(dropped)
+                self.active.pop(dropped.txt_path, None)
+                self.shed += 1
+                self.record(dropped)
+                print(f"Job queue full ({self.maxsize}), shedding oldest job {dropped.name}")
+            heapq.heappush(self.pending, job)
+            self.active[job.txt_path] = job
+            self.accepted += 1
+            print(f"Queued {job.name} (depth {len(self.pending)}/{self.maxsize})")
+            self.cond.notify()
+        return True
+
+    def get(self, timeout=None):
+        """Take the next job, blocking up to `timeout` seconds. Returns None on timeout."""
+        wait_until = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.cond:
+                while not self.pending:
+                    remaining = None if wait_until is None else wait_until - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return None
+                    self.cond.wait(remaining)
+                job = heapq.heappop(self.pending)
+                if not self.expire(job):
+                    job.started = time.time()
+                    return job
+                self.active.pop(job.txt_path, None)
+                self.expired += 1
+            self.record(job)
+
+    def expire(self, job):
+        """Decide whether a job that is about to start should be dropped (caller holds the lock)"""
+        if job.deadline is None:
+            return False
+        now = time.time()
+        if now > job.deadline:
+            print(f"Dropping {job.name}: {now - job.deadline:.0f}s past its deadline")
+            return True
+        if self.service_seconds is not None and now + self.service_seconds > job.deadline:
+            if self.deadline_policy == 'drop':
+                print(f"Dropping {job.name}: it would finish {now + self.service_seconds - job.deadline:.0f}s "
+                      f"after its deadline")
+                return True
+            if not job.late:
+                job.late = True
+                self.downgraded += 1
+                print(f"{job.name} can't make its deadline at full quality, downgrading it")
+        return False
+
+    def expire_taken(self, job):
+        """Drop a job that was taken but waited past its deadline before it could start.
+
+        Returns False if it is still on time; otherwise the job is finished as expired and
+        must not be passed to done().
+        """
+        with self.cond:
+            if job.deadline is None or time.time() <= job.deadline:
+                return False
+            if self.active.get(job.txt_path) is job:
+                del self.active[job.txt_path]
+            self.expired += 1
+        print(f"Dropping {job.name}: {time.time() - job.deadline:.0f}s past its deadline")
+        self.record(job)
+        return True
+
+    def remove_pending(self, job):
+        # Caller holds the lock
+        self.pending.remove(job)
+        heapq.heapify(self.pending)
+
+    def job_for(self, txt_path):
+        """The queued or running Job for a txt path, or None"""
+        with self.cond:
+            return self.active.get(os.path.abspath(txt_path))
+
+    def requeue(self, job):
+        """Put a job that was taken but not finished back in the queue, keeping its place in line.
+
+        It is still in the active set, so this bypasses the duplicate check and the size limit.
+        """
+        with self.cond:
+            heapq.heappush(self.pending, job)
+            self.cond.notify()
+        print(f"Re-queued {job.name} (depth {len(self.pending)}/{self.maxsize})")
+
+    def done(self, job):
+        with self.cond:
+            if self.active.get(job.txt_path) is job:
+                del self.active[job.txt_path]
+            if job.cancelled.is_set():
+                self.cancelled += 1
+            else:
+                self.completed += 1
+                if job.started is not None:
+                    # Moving average of take-to-done time, used to predict deadline misses
+                    elapsed = time.time() - job.started
+                    self.service_seconds = elapsed if self.service_seconds is None else \
+                        0.8 * self.service_seconds + 0.2 * elapsed
+        self.record(job)
+
+    def cancel(self, txt_path):
+        """Cancel a queued or running job, returns False if it is not known"""
+        txt_path = os.path.abspath(txt_path)
+        with self.cond:
+            job = self.active.get(txt_path)
+            if job is None:
+                return False
+            job.cancelled.set()
+            if job not in self.pending:
+                print(f"Cancelling {job.name} while it is generating")
+                return True
+            self.remove_pending(job)
+            del self.active[txt_path]
+            self.cancelled += 1
+        print(f"Cancelled queued job {job.name}")
+        self.record(job)
+        return True
+
+    def cancel_all(self):
+        with self.cond:
+            paths = list(self.active)
+        for path in paths:
+            self.cancel(path)
+        return len(paths)
+
+    def is_cancelled(self, txt_path):
+        job = self.job_for(txt_path)
+        return job is not None and job.cancelled.is_set()
+
+    def handle_cancel_file(self, path):
+        """Act on a '<name>.cancel' control file (or 'all.cancel') dropped into the watch folder"""
+        name = os.path.basename(path)[:-len(CANCEL_SUFFIX)]
+        if name == 'all':
+            print(f"Cancelling all {self.cancel_all()} queued and running job(s)")
+        elif not self.cancel(os.path.join(os.path.dirname(path), name + '.txt')):
+            print(f"Nothing to cancel for {name}")
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def record(self, job):
+        """Append a finished or shed job to the ledger so scan() skips it after a restart"""
+        if self.ledger_path and job.ledger:
+            try:
+                with self.ledger_lock, open(self.ledger_path, 'a', encoding='utf-8') as f:
+                    f.write(job.name + '\n')
+            except OSError as e:
+                print(f"Error updating job ledger {self.ledger_path}: {e}")
+        for listener in self.listeners:
+            listener(job)
+
+    def scan(self, watch_dir, max_age=600, priority='normal'):
+        """Enqueue txt files already in watch_dir that are not in the ledger and not too old"""
+        now = time.time()
+        finished = self.compact_ledger(watch_dir, max_age, now)
+        candidates = []
+        for name in os.listdir(watch_dir):
+            path = os.path.join(watch_dir, name)
+            if not name.endswith('.txt') or name in finished or not os.path.isfile(path):
+                continue
+            mtime = os.path.getmtime(path)
+            if max_age is None or now - mtime <= max_age:
+                candidates.append((mtime, path))
+        for mtime, path in sorted(candidates):
+            # Deadlines count from when the file was written, not from this restart
+            self.put(path, priority, enqueued=mtime)
+        if candidates:
+            print(f"Picked up {len(candidates)} existing file(s) from {watch_dir}")
+
+    def compact_ledger(self, watch_dir, max_age, now):
+        """Read the ledger and rewrite it without the entries no scan() could use any more.
+
+        Only txt files that are still in watch_dir and within max_age would be picked up
+        again, so that also bounds the ledger to what a restart can actually see.
+        """
+        if not self.ledger_path or not os.path.exists(self.ledger_path):
+            return set()
+        with self.ledger_lock:
+            try:
+                with open(self.ledger_path, 'r', encoding='utf-8') as f:
+                    entries = {line.strip() for line in f if line.strip()}
+            except OSError as e:
+                print(f"Error reading job ledger {self.ledger_path}: {e}")
+                return set()
+            finished = set()
+            for name in entries:
+                try:
+                    mtime = os.path.getmtime(os.path.join(watch_dir, name))
+                except OSError:
+                    continue
+                if max_age is None or now - mtime <= max_age:
+                    finished.add(name)
+            if len(finished) < len(entries):
+                tmp_path = self.ledger_path + '.tmp'
+                try:
+                    with open(tmp_path, 'w', encoding='utf-8') as f:
+                        f.writelines(name + '\n' for name in sorted(finished))
+                    os.replace(tmp_path, self.ledger_path)
+                except OSError as e:
+                    print(f"Error compacting job ledger {self.ledger_path}: {e}")
+        return finished
+
+    def stats(self):
+        return {
+            'depth': len(self.pending),
+            'maxsize': self.maxsize,
+            'accepted': self.accepted,
+            'duplicates': self.duplicates,
+            'shed': self.shed,
+            'completed': self.completed,
+            'cancelled': self.cancelled,
+            'expired': self.expired,
+            'downgraded': self.downgraded,
+        }
+
+
+class IngestHandler(FileSystemEventHandler):
+    """Watchdog handler that queues new txt files with the folder's priority.
+
+    Dropping a '<name>.cancel' file next to '<name>.txt', or deleting the txt file, cancels
+    that job; 'all.cancel' cancels everything queued or running.
+    """
+
+    def __init__(self, job_queue, priority='normal'):
+        self.job_queue = job_queue
+        self.priority = priority
+
+    def on_created(self, event):
+        if event.is_directory:
+            return
+        if event.src_path.endswith(CANCEL_SUFFIX):
+            self.job_queue.handle_cancel_file(event.src_path)
+        elif event.src_path.endswith(".txt"):
+            print(f"New text file detected: {event.src_path}")
+            self.job_queue.put(event.src_path, self.priority)
+
+    def on_deleted(self, event):
+        if not event.is_directory and event.src_path.endswith(".txt"):
+            self.job_queue.cancel(event.src_path)
+
+
+def start_workers(queue, process_fn, count=1, name="inference-worker"):
+    """Start `count` daemon threads that feed jobs from `queue` into `process_fn(job)`"""
+    def work():
+        while True:
+            job = queue.get()
+            try:
+                process_fn(job)
+            except Exception as e:
+                print(f"Error processing {job.txt_path}: {e}")
+                print(traceback.format_exc())
+            finally:
+                queue.done(job)
+
+    threads = []
+    for i in range(count):
+        thread = threading.Thread(target=work, name=f"{name}-{i}", daemon=True)
+        thread.start()
+        threads.append(thread)
+    return threads
@@ -0,0 +1,226 @@
+import json
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import torch
+
+# Timeline of a job, in order. Each stage's duration is measured from the previous stage
+# that was actually reached, so a cache hit simply has no preprocess/generate stages.
+STAGES = ('detected', 'read', 'parsed', 'preprocessed', 'first_audio', 'generated', 'written')
+
+
+class JobMetrics:
+    """Timestamps and counters for one txt file as it goes through a generator.
+
+    While files of the job are still queued on an output encoder, 'written' and the final
+    record wait for the last of them to be renamed into place.
+    """
+
+    def __init__(self, txt_path, detected=None):
+        self.txt_path = txt_path
+        self.marks = {'detected': detected if detected is not None else time.time()}
+        self.status = 'ok'
+        self.audio_seconds = 0.0
+        self.tokens = 0
+        self.generate_seconds = 0.0
+        self.peak_memory = 0
+        self.finished = False
+        self.writes = 0
+        self.write_failed = False
+        self.written_pending = False
+        self.deferred_status = None
+        self.finish_deferred = False
+        self.lock = threading.Lock()
+
+    def mark(self, stage, when=None):
+        """Record the first time a stage is reached"""
+        with self.lock:
+            if stage == 'written' and self.writes:
+                self.written_pending = True
+                return
+            if stage not in self.marks:
+                self.marks[stage] = when if when is not None else time.time()
+
+    def durations(self):
+        durations = {}
+        previous = self.marks['detected']
+        for stage in STAGES[1:]:
+            if stage in self.marks:
+                durations[stage] = self.marks[stage] - previous
+                previous = self.marks[stage]
+        end = max(self.marks.values())
+        durations['total'] = end - self.marks['detected']
+        if 'first_audio' in self.marks:
+            durations['time_to_first_audio'] = self.marks['first_audio'] - self.marks['detected']
+        return durations
+
+    def to_dict(self):
+        record = {
+            'txt_path': self.txt_path,
+            'status': self.status,
+            'detected': self.marks['detected'],
+            'seconds': {k: round(v, 4) for k, v in self.durations().items()},
+            'audio_seconds': round(self.audio_seconds, 3),
+            'tokens': self.tokens,
+            'peak_memory_mb': round(self.peak_memory / 1024 / 1024, 1),
+        }
+        if self.generate_seconds > 0:
+            if self.tokens:
+                record['tokens_per_second'] = round(self.tokens / self.generate_seconds, 2)
+            if self.audio_seconds > 0:
+                record['rtf'] = round(self.generate_seconds / self.audio_seconds, 3)
+        return record
+
+
+class MetricsRecorder:
+    """Collects finished JobMetrics, appends them to a JSON lines file and serves a summary.
+
+    The summary (GET /metrics on 127.0.0.1:`port`) has per-stage mean/p50/p95 over the last
+    `window` jobs, throughput and RTF, job counts by status, and whatever the registered
+    `sources` report (queue depth, cache stats...). Without a file or a port it only keeps
+    the in-memory window, so instrumentation costs nothing measurable when unused.
+    """
+
+    def __init__(self, jsonl_path=None, port=0, window=200):
+        self.jsonl_path = jsonl_path
+        self.port = port
+        self.recent = deque(maxlen=window)
+        self.counts = {}
+        self.total_audio_seconds = 0.0
+        self.sources = {}
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.server = None
+
+    def start(self):
+        if self.port <= 0:
+            return
+        recorder = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/') not in ('', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = json.dumps(recorder.summary(), indent=2, default=str).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', self.port), Handler)
+        threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True).start()
+        print(f"Serving metrics on http://127.0.0.1:{self.port}/metrics")
+
+    def add_source(self, name, fn):
+        """Include fn()'s result under `name` in every summary"""
+        self.sources[name] = fn
+
+    def begin(self, txt_path, detected=None):
+        return JobMetrics(txt_path, detected)
+
+    def write_queued(self, metrics):
+        """A file of this job was handed to an output encoder and is not in place yet"""
+        with metrics.lock:
+            metrics.writes += 1
+
+    def write_done(self, metrics, ok=True):
+        """The encoder renamed a queued file into place (or failed to), called from its callback"""
+        with metrics.lock:
+            metrics.writes -= 1
+            metrics.write_failed = metrics.write_failed or not ok
+            if metrics.writes:
+                return
+            if metrics.written_pending and ok:
+                metrics.marks.setdefault('written', time.time())
+            if not metrics.finish_deferred:
+                return
+            status = metrics.deferred_status
+        self.finish(metrics, status)
+
+    def finish(self, metrics, status=None):
+        """Record a job once; later calls for the same job are ignored.
+
+        With encoder writes still outstanding the record is made by the last write_done().
+        """
+        if metrics is None:
+            return
+        with metrics.lock:
+            if metrics.finished:
+                return
+            if metrics.writes:
+                if not metrics.finish_deferred:
+                    metrics.finish_deferred = True
+                    metrics.deferred_status = status
+                return
+            metrics.finished = True
+        if metrics.write_failed:
+            status = 'failed'
+        if status is not None:
+            metrics.status = status
+        record = metrics.to_dict()
+        with self.lock:
+            self.recent.append(record)
+            self.counts[metrics.status] = self.counts.get(metrics.status, 0) + 1
+            self.total_audio_seconds += metrics.audio_seconds
+            if self.jsonl_path:
+                try:
+                    with open(self.jsonl_path, 'a', encoding='utf-8') as f:
+                        f.write(json.dumps(record) + '\n')
+                except OSError as e:
+                    print(f"Error writing metrics to {self.jsonl_path}: {e}")
+
+    @staticmethod
+    def percentile(values, q):
+        values = sorted(values)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def summary(self):
+        with self.lock:
+            recent = list(self.recent)
+            summary = {
+                'uptime_seconds': round(time.time() - self.started, 1),
+                'jobs': dict(self.counts),
+                'audio_seconds_total': round(self.total_audio_seconds, 1),
+            }
+        stages = {}
+        for record in recent:
+            for stage, seconds in record['seconds'].items():
+                stages.setdefault(stage, []).append(seconds)
+        summary['stages'] = {stage: {'mean': round(sum(v) / len(v), 4),
+                                     'p50': round(self.percentile(v, 0.5), 4),
+                                     'p95': round(self.percentile(v, 0.95), 4)}
+                             for stage, v in stages.items()}
+        rtfs = [r['rtf'] for r in recent if 'rtf' in r]
+        if rtfs:
+            summary['rtf'] = {'mean': round(sum(rtfs) / len(rtfs), 3), 'p95': round(self.percentile(rtfs, 0.95), 3)}
+        speeds = [r['tokens_per_second'] for r in recent if r.get('tokens_per_second')]
+        if speeds:
+            summary['tokens_per_second'] = round(sum(speeds) / len(speeds), 2)
+        peaks = [r['peak_memory_mb'] for r in recent if r['peak_memory_mb']]
+        if peaks:
+            summary['peak_memory_mb'] = max(peaks)
+        for name, fn in self.sources.items():
+            try:
+                summary[name] = fn()
+            except Exception as e:
+                summary[name] = f"error: {e}"
+        return summary
+
+
+def reset_peak_memory(device):
+    if torch.device(device).type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(device)
+
+
+def peak_memory(device):
+    """Peak allocated device memory in bytes since the last reset (cuda only, 0 elsewhere)"""
+    if torch.device(device).type == 'cuda':
+        return torch.cuda.max_memory_allocated(device)
+    return 0
@@ -0,0 +1,109 @@
+import threading
+import time
+from contextlib import contextmanager
+
+import torch
+
+
+class IdleOffloader:
+    """Moves a resident model's weights to pinned host memory when no job has run for a while.
+
+    Every use of the model goes through use(): it brings the weights back first if they were
+    offloaded, and keeps the watcher thread from offloading while a job is running. Both
+    directions are plain DMA copies instead of a from_pretrained() reload. The pinned host
+    copies only live while the model is offloaded; they are freed again once the weights are
+    back on the device. Callbacks in `on_offload` drop other device-resident state (caches)
+    that would otherwise keep VRAM in use.
+    """
+
+    def __init__(self, modules, device, idle_seconds, on_offload=()):
+        self.modules = [m for m in modules if m is not None]
+        self.device = torch.device(device)
+        self.idle_seconds = idle_seconds
+        self.on_offload = list(on_offload)
+        self.offloaded = False
+        self.active = 0
+        self.last_used = time.time()
+        self.offloads = 0
+        self.reloads = 0
+        self.last_reload_seconds = 0.0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.watch, name="idle-offload", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        print(f"Offloading the model to host memory after {self.idle_seconds / 60:.1f} idle minutes")
+
+    def tensors(self):
+        seen = set()
+        for module in self.modules:
+            for tensor in list(module.parameters()) + list(module.buffers()):
+                if id(tensor) not in seen:
+                    seen.add(id(tensor))
+                    yield tensor
+
+    def watch(self):
+        interval = max(1.0, min(30.0, self.idle_seconds / 4))
+        while True:
+            time.sleep(interval)
+            with self.lock:
+                if not self.offloaded and self.active == 0 and time.time() - self.last_used >= self.idle_seconds:
+                    self.offload()
+
+    @torch.no_grad()
+    def offload(self):
+        # Caller holds the lock
+        start = time.time()
+        moved = 0
+        for tensor in self.tensors():
+            if tensor.device.type == 'cpu':
+                continue
+            pinned = torch.empty(tensor.shape, dtype=tensor.dtype, pin_memory=True)
+            pinned.copy_(tensor.data)
+            tensor.data = pinned
+            moved += pinned.element_size() * pinned.nelement()
+        for callback in self.on_offload:
+            callback()
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+            torch.cuda.empty_cache()
+        self.offloaded = True
+        self.offloads += 1
+        print(f"Idle for {(time.time() - self.last_used) / 60:.1f} minutes, offloaded "
+              f"{moved / 1024 / 1024:.0f}MB of weights to host memory in {time.time() - start:.2f}s")
+
+    @torch.no_grad()
+    def reload(self):
+        # Caller holds the lock
+        start = time.time()
+        for tensor in self.tensors():
+            if tensor.device != self.device:
+                tensor.data = tensor.data.to(self.device, non_blocking=True)
+        if self.device.type == 'cuda':
+            # The copies are done, so the pinned buffers are unreferenced now; torch keeps freed
+            # pinned blocks cached, release them as well where this version can
+            torch.cuda.synchronize(self.device)
+            empty_host_cache = getattr(torch._C, '_host_emptyCache', None)
+            if empty_host_cache is not None:
+                empty_host_cache()
+        self.offloaded = False
+        self.reloads += 1
+        self.last_reload_seconds = time.time() - start
+        print(f"Reloaded model weights to {self.device} in {self.last_reload_seconds:.2f}s")
+
+    @contextmanager
+    def use(self):
+        with self.lock:
+            if self.offloaded:
+                self.reload()
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.active -= 1
+                self.last_used = time.time()
+
+    def stats(self):
+        return {'offloaded': self.offloaded, 'offloads': self.offloads, 'reloads': self.reloads,
+                'last_reload_seconds': round(self.last_reload_seconds, 3)}
@@ -0,0 +1,239 @@
+import multiprocessing
+import os
+import random
+import struct
+import threading
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from pcm import DISCORD_CHANNELS, DISCORD_RATE, FRAME_BYTES, FRAME_SAMPLES, resample, to_channels, to_s16le, \
+    write_s16le_wav
+
+# wav: the model's own rate and channels, written in-process as before
+# pcm48: 48 kHz stereo s16le wav, what Discord plays, so the bot never resamples
+# opus: Ogg Opus of 20 ms packets the bot sends as they are, without touching an encoder
+OUTPUT_FORMATS = ('wav', 'pcm48', 'opus')
+EXTENSIONS = {'wav': '.wav', 'pcm48': '.wav', 'opus': '.opus'}
+
+# opus_encoder_ctl request for the encoder's lookahead, from opus_defines.h
+OPUS_GET_LOOKAHEAD_REQUEST = 4027
+
+
+def _crc_table():
+    table = []
+    for i in range(256):
+        crc = i << 24
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x04C11DB7) if crc & 0x80000000 else crc << 1
+        table.append(crc & 0xFFFFFFFF)
+    return table
+
+
+_CRC_TABLE = _crc_table()
+
+
+def ogg_crc(data):
+    crc = 0
+    for byte in data:
+        crc = ((crc << 8) & 0xFFFFFFFF) ^ _CRC_TABLE[(crc >> 24) ^ byte]
+    return crc
+
+
+def ogg_page(packets, granule, serial, sequence, flags=0):
+    lacing = bytearray()
+    for packet in packets:
+        lacing += b'\xff' * (len(packet) // 255) + bytes([len(packet) % 255])
+    header = struct.pack('<4sBBqIIIB', b'OggS', 0, flags, granule, serial, sequence, 0, len(lacing)) + lacing
+    page = bytearray(header + b''.join(packets))
+    struct.pack_into('<I', page, 22, ogg_crc(page))
+    return bytes(page)
+
+
+def write_ogg_opus(path, packets, samples, pre_skip, packets_per_page=50):
+    """Write 20 ms stereo Opus packets as an Ogg Opus file. `samples` is the real audio length
+    at 48 kHz, so the padding of the last packet is trimmed on playback, and `pre_skip` the
+    encoder's lookahead, which players drop from the start."""
+    serial = random.getrandbits(32)
+    head = struct.pack('<8sBBHIhB', b'OpusHead', 1, DISCORD_CHANNELS, pre_skip, DISCORD_RATE, 0, 0)
+    vendor = b'pyghtmare'
+    tags = b'OpusTags' + struct.pack('<I', len(vendor)) + vendor + struct.pack('<I', 0)
+    with open(path, 'wb') as f:
+        f.write(ogg_page([head], 0, serial, 0, flags=0x02))
+        f.write(ogg_page([tags], 0, serial, 1))
+        sequence = 2
+        page, segments, written = [], 0, 0
+        for i, packet in enumerate(packets):
+            page.append(packet)
+            segments += len(packet) // 255 + 1
+            written += 1
+            last = i == len(packets) - 1
+            # A page holds at most 255 lacing values, leave room for the largest Opus packet
+            if last or len(page) >= packets_per_page or segments > 255 - 6:
+                granule = pre_skip + (samples if last else written * FRAME_SAMPLES)
+                f.write(ogg_page(page, granule, serial, sequence, flags=0x04 if last else 0))
+                sequence += 1
+                page, segments = [], 0
+
+
+def read_opus_packets(path):
+    """The audio packets of an Ogg Opus file (the OpusHead/OpusTags headers are skipped)"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    packets = []
+    partial = b''
+    pos = 0
+    while pos + 27 <= len(data):
+        if data[pos:pos + 4] != b'OggS':
+            raise ValueError(f"{path} is not an Ogg file")
+        count = data[pos + 26]
+        lacing = data[pos + 27:pos + 27 + count]
+        body = pos + 27 + count
+        for size in lacing:
+            partial += data[body:body + size]
+            body += size
+            if size < 255:
+                packets.append(partial)
+                partial = b''
+        pos = body
+    return packets[2:]
+
+
+def opus_lookahead(encoder):
+    """A discord.py Encoder's lookahead in 48 kHz samples, the pre-skip of its Ogg stream.
+
+    It depends on the libopus version and the encoder settings, so it is asked for rather
+    than assumed.
+    """
+    import ctypes
+    from discord import opus
+    lookahead = ctypes.c_int32()
+    opus._lib.opus_encoder_ctl(encoder._state, OPUS_GET_LOOKAHEAD_REQUEST, ctypes.byref(lookahead))
+    return lookahead.value
+
+
+def encode_opus(pcm):
+    """Encode 48 kHz stereo s16le into 20 ms Opus packets with discord.py's libopus bindings.
+
+    Returns the packets and the encoder's lookahead.
+    """
+    from discord.opus import Encoder
+    encoder = Encoder()
+    if len(pcm) % FRAME_BYTES:
+        pcm += bytes(FRAME_BYTES - len(pcm) % FRAME_BYTES)
+    packets = [encoder.encode(pcm[i:i + FRAME_BYTES], FRAME_SAMPLES) for i in range(0, len(pcm), FRAME_BYTES)]
+    return packets, opus_lookahead(encoder)
+
+
+def encode_file(audio, rate, output_path, output_format, rename=True):
+    """Worker process side: convert (T, C) float audio into a hidden file next to output_path.
+
+    Renames it into place too unless `rename` is False, returns the path it ended up at.
+    """
+    audio = to_channels(resample(audio, rate, DISCORD_RATE), DISCORD_CHANNELS)
+    pcm = to_s16le(audio)
+    partial_dir = os.path.join(os.path.dirname(output_path) or ".", ".partial")
+    os.makedirs(partial_dir, exist_ok=True)
+    tmp_path = os.path.join(partial_dir, os.path.basename(output_path))
+    if output_format == 'opus':
+        packets, pre_skip = encode_opus(pcm)
+        write_ogg_opus(tmp_path, packets, len(audio), pre_skip)
+    else:
+        write_s16le_wav(tmp_path, pcm)
+    os.chmod(tmp_path, 0o666)
+    if not rename:
+        return tmp_path
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+def check_opus():
+    from discord.opus import Encoder
+    Encoder()
+    return True
+
+
+class OutputEncoder:
+    """Resamples and encodes finished audio on a small process pool, off the inference process.
+
+    submit() returns right away and the file is renamed into place once its worker is done,
+    after which its `on_done(ok)` callback runs. Renames happen in submission order, so streamed segments still reach the watchers one
+    after another even when a later one finishes encoding first. write() waits for the file,
+    for callers like the result cache that need it next.
+    """
+
+    def __init__(self, output_format, workers=2):
+        if output_format not in OUTPUT_FORMATS or output_format == 'wav':
+            raise ValueError(f"Unsupported output format: {output_format}")
+        self.output_format = output_format
+        self.extension = EXTENSIONS[output_format]
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        self.pending = deque()
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.failed = 0
+        if output_format == 'opus':
+            # Fail at startup rather than on the first message if libopus can't be loaded
+            try:
+                self.pool.submit(check_opus).result()
+            except Exception as e:
+                self.pool.shutdown()
+                raise RuntimeError(f"Opus output needs libopus, which discord.py could not load: {e}") from e
+        print(f"Encoding output as {output_format} on {workers} worker process(es)")
+
+    @staticmethod
+    def prepare(audio):
+        # The array is pickled on a feeder thread later, so it must not be a view of a reused buffer
+        audio = np.array(audio, dtype=np.float32, copy=True)
+        return audio[:, np.newaxis] if audio.ndim == 1 else audio
+
+    def submit(self, audio, rate, output_path, on_done=None):
+        with self.lock:
+            future = self.pool.submit(encode_file, self.prepare(audio), rate, output_path, self.output_format,
+                                      rename=False)
+            self.pending.append((future, output_path, on_done))
+            self.submitted += 1
+        future.add_done_callback(self.publish_ready)
+        return future
+
+    def write(self, audio, rate, output_path):
+        with self.lock:
+            self.submitted += 1
+        try:
+            return self.pool.submit(encode_file, self.prepare(audio), rate, output_path, self.output_format).result()
+        except Exception:
+            with self.lock:
+                self.failed += 1
+            raise
+
+    def publish_ready(self, _):
+        finished = []
+        with self.lock:
+            while self.pending and self.pending[0][0].done():
+                future, output_path, on_done = self.pending.popleft()
+                error = future.exception()
+                ok = error is None
+                if error is not None:
+                    self.failed += 1
+                    print(f"Error encoding {output_path}: {error}")
+                    print(''.join(traceback.format_exception(error)))
+                else:
+                    try:
+                        os.replace(future.result(), output_path)
+                    except OSError as e:
+                        ok = False
+                        self.failed += 1
+                        print(f"Error moving {output_path} into place: {e}")
+                if on_done is not None:
+                    finished.append((on_done, ok))
+        # Outside the lock, the callbacks may record metrics or submit more work
+        for on_done, ok in finished:
+            try:
+                on_done(ok)
+            except Exception as e:
+                print(f"Error in output callback: {e}")
+
+    def stats(self):
+        return {'format': self.output_format, 'submitted': self.submitted, 'failed': self.failed}
@@ -0,0 +1,183 @@
+import math
+import struct
+import subprocess
+import wave
+
+import numpy as np
+
+# What discord.py sends: 20 ms Opus frames of 48 kHz stereo s16le
+DISCORD_RATE = 48000
+DISCORD_CHANNELS = 2
+FRAME_SAMPLES = DISCORD_RATE // 50
+FRAME_BYTES = FRAME_SAMPLES * DISCORD_CHANNELS * 2
+
+
+def parse_wav(data, path=''):
+    """Split wav bytes into (format tag, channels, sample_rate, bits, sample bytes)"""
+    if data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        raise ValueError(f"{path} is not a wav file")
+    pos = 12
+    fmt = None
+    samples = None
+    while pos + 8 <= len(data):
+        chunk_id, size = struct.unpack('<4sI', data[pos:pos + 8])
+        body = data[pos + 8:pos + 8 + size]
+        if chunk_id == b'fmt ':
+            tag, channels, rate, _, _, bits = struct.unpack('<HHIIHH', body[:16])
+            if tag == 0xFFFE and len(body) >= 26:
+                # WAVE_FORMAT_EXTENSIBLE, the real format is the start of the sub-format GUID
+                tag = struct.unpack('<H', body[24:26])[0]
+            fmt = (tag, channels, rate, bits)
+        elif chunk_id == b'data':
+            samples = body
+        pos += 8 + size + (size & 1)
+    if fmt is None or samples is None:
+        raise ValueError(f"{path} has no fmt or data chunk")
+    return fmt + (samples,)
+
+
+def read_wav(path):
+    """Read an integer PCM or float wav into a (T, C) float32 array, returns (audio, sample_rate).
+
+    Raises ValueError for anything that isn't a plain wav, see decode_file for the rest.
+    """
+    with open(path, 'rb') as f:
+        tag, channels, rate, bits, samples = parse_wav(f.read(), path)
+    if tag == 1 and bits == 16:
+        audio = np.frombuffer(samples[:len(samples) // 2 * 2], '<i2').astype(np.float32) / 32768
+    elif tag == 1 and bits == 24:
+        raw = np.frombuffer(samples[:len(samples) // 3 * 3], np.uint8).reshape(-1, 3).astype(np.int32)
+        audio = ((raw[:, 0] << 8 | raw[:, 1] << 16 | raw[:, 2] << 24) >> 8).astype(np.float32) / 8388608
+    elif tag == 1 and bits == 32:
+        audio = np.frombuffer(samples[:len(samples) // 4 * 4], '<i4').astype(np.float32) / 2147483648
+    elif tag == 3 and bits == 32:
+        audio = np.frombuffer(samples[:len(samples) // 4 * 4], '<f4').astype(np.float32)
+    elif tag == 3 and bits == 64:
+        audio = np.frombuffer(samples[:len(samples) // 8 * 8], '<f8').astype(np.float32)
+    else:
+        raise ValueError(f"{path} has an unsupported wav format ({tag}, {bits} bit)")
+    frames = len(audio) // channels
+    return audio[:frames * channels].reshape(frames, channels), rate
+
+
+def read_discord_wav(path):
+    """The raw sample bytes of a wav that is already 48 kHz stereo s16le, otherwise None"""
+    with open(path, 'rb') as f:
+        try:
+            tag, channels, rate, bits, samples = parse_wav(f.read(), path)
+        except ValueError:
+            return None
+    if (tag, channels, rate, bits) != (1, DISCORD_CHANNELS, DISCORD_RATE, 16):
+        return None
+    return samples[:len(samples) // 4 * 4]
+
+
+def write_s16le_wav(path, pcm, rate=DISCORD_RATE, channels=DISCORD_CHANNELS):
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(channels)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(pcm)
+
+
+def decode_file(path):
+    """Decode any audio file to ((T, C) float32, sample_rate), in-process for wavs and
+    with a one-shot ffmpeg for everything else"""
+    try:
+        return read_wav(path)
+    except ValueError:
+        pass
+    result = subprocess.run(['ffmpeg', '-v', 'error', '-i', path, '-f', 'f32le', '-ar', str(DISCORD_RATE),
+                             '-ac', str(DISCORD_CHANNELS), '-'], capture_output=True, check=True)
+    return np.frombuffer(result.stdout, '<f4').reshape(-1, DISCORD_CHANNELS), DISCORD_RATE
+
+
+def from_s16le(pcm, channels):
+    audio = np.frombuffer(pcm[:len(pcm) // (2 * channels) * 2 * channels], '<i2')
+    return audio.reshape(-1, channels).astype(np.float32) / 32768
+
+
+def to_s16le(audio):
+    return (np.clip(audio, -1.0, 1.0) * 32767).astype('<i2').tobytes()
+
+
+def resample(audio, src_rate, dst_rate, half_taps=16, block=65536):
+    """Windowed-sinc resampling of a (T, C) float32 array between integer sample rates.
+
+    Every output sample is a Hann-windowed sinc over the 2 * half_taps nearest input samples
+    (widened when downsampling so the filter also band-limits). With src/dst = M/L in lowest
+    terms there are only L distinct filter phases, so their weights are computed once and the
+    work per block is a gather and a multiply-add.
+    """
+    if src_rate == dst_rate or len(audio) == 0:
+        return audio
+    return StreamResampler(src_rate, dst_rate, audio.shape[1], half_taps).feed(audio, final=True, block=block)
+
+
+class StreamResampler:
+    """resample() for audio that arrives in pieces, e.g. streamed IPC chunks.
+
+    Each feed() returns the output samples whose filter taps are all covered by the input so
+    far, keeping just enough history for the next ones; feeding the last piece with
+    final=True flushes the rest. The concatenated output is the same as resampling the whole
+    clip at once, so there are no clicks at the piece boundaries.
+    """
+
+    def __init__(self, src_rate, dst_rate, channels, half_taps=16):
+        self.passthrough = src_rate == dst_rate
+        g = math.gcd(src_rate, dst_rate)
+        self.step, self.phases = src_rate // g, dst_rate // g
+        cutoff = min(1.0, self.phases / self.step)
+        self.support = int(math.ceil(half_taps / cutoff))
+        self.offsets = np.arange(-self.support + 1, self.support + 1)
+        distance = (np.arange(self.phases) / self.phases)[:, None] - self.offsets[None, :]
+        window = 0.5 + 0.5 * np.cos(np.pi * np.clip(distance / self.support, -1.0, 1.0))
+        self.table = (cutoff * np.sinc(cutoff * distance) * window).astype(np.float32)
+        # Input not yet used up, starting `support` zeros before the first sample; history[0]
+        # is input sample `start`
+        self.history = np.zeros((self.support, channels), dtype=np.float32)
+        self.start = -self.support
+        self.received = 0
+        self.produced = 0
+
+    def feed(self, audio, final=False, block=65536):
+        if self.passthrough:
+            return audio
+        self.history = np.concatenate([self.history, np.asarray(audio, dtype=np.float32)])
+        self.received += len(audio)
+        if final:
+            end = self.received * self.phases // self.step
+            self.history = np.pad(self.history, ((0, self.support + 1), (0, 0)))
+        else:
+            # Output n reads input up to n * step // phases + support
+            end = -(-(self.received - self.support) * self.phases // self.step)
+        end = max(end, self.produced)
+        out = np.empty((end - self.produced, self.history.shape[1]), dtype=np.float32)
+        for first in range(self.produced, end, block):
+            n = np.arange(first, min(end, first + block)) * self.step
+            base, phase = np.divmod(n, self.phases)
+            taps = self.history[base[:, None] + self.offsets[None, :] - self.start]
+            at = first - self.produced
+            out[at:at + len(n)] = np.einsum('nk,nkc->nc', self.table[phase], taps)
+        self.produced = end
+        # Drop the input that no later output reaches back to
+        drop = end * self.step // self.phases - self.support + 1 - self.start
+        if drop > 0 and not final:
+            self.history = self.history[drop:]
+            self.start += drop
+        return out
+
+
+def to_channels(audio, channels):
+    if audio.shape[1] == channels:
+        return audio
+    if audio.shape[1] == 1:
+        return np.repeat(audio, channels, axis=1)
+    if channels == 1:
+        return audio.mean(axis=1, keepdims=True)
+    return audio[:, :channels]
+
+
+def to_discord(audio, rate):
+    """(T, C) float audio at any rate -> 48 kHz stereo s16le bytes, ready to be sliced into frames"""
+    return to_s16le(to_channels(resample(audio, rate, DISCORD_RATE), DISCORD_CHANNELS))
@@ -1,6 +1,298 @@
-import sys
+"""Plays generated audio into a PulseAudio sink for the IRC bot (or anything else that
+records from a virtual microphone).
+
+Clips are wrapped in a little noise before and after and mixed over a constant noise bed,
+then written back to back into one long-running paplay stream.
+
+    python player.py                          # watch ./outputs, play into virtual_speaker
+    python player.py clip.wav other.wav       # play these and exit
+    python player.py --output out.wav clip.wav  # write to a wav instead of a sound server
+"""
+import argparse
+import os
+import queue
 import subprocess
+import threading
+import time
+import wave
+
+import numpy as np
+from watchdog.events import FileSystemEventHandler
+from watchdog.observers import Observer
+
+from pcm import decode_file, resample, to_channels, to_s16le
+
+SINK_NAME = "virtual_speaker"
+SOURCE_NAME = "virtual_mic"
+AUDIO_EXTENSIONS = ('.wav', '.opus')
+
+
+class PulseOutput:
+    """One paplay process fed raw s16le for the whole run.
+
+    Writes block while PulseAudio's buffer is full, which is what paces the player to real
+    time. paplay is restarted if it dies; the block being written is lost.
+    """
+    live = True
+
+    def __init__(self, rate, channels, device=None, latency_ms=200):
+        self.command = ['paplay', '--raw', f'--rate={rate}', f'--channels={channels}', '--format=s16le',
+                        f'--latency-msec={latency_ms}']
+        if device:
+            self.command.append(f'--device={device}')
+        self.proc = None
+
+    def write(self, pcm):
+        try:
+            if self.proc is None or self.proc.poll() is not None:
+                self.proc = subprocess.Popen(self.command, stdin=subprocess.PIPE, bufsize=0)
+            self.proc.stdin.write(pcm)
+        except OSError as e:
+            print(f"Playback error: {e}")
+            self.proc = None
+            time.sleep(1)
+
+    def close(self):
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.close()
+        except (OSError, ValueError):
+            # paplay already exited, so whatever was still buffered for it can't be flushed
+            pass
+        try:
+            self.proc.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+        self.proc = None
+
+
+class FileOutput:
+    """Writes the stream to a wav file instead, as fast as it is produced"""
+    live = False
+
+    def __init__(self, path, rate, channels):
+        self.wav = wave.open(path, 'wb')
+        self.wav.setnchannels(channels)
+        self.wav.setsampwidth(2)
+        self.wav.setframerate(rate)
+
+    def write(self, pcm):
+        self.wav.writeframes(pcm)
+
+    def close(self):
+        self.wav.close()
+
+
+class Player:
+    """Decodes queued files on one thread and writes them to `output` on another.
+
+    Each clip becomes `pre_pad` seconds of noise, the clip, `post_pad` seconds of noise and
+    `gap` seconds of nothing, all over a noise bed and scaled by `gain`; the defaults are what
+    play-audio-irc.sh's ffmpeg filter graph produced (amix halved both of its inputs). While
+    nothing is queued a live output keeps getting the bed, so the stream never underruns and
+    the next clip starts without reopening anything.
+    """
+
+    def __init__(self, output, rate=44100, channels=1, pre_pad=1.25, post_pad=2.5, gap=0.0, pad_amplitude=0.0005,
+                 bed_amplitude=0.0002, gain=0.5, delete=False, block_seconds=0.1):
+        self.output = output
+        self.rate = rate
+        self.channels = channels
+        self.pre_pad = pre_pad
+        self.post_pad = post_pad
+        self.gap = gap
+        self.pad_amplitude = pad_amplitude
+        self.bed_amplitude = bed_amplitude
+        self.gain = gain
+        self.delete = delete
+        self.block_samples = int(block_seconds * rate)
+        self.rng = np.random.default_rng()
+        self.paths = queue.Queue()
+        # One clip decoded ahead of the one that is playing
+        self.ready = queue.Queue(maxsize=1)
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def enqueue(self, path):
+        """Queue a file, unless it is already waiting to be played"""
+        with self.lock:
+            if path in self.pending:
+                return
+            self.pending.add(path)
+        print(f"Queued {path}")
+        self.paths.put(path)
+
+    def finish(self):
+        """Stop once everything queued so far has been played"""
+        self.paths.put(None)
+
+    def noise(self, samples, amplitude):
+        # Same signal on every channel, like ffmpeg upmixing the mono anoisesrc
+        mono = self.rng.uniform(-amplitude, amplitude, (samples, 1)).astype(np.float32)
+        return np.repeat(mono, self.channels, axis=1)
+
+    def seconds(self, seconds):
+        return int(round(seconds * self.rate))
+
+    def render(self, path):
+        audio, rate = decode_file(path)
+        audio = to_channels(resample(audio, rate, self.rate), self.channels)
+        main = np.concatenate([
+            self.noise(self.seconds(self.pre_pad), self.pad_amplitude),
+            audio,
+            self.noise(self.seconds(self.post_pad), self.pad_amplitude),
+            np.zeros((self.seconds(self.gap), self.channels), dtype=np.float32),
+        ])
+        return to_s16le(self.gain * (main + self.noise(len(main), self.bed_amplitude)))
+
+    def decode_loop(self):
+        while True:
+            path = self.paths.get()
+            if path is None:
+                self.ready.put(None)
+                return
+            try:
+                self.ready.put((path, self.render(path)))
+            except Exception as e:
+                print(f"Error decoding {path}: {e}")
+                self.done(path)
+
+    def done(self, path):
+        with self.lock:
+            self.pending.discard(path)
+        if self.delete:
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"Error deleting {path}: {e}")
+
+    def run(self):
+        """Write clips (and the bed in between) until finish() has been reached"""
+        threading.Thread(target=self.decode_loop, name="player-decode", daemon=True).start()
+        block_bytes = self.block_samples * self.channels * 2
+        while True:
+            try:
+                item = self.ready.get(block=not self.output.live)
+            except queue.Empty:
+                self.output.write(to_s16le(self.gain * self.noise(self.block_samples, self.bed_amplitude)))
+                continue
+            if item is None:
+                return
+            path, pcm = item
+            for start in range(0, len(pcm), block_bytes):
+                self.output.write(pcm[start:start + block_bytes])
+            print(f"Played {path}")
+            self.done(path)
+
+
+class AudioFileHandler(FileSystemEventHandler):
+    """Queues audio files once they are complete in the watched folder.
+
+    That is either a rename into it (the generators write into .partial/ first) or a file
+    written in place being closed (espeak-ng from robo-commentator.sh).
+    """
+
+    def __init__(self, player, watch_dir):
+        self.player = player
+        self.watch_dir = os.path.abspath(watch_dir)
+
+    def wanted(self, path):
+        return path.endswith(AUDIO_EXTENSIONS) and os.path.dirname(os.path.abspath(path)) == self.watch_dir
+
+    def on_closed(self, event):
+        if not event.is_directory and self.wanted(event.src_path):
+            self.player.enqueue(event.src_path)
+
+    def on_moved(self, event):
+        if not event.is_directory and self.wanted(event.dest_path):
+            self.player.enqueue(event.dest_path)
+
+
+def pactl_load(*args):
+    return subprocess.run(['pactl', 'load-module', *args], capture_output=True, text=True,
+                          check=True).stdout.strip()
+
+
+def load_virtual_devices(sink_name, source_name):
+    """A null sink to play into and a microphone fed from its monitor; returns the module ids"""
+    modules = [pactl_load('module-null-sink', f'sink_name={sink_name}',
+                          f'sink_properties=device.description={sink_name}')]
+    print(f"Created sink: {sink_name} (module id: {modules[0]})")
+    try:
+        modules.append(pactl_load('module-remap-source', f'master={sink_name}.monitor', f'source_name={source_name}',
+                                  f'source_properties=device.description={source_name}'))
+    except subprocess.CalledProcessError:
+        unload_virtual_devices(modules)
+        raise
+    print(f"Created source: {source_name} (module id: {modules[1]})")
+    return modules
+
+
+def unload_virtual_devices(modules):
+    for module in reversed(modules):
+        subprocess.run(['pactl', 'unload-module', module])
+    print("Unloaded virtual devices")
+
+
+def main(files, watch_dir, output_path=None, sink=None, virtual_devices=True, latency_ms=200, rate=44100, channels=1,
+         **options):
+    watching = not files
+    if output_path:
+        output = FileOutput(output_path, rate, channels)
+    else:
+        output = PulseOutput(rate, channels, sink or (SINK_NAME if watching else None), latency_ms)
+    # Files found in the watched folder are deleted once played, files given by name are not
+    player = Player(output, rate, channels, delete=watching, **options)
+    modules = []
+    observer = None
+    try:
+        if not watching:
+            for path in files:
+                player.enqueue(path)
+            player.finish()
+            player.run()
+            return
+        if virtual_devices and not output_path:
+            modules = load_virtual_devices(sink or SINK_NAME, SOURCE_NAME)
+        os.makedirs(watch_dir, exist_ok=True)
+        observer = Observer()
+        # Recursive so renames out of .partial/ arrive as moves rather than bare creations
+        observer.schedule(AudioFileHandler(player, watch_dir), watch_dir, recursive=True)
+        observer.start()
+        print(f"Monitoring {watch_dir} for new audio files, apps can use {SOURCE_NAME} as microphone")
+        player.run()
+    except KeyboardInterrupt:
+        print("Stopping")
+    finally:
+        if observer is not None:
+            observer.stop()
+            observer.join()
+        output.close()
+        if modules:
+            unload_virtual_devices(modules)
+
 
 if __name__ == "__main__":
-    filepath = sys.argv[1]
-    subprocess.run(['paplay', filepath])
+    parser = argparse.ArgumentParser(description="Play generated audio into a PulseAudio sink with a noise bed")
+    parser.add_argument("files", nargs="*", help="Play these files and exit instead of watching a folder")
+    parser.add_argument("--watch_dir", type=str, default="./outputs", help="Folder to watch for new audio files")
+    parser.add_argument("--output", type=str, default=None, help="Write to this wav file instead of PulseAudio")
+    parser.add_argument("--sink", type=str, default=None, help=f"PulseAudio sink to play into (default: {SINK_NAME} when watching, the default sink otherwise)")
+    parser.add_argument("--no_virtual_devices", action="store_true", help=f"Don't create {SINK_NAME}/{SOURCE_NAME}, e.g. when they already exist")
+    parser.add_argument("--rate", type=int, default=44100, help="Sample rate of the output stream")
+    parser.add_argument("--channels", type=int, default=1, help="Channels of the output stream")
+    parser.add_argument("--latency_ms", type=int, default=200, help="PulseAudio buffer, also how late a clip can start after the bed")
+    parser.add_argument("--pre_pad", type=float, default=1.25, help="Seconds of noise before each clip")
+    parser.add_argument("--post_pad", type=float, default=2.5, help="Seconds of noise after each clip")
+    parser.add_argument("--gap", type=float, default=0.0, help="Extra seconds of bed only between clips")
+    parser.add_argument("--pad_amplitude", type=float, default=0.0005, help="Amplitude of the padding noise")
+    parser.add_argument("--bed_amplitude", type=float, default=0.0002, help="Amplitude of the constant noise bed (0 disables it)")
+    parser.add_argument("--gain", type=float, default=0.5, help="Gain applied to the mix")
+
+    args = parser.parse_args()
+    main(args.files, args.watch_dir, output_path=args.output, sink=args.sink,
+         virtual_devices=not args.no_virtual_devices, latency_ms=args.latency_ms, rate=args.rate,
+         channels=args.channels, pre_pad=args.pre_pad, post_pad=args.post_pad, gap=args.gap,
+         pad_amplitude=args.pad_amplitude, bed_amplitude=args.bed_amplitude, gain=args.gain)
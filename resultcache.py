@@ -0,0 +1,127 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+
+def publish_file(src_path, output_path):
+    """Copy a finished wav next to output_path and rename it into place for the watchers"""
+    partial_dir = os.path.join(os.path.dirname(output_path) or ".", ".partial")
+    os.makedirs(partial_dir, exist_ok=True)
+    tmp_path = os.path.join(partial_dir, os.path.basename(output_path))
+    shutil.copyfile(src_path, tmp_path)
+    os.chmod(tmp_path, 0o666)
+    os.replace(tmp_path, output_path)
+
+
+class ResultCache:
+    """Content-addressed, size-bounded on-disk cache of generated clips.
+
+    Keys are hashes of everything that changes the audio (normalized script, voices, model
+    and sampling settings). Entries are evicted least-recently-used first; the file mtime is
+    bumped on every hit so the order survives a restart.
+
+    Identical requests in flight at the same time share one generation: the first caller of
+    begin() becomes the leader and must call finish(), everyone else blocks in begin() until
+    the leader is done and then gets the cached file.
+    """
+
+    def __init__(self, cache_dir, max_mb=1024, extension='.wav'):
+        self.cache_dir = cache_dir
+        self.extension = extension
+        self.incoming_dir = os.path.join(cache_dir, ".incoming")
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        os.makedirs(self.incoming_dir, exist_ok=True)
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        existing = []
+        for name in os.listdir(cache_dir):
+            path = os.path.join(cache_dir, name)
+            if name.endswith(extension) and os.path.isfile(path):
+                st = os.stat(path)
+                existing.append((st.st_mtime, name[:-len(extension)], st.st_size))
+        for _, key, size in sorted(existing):
+            self.entries[key] = size
+            self.total_bytes += size
+        self.evict()
+
+    @staticmethod
+    def make_key(**parts):
+        blob = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(blob.encode('utf-8')).hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, f"{key}{self.extension}")
+
+    def incoming_path(self, key):
+        """Where a leader should write the full clip before calling finish()"""
+        return os.path.join(self.incoming_dir, f"{key}{self.extension}")
+
+    def begin(self, key):
+        """Return the cached path on a hit, or None if the caller is now the leader for `key`"""
+        while True:
+            with self.lock:
+                if key in self.entries and os.path.exists(self.path_for(key)):
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    path = self.path_for(key)
+                    try:
+                        os.utime(path)
+                    except OSError:
+                        pass
+                    return path
+                self.entries.pop(key, None)
+                event = self.inflight.get(key)
+                if event is None:
+                    self.inflight[key] = threading.Event()
+                    self.misses += 1
+                    return None
+            # Someone else is generating this exact request, wait for it and look again
+            event.wait()
+
+    def finish(self, key, incoming=None):
+        """Store the leader's result (if any) and wake up waiting duplicates"""
+        try:
+            if incoming and os.path.exists(incoming):
+                path = self.path_for(key)
+                os.replace(incoming, path)
+                size = os.path.getsize(path)
+                with self.lock:
+                    self.total_bytes -= self.entries.pop(key, 0)
+                    self.entries[key] = size
+                    self.total_bytes += size
+                    self.evict()
+        finally:
+            with self.lock:
+                event = self.inflight.pop(key, None)
+            if event is not None:
+                event.set()
+
+    def publish(self, key, output_path):
+        """Copy a cached result to output_path, returns False if it is not cached"""
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            return False
+        publish_file(path, output_path)
+        return True
+
+    def evict(self):
+        # Caller holds the lock (or is the constructor)
+        while self.total_bytes > self.max_bytes and self.entries:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(self.path_for(key))
+            except OSError:
+                pass
+
+    def stats(self):
+        return (f"{len(self.entries)} clips, {self.total_bytes / 1024 / 1024:.1f}MB, "
+                f"{self.hits} hits, {self.misses} misses")
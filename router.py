@@ -0,0 +1,82 @@
+import argparse
+import os
+import time
+from watchdog.observers import Observer
+
+from jobqueue import IngestHandler, JobQueue
+from backends import BackendWorker, CosyVoiceBackend, EspeakBackend, Router, VibeVoiceBackend
+
+
+def build_backend(name, args):
+    if name == "vibevoice":
+        return VibeVoiceBackend(args.vibevoice_model_path, args.speaker_names, args.output_dir, args.device,
+                                cfg_scale=args.cfg_scale, dtype=args.dtype,
+                                stream_segment_seconds=args.stream_segment_seconds)
+    if name == "cosyvoice":
+        return CosyVoiceBackend(args.cosyvoice_model_dir, args.speaker_names, args.output_dir, args.device,
+                                write_mode="segment" if args.stream else "full")
+    if name == "espeak":
+        return EspeakBackend(args.output_dir, voice=args.espeak_voice)
+    raise ValueError(f"Unknown backend: {name}")
+
+
+def main(args):
+    deadlines = {}
+    if args.deadline_seconds > 0:
+        deadlines['high'] = deadlines['normal'] = args.deadline_seconds
+    if args.comm_deadline_seconds > 0:
+        deadlines['low'] = args.comm_deadline_seconds
+    job_queue = JobQueue(args.queue_size, args.queue_policy, ledger_path=os.path.join(args.watch_dir, ".generated"),
+                         deadlines=deadlines, deadline_policy=args.deadline_policy)
+    workers = []
+    for name in args.backends:
+        backend = build_backend(name, args)
+        print(f"Loading backend {name}...")
+        # Handlers check this queue for cancellations and late jobs while they generate
+        backend.load(job_queue)
+        backend.register_voices()
+        workers.append(BackendWorker(backend, job_queue, streaming=args.stream))
+    router = Router(workers, job_queue, latency_budget=args.latency_budget)
+    router.start()
+
+    observer = Observer()
+    observer.schedule(IngestHandler(job_queue), args.watch_dir, recursive=False)
+    if args.comm_dir:
+        os.makedirs(args.comm_dir, exist_ok=True)
+        observer.schedule(IngestHandler(job_queue, priority='low'), args.comm_dir, recursive=False)
+    observer.start()
+    print(f"Routing {args.watch_dir} to {', '.join(args.backends)} with a {args.latency_budget}s latency budget")
+    job_queue.scan(args.watch_dir, max_age=args.scan_max_age)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        observer.stop()
+    observer.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-backend TTS router")
+    parser.add_argument("--backends", type=str, nargs='+', default=["vibevoice", "espeak"], choices=["vibevoice", "cosyvoice", "espeak"], help="Backends to load, best quality first")
+    parser.add_argument("--latency_budget", type=float, default=30.0, help="Target seconds from queueing to finished audio")
+    parser.add_argument("--speaker_names", type=str, nargs='+', default=['boris'], help="Speaker names in order")
+    parser.add_argument("--output_dir", type=str, default="./outputs", help="Directory to save output audio files")
+    parser.add_argument("--watch_dir", type=str, default="./txt", help="Directory to watch for new text files")
+    parser.add_argument("--comm_dir", type=str, default="", help="Low-priority folder (e.g. ./comm_txt) that always goes to the cheapest backend")
+    parser.add_argument("--device", type=str, default="cuda", help="Device for the model backends")
+    parser.add_argument("--stream", action="store_true", help="Use each backend's streaming output")
+    parser.add_argument("--queue_size", type=int, default=64, help="Maximum number of pending txt files")
+    parser.add_argument("--queue_policy", type=str, default="reject", choices=["reject", "drop_oldest"], help="What to do with new files when the queue is full")
+    parser.add_argument("--scan_max_age", type=float, default=600, help="Pick up unprocessed txt files up to this many seconds old at startup")
+    parser.add_argument("--deadline_seconds", type=float, default=0, help="Seconds a txt file may wait before it is too stale to generate (0 disables deadlines)")
+    parser.add_argument("--comm_deadline_seconds", type=float, default=0, help="Deadline for --comm_dir files (0 disables)")
+    parser.add_argument("--deadline_policy", type=str, default="drop", choices=["drop", "downgrade"], help="Drop files that would miss their deadline, or send them to the cheapest backend")
+    parser.add_argument("--vibevoice_model_path", type=str, default="microsoft/VibeVoice-1.5b", help="VibeVoice model path")
+    parser.add_argument("--cfg_scale", type=float, default=1.3, help="VibeVoice CFG scale")
+    parser.add_argument("--dtype", type=str, default="float32", choices=["float32", "float16", "bfloat16"], help="VibeVoice dtype")
+    parser.add_argument("--stream_segment_seconds", type=float, default=2.0, help="VibeVoice segment length with --stream")
+    parser.add_argument("--cosyvoice_model_dir", type=str, default="pretrained_models/Fun-CosyVoice3-0.5B", help="CosyVoice model directory")
+    parser.add_argument("--espeak_voice", type=str, default=None, help="espeak-ng voice")
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,57 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the repository root, next to the scripts that import them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class FakeProcessor:
+    class audio_processor:
+        sampling_rate = 24000
+
+    @staticmethod
+    def save_audio(audio, output_path):
+        with open(output_path, 'w', encoding='utf-8') as f:
+            f.write(audio)
+
+
+class FakeVoiceMapper:
+    def refresh_if_changed(self):
+        pass
+
+    def get_voice_path(self, name):
+        return f"{name}.wav"
+
+
+@pytest.fixture
+def make_handler(tmp_path, monkeypatch):
+    """Builds generator.py's TxtFileHandler through its constructor on a stub model.
+
+    make_handler(generate, **options) passes the options to the constructor and replaces
+    generate_batch with `generate(handler, jobs)`. Audio is whatever `generate` writes out,
+    handed through to_numpy unchanged. Output and the result cache go to tmp_path.
+    """
+    pytest.importorskip("torch")
+    pytest.importorskip("vibevoice")
+    from backends import load_script
+
+    generator = load_script("generator.py")
+
+    def load_model(handler):
+        handler.model = None
+        handler.processor = FakeProcessor()
+
+    monkeypatch.setattr(generator.TxtFileHandler, "load_model", load_model)
+    monkeypatch.setattr(generator, "VoiceMapper", FakeVoiceMapper)
+
+    def make(generate, **options):
+        options.setdefault('result_cache_dir', str(tmp_path / "cache"))
+        options.setdefault('result_cache_mb', 1)
+        handler = generator.TxtFileHandler("model", ["boris"], str(tmp_path), "cpu", 1.3, "float32", **options)
+        handler.generate_batch = lambda jobs: generate(handler, jobs)
+        handler.to_numpy = lambda audio: audio
+        return handler
+
+    return make
@@ -0,0 +1,133 @@
+import threading
+import time
+import types
+
+import pytest
+
+pytest.importorskip("watchdog")
+
+import backends
+from backends import BackendWorker, Router, TTSBackend
+from jobqueue import JobQueue
+
+
+class BlockingBackend(TTSBackend):
+    """Synthesizes nothing, each job blocks until `release` is set"""
+
+    name = "blocking"
+
+    def __init__(self):
+        super().__init__()
+        self.started = []
+        self.release = threading.Event()
+
+    def synthesize(self, job):
+        self.started.append(job.name)
+        self.release.wait(5)
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def write_jobs(tmp_path, job_queue, count):
+    for i in range(count):
+        path = tmp_path / f"message{i}.txt"
+        path.write_text("Speaker 1: Hello there.\n")
+        job_queue.put(str(path))
+
+
+def test_router_leaves_jobs_in_the_shared_queue_until_a_backend_has_room(tmp_path):
+    job_queue = JobQueue()
+    backend = BlockingBackend()
+    worker = BackendWorker(backend, job_queue, max_pending=1)
+    Router([worker], job_queue).start()
+    write_jobs(tmp_path, job_queue, 5)
+    # One job generating, one waiting on the worker, the rest still in the job queue
+    wait_for(lambda: backend.started and worker.pending.full())
+    time.sleep(0.1)
+    assert job_queue.depth == 3
+    backend.release.set()
+    wait_for(lambda: job_queue.stats()['completed'] == 5)
+    assert backend.started == [f"message{i}.txt" for i in range(5)]
+
+
+def test_worker_skips_jobs_cancelled_or_expired_while_waiting(tmp_path):
+    job_queue = JobQueue(deadlines={'normal': 0.2})
+    backend = BlockingBackend()
+    worker = BackendWorker(backend, job_queue, max_pending=2)
+    Router([worker], job_queue).start()
+    write_jobs(tmp_path, job_queue, 3)
+    wait_for(lambda: backend.started and worker.pending.full())
+    job_queue.cancel(str(tmp_path / "message1.txt"))
+    time.sleep(0.3)
+    backend.release.set()
+    wait_for(lambda: job_queue.depth == 0 and not job_queue.active)
+    assert backend.started == ["message0.txt"]
+    stats = job_queue.stats()
+    assert (stats['completed'], stats['cancelled'], stats['expired']) == (1, 1, 1)
+
+
+class CancellableHandler:
+    """Stands in for a generator's TxtFileHandler, generating until its job is cancelled"""
+
+    def __init__(self, *args, job_queue=None, **options):
+        self.job_queue = job_queue
+        self.generating = threading.Event()
+        self.stopped = []
+
+    def process_txt_file(self, txt_path, stream_segment_seconds=None):
+        self.generating.set()
+        while not self.job_queue.is_cancelled(txt_path):
+            time.sleep(0.01)
+        self.stopped.append(txt_path)
+
+
+def test_cancelling_a_job_reaches_the_backend_generating_it(tmp_path, monkeypatch):
+    monkeypatch.setattr(backends, "load_script",
+                        lambda filename: types.SimpleNamespace(TxtFileHandler=CancellableHandler))
+    job_queue = JobQueue()
+    backend = backends.VibeVoiceBackend("model", ["boris"], str(tmp_path), "cpu")
+    backend.load(job_queue)
+    worker = BackendWorker(backend, job_queue)
+    Router([worker], job_queue).start()
+    write_jobs(tmp_path, job_queue, 1)
+    assert backend.handler.generating.wait(5)
+    job_queue.cancel(str(tmp_path / "message0.txt"))
+    wait_for(lambda: job_queue.stats()['cancelled'] == 1)
+    assert backend.handler.stopped == [str(tmp_path / "message0.txt")]
+
+
+class RecordingHandler:
+    def __init__(self, *args, job_queue=None, **options):
+        self.calls = []
+
+    def process_txt_file(self, txt_path, **overrides):
+        self.calls.append(overrides)
+
+
+def test_vibevoice_passes_the_segment_length_per_job(tmp_path, monkeypatch):
+    monkeypatch.setattr(backends, "load_script",
+                        lambda filename: types.SimpleNamespace(TxtFileHandler=RecordingHandler))
+    backend = backends.VibeVoiceBackend("model", ["boris"], str(tmp_path), "cpu", stream_segment_seconds=4)
+    backend.load()
+    job = types.SimpleNamespace(txt_path=str(tmp_path / "message0.txt"))
+    backend.stream(job)
+    backend.synthesize(job)
+    assert backend.handler.calls == [{'stream_segment_seconds': 4}, {'stream_segment_seconds': 0}]
+
+
+def test_espeak_output_is_named_like_the_other_backends(tmp_path, monkeypatch):
+    def fake_espeak(command, **kwargs):
+        with open(command[command.index('-w') + 1], 'wb') as f:
+            f.write(b"RIFF")
+
+    monkeypatch.setattr(backends.subprocess, "run", fake_espeak)
+    job_queue = JobQueue()
+    write_jobs(tmp_path, job_queue, 1)
+    backends.EspeakBackend(str(tmp_path)).synthesize(job_queue.get(0))
+    assert (tmp_path / "message0_generated.wav").exists()
+    assert not (tmp_path / "message0.wav").exists()
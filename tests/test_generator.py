@@ -0,0 +1,352 @@
+import os
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("vibevoice")
+
+from backends import load_script
+
+generator = load_script("generator.py")
+
+
+def window_text(window):
+    # How generate_chunked joins a window's turns (each prefixed with its speaker label)
+    return '\n'.join(text for _, text in window)
+
+
+SCRIPTS = [
+    "Speaker 1: Hello there. This is the first turn, and it is fairly short.",
+    "Speaker 2: The second speaker answers with a couple of sentences. Then adds one more.",
+    "Speaker 1: " + "A very long sentence without any punctuation that keeps going " * 4,
+    "Speaker 2: Short reply.",
+    "Speaker 1: Another turn. And another sentence in it!",
+]
+
+
+@pytest.mark.parametrize("max_chars", [20, 40, 64, 100, 200])
+def test_split_script_windows_fit_max_chars(max_chars):
+    windows = generator.split_script(SCRIPTS, max_chars)
+    assert windows
+    for window in windows:
+        assert len(window_text(window)) <= max_chars
+    words = ' '.join(window_text(w).replace('\n', ' ') for w in windows).split()
+    expected = ' '.join(line.split(':', 1)[1] for line in SCRIPTS).split()
+    assert words == expected
+
+
+def test_split_script_prefers_turn_boundaries():
+    scripts = ["Speaker 1: One two three four five.", "Speaker 2: Six seven. Eight nine ten eleven twelve."]
+    # The second turn's first sentence would still fit after the first turn, but the whole
+    # turn fits in a window of its own, so it is moved over intact rather than split
+    windows = generator.split_script(scripts, 40)
+    assert windows == [[('1', "One two three four five.")], [('2', "Six seven. Eight nine ten eleven twelve.")]]
+
+
+def test_window_token_budget_scales_with_the_tokenized_text():
+    assert generator.window_token_budget(0) == 128
+    assert generator.window_token_budget(100) == 628
+    assert generator.window_token_budget(10000) == 4096
+
+
+def make_jobs(handler, tmp_path, names):
+    jobs = []
+    for name in names:
+        txt_path = str(tmp_path / f"{name}.txt")
+        handler.job_queue.put(txt_path)
+        jobs.append({'txt_path': txt_path, 'cache_key': 'same-script', 'metrics': handler.metrics.begin(txt_path)})
+    return jobs
+
+
+def test_duplicate_gets_a_degraded_leaders_audio(tmp_path, make_handler):
+    def generate(handler, jobs):
+        for job in jobs:
+            job['degraded'] = True
+            job['audio_seconds'] = 1.0
+            handler.write_output(job, "degraded audio")
+
+    handler = make_handler(generate)
+    leader, duplicate = make_jobs(handler, tmp_path, ["leader", "duplicate"])
+    handler.process_batch([leader, duplicate])
+    assert (tmp_path / "duplicate_generated.wav").read_text() == "degraded audio"
+    assert duplicate['metrics'].status == 'ok'
+    assert 'written' in duplicate['metrics'].marks
+
+
+def test_duplicate_is_generated_when_its_leader_was_cancelled(tmp_path, make_handler):
+    generated = []
+
+    def generate(handler, jobs):
+        generated.append([os.path.basename(job['txt_path']) for job in jobs])
+        for job in jobs:
+            if job is leader:
+                handler.job_queue.cancel(job['txt_path'])
+                job['metrics'].status = 'cancelled'
+            else:
+                handler.write_output(job, "audio")
+
+    handler = make_handler(generate)
+    leader, duplicate = make_jobs(handler, tmp_path, ["leader", "duplicate"])
+    handler.process_batch([leader, duplicate])
+    assert generated == [["leader.txt"], ["duplicate.txt"]]
+    assert (tmp_path / "duplicate_generated.wav").read_text() == "audio"
+    assert leader['metrics'].status == 'cancelled'
+    assert duplicate['metrics'].status == 'ok'
+
+
+def test_duplicate_fails_when_no_audio_can_be_produced(tmp_path, make_handler):
+    handler = make_handler(lambda handler, jobs: None)
+    leader, duplicate = make_jobs(handler, tmp_path, ["leader", "duplicate"])
+    handler.process_batch([leader, duplicate])
+    assert not (tmp_path / "duplicate_generated.wav").exists()
+    assert duplicate['metrics'].status == 'failed'
+
+
+class DeadProcess:
+    exitcode = 1
+
+    @staticmethod
+    def is_alive():
+        return False
+
+
+def test_pool_drops_cancelled_jobs_and_stops_dispatching_without_workers(tmp_path):
+    import queue
+    import threading
+    import time
+    from jobqueue import JobQueue
+
+    job_queue = JobQueue()
+    for name in ("running", "waiting"):
+        job_queue.put(str(tmp_path / f"{name}.txt"))
+    running = job_queue.get()
+    job_queue.cancel(running.txt_path)
+    pool = generator.ProcessWorkerPool(job_queue, ["cpu"], (), {}, max_restarts=0, health_interval=0.01)
+    worker = pool.workers[0]
+    worker.update(process=DeadProcess(), cancels=queue.Queue(), inflight={running.txt_path: (running, 0.0)})
+    dispatcher = threading.Thread(target=pool.dispatch, daemon=True)
+    dispatcher.start()
+    threading.Thread(target=pool.check_health, daemon=True).start()
+    dispatcher.join(5)
+    assert not dispatcher.is_alive()
+    assert worker['failed']
+    # The cancelled job was not put back, the one the dispatcher held was
+    deadline = time.monotonic() + 5
+    while job_queue.stats()['cancelled'] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert job_queue.stats()['cancelled'] == 1
+    assert [job.name for job in job_queue.pending] == ["waiting.txt"]
+
+
+def test_pool_tells_each_worker_its_share_of_the_backlog(tmp_path):
+    import queue
+    import threading
+    import time
+    from jobqueue import JobQueue
+
+    job_queue = JobQueue()
+    for i in range(5):
+        job_queue.put(str(tmp_path / f"message{i}.txt"))
+    pool = generator.ProcessWorkerPool(job_queue, ["cpu", "cpu"], (), {})
+    for worker in pool.workers:
+        worker.update(ready=True, tasks=queue.Queue())
+    threading.Thread(target=pool.dispatch, daemon=True).start()
+    deadline = time.monotonic() + 5
+    while job_queue.depth > 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    tasks = [worker['tasks'].get(timeout=5) for worker in pool.workers]
+    # Four then three files were still queued, split over two workers
+    assert sorted(task[-1] for task in tasks) == [2, 2]
+
+
+def test_quality_levels_only_discount_the_diffusion_head():
+    quality = generator.AdaptiveQuality(10, 1.3, 5.0)
+    assert quality.cost(0) == pytest.approx(1.0)
+    # 3 steps without CFG against 10 steps with it: 3 of 20 head evaluations, LM unchanged
+    assert quality.cost(3) == pytest.approx(0.6 + 0.4 * 3 / 20)
+    assert generator.AdaptiveQuality(10, 1.0, 5.0).cost(0) == pytest.approx(1.0)
+
+
+class FakeEncoder:
+    def __init__(self):
+        self.callbacks = []
+
+    def submit(self, audio, rate, output_path, on_done=None):
+        self.callbacks.append(on_done)
+
+
+def test_encoded_output_counts_as_written_once_it_is_in_place(tmp_path, make_handler):
+    handler = make_handler(lambda handler, jobs: [handler.write_output(job, "audio") for job in jobs])
+    handler.encoder = FakeEncoder()
+    job, = make_jobs(handler, tmp_path, ["message"])
+    del job['cache_key']
+    handler.process_batch([job])
+    assert not job['metrics'].finished and 'written' not in job['metrics'].marks
+    handler.encoder.callbacks[0](True)
+    assert job['metrics'].finished and 'written' in job['metrics'].marks
+    assert job['metrics'].status == 'ok'
+
+
+def test_failed_encode_is_recorded_as_failed(tmp_path, make_handler):
+    handler = make_handler(lambda handler, jobs: [handler.write_output(job, "audio") for job in jobs])
+    handler.encoder = FakeEncoder()
+    job, = make_jobs(handler, tmp_path, ["message"])
+    del job['cache_key']
+    handler.process_batch([job])
+    handler.encoder.callbacks[0](False)
+    assert job['metrics'].finished and job['metrics'].status == 'failed'
+    assert 'written' not in job['metrics'].marks
+
+
+def test_ipc_job_streams_its_audio_back_to_the_client(tmp_path, make_handler):
+    import tempfile
+    import threading
+
+    import numpy as np
+    from ipc import IPCClient, IPCServer
+    from pcm import to_s16le
+
+    handler = make_handler(lambda handler, jobs: [handler.write_output(job, audio) for job in jobs])
+    audio = np.linspace(-0.5, 0.5, handler.processor.audio_processor.sampling_rate // 2, dtype=np.float32)
+    handler.start_workers()
+
+    clips, chunks = [], []
+    ended = threading.Event()
+
+    def on_clip(clip):
+        clips.append(clip)
+        ended.set()
+
+    socket_path = os.path.join(tempfile.mkdtemp(), "generator.sock")
+    server = IPCServer(socket_path, handler.submit_ipc, handler.cancel_ipc)
+    server.start()
+    client = IPCClient(socket_path, on_clip, on_audio=lambda job_id, name, rate, channels, pcm: chunks.append(pcm))
+    try:
+        client.submit("Speaker 1: Hello there.", name="hello")
+        assert ended.wait(5)
+    finally:
+        server.close()
+    clip, = clips
+    assert (clip.name, clip.status, clip.sample_rate, clip.channels) == ("hello", "ok", 24000, 1)
+    assert b''.join(chunks) == to_s16le(audio)
+    # Nothing was written for the watchers
+    assert not list(tmp_path.glob("*_generated.wav"))
+
+
+class PromptProcessor:
+    """Counts how often the voice prompt is built from raw audio"""
+
+    class audio_processor:
+        @staticmethod
+        def _load_audio_from_path(path):
+            with open(path, encoding='utf-8') as f:
+                return f.read()
+
+    def __init__(self):
+        self.builds = []
+
+    def _create_voice_prompt(self, speaker_samples):
+        self.builds.append(list(speaker_samples))
+        return [1, 2], [sample.upper() for sample in speaker_samples], [False, True]
+
+
+def test_voice_prompts_are_built_once_per_voice_set(tmp_path):
+    voice = tmp_path / "boris.wav"
+    voice.write_text("boris")
+    processor = PromptProcessor()
+    cache = generator.VoicePromptCache(processor, "cpu")
+    assert cache.install()
+    for _ in range(2):
+        tokens, speech, masks = processor._create_voice_prompt([str(voice)])
+        assert (tokens, speech, masks) == ([1, 2], ["BORIS"], [False, True])
+        tokens.append(3)
+    # The original builder ran once, on the decoded audio rather than the path
+    assert processor.builds == [["boris"]]
+
+    voice.write_text("boris, re-recorded")
+    os.utime(voice, ns=(0, 0))
+    assert processor._create_voice_prompt([str(voice)])[1] == ["BORIS, RE-RECORDED"]
+    assert len(processor.builds) == 2
+
+
+class RecordingHandler:
+    def __init__(self):
+        self.finished = {}
+
+    def finish_metrics(self, job, status=None):
+        self.finished[os.path.basename(job['txt_path'])] = status
+
+
+def test_batch_scheduler_drops_held_jobs_cancelled_or_expired_while_waiting(tmp_path):
+    from jobqueue import JobQueue
+
+    job_queue = JobQueue()
+    handler = RecordingHandler()
+    scheduler = generator.BatchScheduler(handler, job_queue, max_batch=4, max_wait_ms=0)
+    for name in ("a", "b", "c"):
+        job_queue.put(str(tmp_path / f"{name}.txt"))
+    for _ in range(3):
+        job = job_queue.get(0)
+        scheduler.held.append({'txt_path': job.txt_path, 'script': "Hello there.",
+                               'speaker_paths': ["boris.wav"], 'job': job})
+    job_queue.cancel(str(tmp_path / "b.txt"))
+    scheduler.held[2]['job'].deadline = 0
+    batch = scheduler.take_batch()
+    assert [os.path.basename(prepared['txt_path']) for prepared in batch] == ["a.txt"]
+    assert handler.finished == {"b.txt": 'cancelled', "c.txt": 'expired'}
+    stats = job_queue.stats()
+    assert (stats['cancelled'], stats['expired']) == (1, 1)
+
+
+def take_jobs(handler, tmp_path, names):
+    """Prepared jobs the way a pipeline stage holds them, already taken off the queue"""
+    jobs = make_jobs(handler, tmp_path, names)
+    for job in jobs:
+        del job['cache_key']
+        job['job'] = handler.job_queue.get(0)
+    return jobs
+
+
+def wait_for_finished(job_queue, count):
+    import time
+
+    deadline = time.monotonic() + 5
+    while True:
+        stats = job_queue.stats()
+        if stats['completed'] + stats['cancelled'] + stats['expired'] >= count or time.monotonic() > deadline:
+            return stats
+        time.sleep(0.01)
+
+
+def test_pipeline_drops_jobs_cancelled_or_expired_before_generating(tmp_path, make_handler):
+    import threading
+
+    generated = []
+    handler = make_handler(lambda handler, jobs: generated.extend(os.path.basename(job['txt_path']) for job in jobs))
+    executor = generator.PipelinedExecutor(handler, handler.job_queue)
+    jobs = take_jobs(handler, tmp_path, ["a", "b", "c"])
+    handler.job_queue.cancel(jobs[1]['txt_path'])
+    jobs[2]['job'].deadline = 0
+    threading.Thread(target=executor.generate_loop, daemon=True).start()
+    for job in jobs:
+        executor.prepared.put(job)
+    stats = wait_for_finished(handler.job_queue, 3)
+    assert generated == ["a.txt"]
+    assert (stats['completed'], stats['cancelled'], stats['expired']) == (1, 1, 1)
+    assert [job['metrics'].status for job in jobs] == ['ok', 'cancelled', 'expired']
+
+
+def test_pipeline_drops_audio_of_jobs_cancelled_before_writing(tmp_path, make_handler):
+    import threading
+
+    handler = make_handler(lambda handler, jobs: None)
+    executor = generator.PipelinedExecutor(handler, handler.job_queue)
+    kept, cancelled = take_jobs(handler, tmp_path, ["kept", "cancelled"])
+    handler.job_queue.cancel(cancelled['txt_path'])
+    threading.Thread(target=executor.write_loop, daemon=True).start()
+    for job in (kept, cancelled):
+        executor.submit(job, "audio")
+    stats = wait_for_finished(handler.job_queue, 2)
+    assert (stats['completed'], stats['cancelled']) == (1, 1)
+    assert (tmp_path / "kept_generated.wav").exists()
+    assert not (tmp_path / "cancelled_generated.wav").exists()
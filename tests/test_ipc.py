@@ -0,0 +1,147 @@
+import io
+import math
+import os
+import tempfile
+import threading
+import time
+import wave
+from array import array
+
+import pytest
+
+from ipc import MAX_PAYLOAD, IPCClient, IPCServer
+
+SAMPLE_RATE = 24000
+
+
+class StubSynthesizer:
+    """Stands in for a generator: 0.1s of tone per word, sent in 20ms chunks"""
+
+    def __init__(self):
+        self.cancelled = set()
+        # When the last chunk of each job was sent
+        self.last_write = {}
+
+    def submit(self, job_id, script, priority, sink):
+        if not script.strip():
+            return False
+        threading.Thread(target=self.synthesize, args=(job_id, script, sink), daemon=True).start()
+        return True
+
+    def synthesize(self, job_id, script, sink):
+        sink.start(SAMPLE_RATE, 1)
+        samples = tone(0.1 * len(script.split()))
+        frame = SAMPLE_RATE // 50
+        for offset in range(0, len(samples), frame):
+            if job_id in self.cancelled:
+                sink.end('cancelled')
+                return
+            sink.write(samples[offset:offset + frame].tobytes())
+            time.sleep(0.001)
+        self.last_write[job_id] = time.monotonic()
+        sink.end('ok')
+
+
+def tone(seconds):
+    return array('h', (int(8000 * math.sin(2 * math.pi * 440 * i / SAMPLE_RATE))
+                       for i in range(int(seconds * SAMPLE_RATE))))
+
+
+class Collector:
+    def __init__(self):
+        self.clips = {}
+        self.chunks = {}
+        self.cond = threading.Condition()
+
+    def on_clip(self, clip):
+        with self.cond:
+            self.clips[clip.name] = clip
+            self.cond.notify_all()
+
+    def on_audio(self, job_id, name, rate, channels, pcm):
+        self.chunks.setdefault(job_id, []).append((time.monotonic(), len(pcm)))
+
+    def wait(self, count):
+        with self.cond:
+            assert self.cond.wait_for(lambda: len(self.clips) >= count, timeout=10), sorted(self.clips)
+        return self.clips
+
+
+@pytest.fixture
+def serve():
+    """serve(submit, cancel) starts an IPCServer on a fresh socket and returns its path"""
+    servers = []
+
+    def start(submit, cancel=None):
+        socket_path = os.path.join(tempfile.mkdtemp(), "generator.sock")
+        server = IPCServer(socket_path, submit, cancel)
+        server.start()
+        servers.append(server)
+        return socket_path
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def test_whole_clips_come_back_with_all_their_audio(serve):
+    socket_path = serve(StubSynthesizer().submit)
+    collector = Collector()
+    client = IPCClient(socket_path, collector.on_clip)
+    client.submit("Speaker 1: one two three four five", name="five")
+    client.submit("Speaker 1: hello", name="one")
+    clips = collector.wait(2)
+    # "Speaker 1:" counts as two words
+    assert clips['five'].status == 'ok' and clips['five'].duration == pytest.approx(0.7)
+    assert clips['one'].status == 'ok' and clips['one'].duration == pytest.approx(0.3)
+    with wave.open(io.BytesIO(clips['five'].to_wav())) as wav:
+        assert wav.getnframes() == int(0.7 * SAMPLE_RATE) and wav.getframerate() == SAMPLE_RATE
+
+
+def test_rejected_job_hands_its_script_back(serve):
+    socket_path = serve(StubSynthesizer().submit)
+    collector = Collector()
+    IPCClient(socket_path, collector.on_clip).submit("   ", name="empty")
+    clip = collector.wait(1)['empty']
+    assert (clip.status, clip.script, clip.duration) == ('rejected', "   ", 0.0)
+
+
+def test_streamed_audio_arrives_while_the_job_is_generating(serve):
+    synthesizer = StubSynthesizer()
+    collector = Collector()
+    client = IPCClient(serve(synthesizer.submit), collector.on_clip, collector.on_audio)
+    job_id = client.submit("Speaker 1: " + "word " * 20, name="stream")
+    clip = collector.wait(1)['stream']
+    assert clip.status == 'ok' and not clip.pcm
+    assert clip.duration == pytest.approx(2.2)
+    assert sum(size for _, size in collector.chunks[job_id]) == int(2.2 * SAMPLE_RATE) * 2
+    assert collector.chunks[job_id][0][0] < synthesizer.last_write[job_id]
+
+
+def test_cancel_stops_a_job_early(serve):
+    synthesizer = StubSynthesizer()
+    collector = Collector()
+    client = IPCClient(serve(synthesizer.submit, synthesizer.cancelled.add), collector.on_clip, collector.on_audio)
+    job_id = client.submit("Speaker 1: " + "word " * 200, name="long")
+    client.cancel(job_id)
+    clip = collector.wait(1)['long']
+    # 20.2s of audio had it run to the end
+    assert clip.status == 'cancelled' and clip.duration < 10
+
+
+def test_a_whole_clip_written_at_once_is_sent_in_bounded_frames(serve):
+    samples = tone(3.0)
+
+    def submit(job_id, script, priority, sink):
+        sink.start(SAMPLE_RATE, 1)
+        sink.write(samples.tobytes())
+        sink.end('ok')
+        return True
+
+    collector = Collector()
+    client = IPCClient(serve(submit), collector.on_clip, collector.on_audio)
+    job_id = client.submit("Speaker 1: hello", name="whole")
+    assert collector.wait(1)['whole'].duration == pytest.approx(3.0)
+    sizes = [size for _, size in collector.chunks[job_id]]
+    assert sum(sizes) == len(samples) * 2
+    assert len(sizes) > 1 and max(sizes) <= MAX_PAYLOAD
@@ -0,0 +1,39 @@
+import os
+import time
+
+import pytest
+
+pytest.importorskip("watchdog")
+
+from jobqueue import JobQueue
+
+
+def read_ledger(path):
+    with open(path, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def test_ipc_jobs_stay_out_of_the_ledger(tmp_path):
+    ledger = tmp_path / ".generated"
+    job_queue = JobQueue(ledger_path=str(ledger))
+    job_queue.put(str(tmp_path / "ipc_abc.txt"), ledger=False)
+    job_queue.put(str(tmp_path / "message.txt"))
+    for _ in range(2):
+        job_queue.done(job_queue.get())
+    assert read_ledger(ledger) == ["message.txt"]
+
+
+def test_scan_compacts_the_ledger(tmp_path):
+    ledger = tmp_path / ".generated"
+    for name in ("fresh.txt", "stale.txt", "new.txt"):
+        (tmp_path / name).write_text("Speaker 1: hi\n")
+    old = time.time() - 3600
+    os.utime(tmp_path / "stale.txt", (old, old))
+    ledger.write_text("fresh.txt\nstale.txt\ndeleted.txt\nfresh.txt\n")
+
+    job_queue = JobQueue(ledger_path=str(ledger))
+    job_queue.scan(str(tmp_path), max_age=600)
+
+    assert read_ledger(ledger) == ["fresh.txt"]
+    assert job_queue.get(timeout=0).name == "new.txt"
+    assert job_queue.get(timeout=0) is None
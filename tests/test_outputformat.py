@@ -0,0 +1,44 @@
+import struct
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from outputformat import ogg_crc, read_opus_packets, write_ogg_opus
+from pcm import FRAME_SAMPLES
+
+
+def ogg_pages(data):
+    """(granule, flags, page bytes) of every page in an Ogg stream"""
+    pages, pos = [], 0
+    while pos < len(data):
+        _, _, flags, granule = struct.unpack_from('<4sBBq', data, pos)
+        count = data[pos + 26]
+        end = pos + 27 + count + sum(data[pos + 27:pos + 27 + count])
+        pages.append((granule, flags, data[pos:end]))
+        pos = end
+    return pages
+
+
+@pytest.mark.parametrize("sizes", [[3], [254, 255, 256, 600], [10] * 7])
+def test_ogg_opus_round_trips_packets_of_any_size(tmp_path, sizes):
+    packets = [bytes([i % 256]) * size for i, size in enumerate(sizes)]
+    path = tmp_path / "clip.opus"
+    write_ogg_opus(str(path), packets, len(packets) * FRAME_SAMPLES, 312, packets_per_page=3)
+    assert read_opus_packets(str(path)) == packets
+
+
+def test_ogg_opus_pages_carry_the_pre_skip_and_the_real_length(tmp_path):
+    path = tmp_path / "clip.opus"
+    # An odd length: the last 20 ms packet is mostly padding
+    samples = 4 * FRAME_SAMPLES + 17
+    write_ogg_opus(str(path), [b'\x01'] * 5, samples, 120, packets_per_page=2)
+    data = path.read_bytes()
+    assert struct.unpack_from('<H', data, data.index(b'OpusHead') + 10) == (120,)
+    pages = ogg_pages(data)
+    assert [granule for granule, _, _ in pages] == [0, 0, 120 + 2 * FRAME_SAMPLES, 120 + 4 * FRAME_SAMPLES,
+                                                    120 + samples]
+    assert pages[0][1] == 0x02 and pages[-1][1] == 0x04
+    for _, _, page in pages:
+        blank = page[:22] + bytes(4) + page[26:]
+        assert struct.unpack_from('<I', page, 22) == (ogg_crc(blank),)
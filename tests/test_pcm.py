@@ -0,0 +1,46 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from pcm import StreamResampler, resample
+
+
+@pytest.mark.parametrize("src_rate, dst_rate", [(24000, 48000), (22050, 48000), (48000, 24000)])
+def test_stream_resampler_matches_resampling_the_whole_clip(src_rate, dst_rate):
+    audio = np.random.default_rng(0).uniform(-1, 1, (10007, 2)).astype(np.float32)
+    resampler = StreamResampler(src_rate, dst_rate, 2)
+    pieces, start = [], 0
+    for size in (1, 7, 480, 2000, 3, 4000):
+        pieces.append(resampler.feed(audio[start:start + size]))
+        start += size
+    pieces.append(resampler.feed(audio[start:], final=True))
+    np.testing.assert_array_equal(np.concatenate(pieces), resample(audio, src_rate, dst_rate))
+
+
+@pytest.mark.parametrize("length", [1, 2, 5, 33, 97, 1001])
+@pytest.mark.parametrize("src_rate, dst_rate", [(24000, 48000), (22050, 48000), (48000, 24000)])
+def test_stream_resampler_handles_odd_lengths_fed_a_sample_at_a_time(length, src_rate, dst_rate):
+    audio = np.random.default_rng(length).uniform(-1, 1, (length, 1)).astype(np.float32)
+    resampler = StreamResampler(src_rate, dst_rate, 1)
+    pieces = [resampler.feed(audio[i:i + 1]) for i in range(length)]
+    pieces.append(resampler.feed(audio[:0], final=True))
+    streamed = np.concatenate(pieces)
+    assert len(streamed) == length * dst_rate // src_rate
+    np.testing.assert_array_equal(streamed, resample(audio, src_rate, dst_rate))
+
+
+def test_stream_resampler_ignores_empty_feeds_mid_stream():
+    audio = np.random.default_rng(1).uniform(-1, 1, (4801, 2)).astype(np.float32)
+    resampler = StreamResampler(24000, 48000, 2)
+    pieces = []
+    for start, end in ((0, 0), (0, 1200), (1200, 1200), (1200, 3001), (3001, 3001)):
+        pieces.append(resampler.feed(audio[start:end]))
+    pieces.append(resampler.feed(audio[3001:], final=True))
+    np.testing.assert_array_equal(np.concatenate(pieces), resample(audio, 24000, 48000))
+
+
+def test_stream_resampler_passes_audio_at_the_target_rate_through():
+    audio = np.ones((7, 2), dtype=np.float32)
+    resampler = StreamResampler(48000, 48000, 2)
+    assert resampler.passthrough
+    assert resampler.feed(audio) is audio
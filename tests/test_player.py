@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+import wave
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("watchdog")
+
+import player
+from pcm import write_s16le_wav
+
+
+def test_pulse_output_closes_quietly_after_paplay_exited():
+    output = player.PulseOutput(44100, 1)
+    output.proc = subprocess.Popen([sys.executable, '-c', 'pass'], stdin=subprocess.PIPE)
+    output.proc.wait()
+    # Still in the pipe's buffer, so close() has to flush it to a process that is gone
+    output.proc.stdin.write(b'\0' * 64)
+    output.close()
+    assert output.proc is None
+
+
+def test_file_output_gets_every_clip_with_its_padding(tmp_path):
+    clips = []
+    for name, seconds in (("one", 0.5), ("two", 0.25)):
+        path = tmp_path / f"{name}.wav"
+        write_s16le_wav(str(path), bytes(int(seconds * 8000) * 2), rate=8000, channels=1)
+        clips.append(str(path))
+    out = tmp_path / "out.wav"
+    player.main(clips, str(tmp_path), output_path=str(out), rate=8000, channels=1, pre_pad=0.1, post_pad=0.2,
+                gap=0.05)
+    with wave.open(str(out)) as wav:
+        assert (wav.getframerate(), wav.getnchannels()) == (8000, 1)
+        assert wav.getnframes() == int((0.5 + 0.25 + 2 * (0.1 + 0.2 + 0.05)) * 8000)
+    # Files given by name are kept
+    assert all(os.path.exists(path) for path in clips)
@@ -0,0 +1,96 @@
+import os
+import types
+
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("cosyvoice")
+
+from backends import load_script
+
+generator = load_script("generator-cosyvoice.py")
+SpeakerStore = generator.SpeakerStore
+
+
+def test_save_keeps_speakers_that_share_a_name_prefix(tmp_path):
+    wav = tmp_path / "voice.wav"
+    wav.write_bytes(b"RIFF fake wav")
+    store = SpeakerStore(str(tmp_path / "spk_cache"))
+    old_key = SpeakerStore.key_for(str(wav), "old prompt")
+    new_key = SpeakerStore.key_for(str(wav), "new prompt")
+
+    store.save("sou-hype", old_key, {'embedding': [1.0]})
+    store.save("sou", old_key, {'embedding': [2.0]})
+    store.save("sou", new_key, {'embedding': [3.0]})
+
+    assert store.load("sou-hype", old_key, "cpu") == {'embedding': [1.0]}
+    assert store.load("sou", new_key, "cpu") == {'embedding': [3.0]}
+    assert store.load("sou", old_key, "cpu") is None
+    assert len(store.entries_for("sou")) == 1
+
+
+class FakeModel:
+    """Stands in for CosyVoice's AutoModel, registering a numbered prompt per call"""
+
+    def __init__(self, model_dir=None, fp16=True):
+        self.frontend = types.SimpleNamespace(spk2info={}, device="cpu")
+        self.registered = []
+
+    def add_zero_shot_spk(self, ref_text, wav_path, spk_name):
+        self.registered.append(spk_name)
+        self.frontend.spk2info[spk_name] = {'embedding': [len(self.registered)]}
+
+
+class FakeVoiceMapper:
+    def __init__(self, voices_dir):
+        self.voice_presets = {name: str(voices_dir / f"{name}.wav") for name in ("boris", "ken")}
+
+    def get_voice_info(self, speaker_name):
+        return self.voice_presets[speaker_name], "Reference text."
+
+
+def make_handler(tmp_path, monkeypatch):
+    """A CosyVoice TxtFileHandler on FakeModel, with boris already in its speaker store"""
+    voices_dir = tmp_path / "voices"
+    voices_dir.mkdir()
+    for name in ("boris", "ken"):
+        (voices_dir / f"{name}.wav").write_bytes(f"RIFF {name}".encode())
+    store = SpeakerStore(str(tmp_path / "spk_cache"))
+    store.save("boris", SpeakerStore.key_for(str(voices_dir / "boris.wav"), generator.prompt_text_for("Reference text.")),
+               {'embedding': [0]})
+    monkeypatch.setattr(generator, "AutoModel", FakeModel)
+    monkeypatch.setattr(generator, "VoiceMapper", lambda: FakeVoiceMapper(voices_dir))
+    return generator.TxtFileHandler("model", ["boris", "ken"], str(tmp_path), "cpu", spk_store_dir=store.store_dir)
+
+
+def test_stored_speakers_load_at_startup_and_changed_voices_register_again(tmp_path, monkeypatch):
+    handler = make_handler(tmp_path, monkeypatch)
+    voices_dir = tmp_path / "voices"
+    store = handler.spk_store
+    spk2info = handler.model.frontend.spk2info
+    assert spk2info == {"boris": {'embedding': [0]}}
+
+    handler.ensure_speaker("boris")
+    handler.ensure_speaker("ken")
+    assert handler.model.registered == ["ken"]
+
+    wav = voices_dir / "boris.wav"
+    wav.write_bytes(b"RIFF boris, recut")
+    mtime = os.path.getmtime(wav) + 10
+    os.utime(wav, (mtime, mtime))
+    handler.ensure_speaker("boris")
+    handler.ensure_speaker("ken")
+    assert handler.model.registered == ["ken", "boris"]
+    assert spk2info["boris"] == {'embedding': [2]}
+    assert len(store.entries_for("boris")) == 1
+
+
+def test_offloading_drops_registered_speakers_until_they_are_used_again(tmp_path, monkeypatch):
+    handler = make_handler(tmp_path, monkeypatch)
+    handler.ensure_speaker("ken")
+    handler.drop_speakers()
+    assert handler.model.frontend.spk2info == {}
+    handler.ensure_speaker("ken")
+    # Back from the store, not registered with the model a second time
+    assert handler.model.registered == ["ken"]
+    assert handler.model.frontend.spk2info == {"ken": {'embedding': [1]}}